@@ -2,18 +2,20 @@
 entrypoint for real time scorekeeping game. an input with 2 channels is required to use this program.
 """
 from multiprocessing import Value
-import numpy as np
-from scipy import signal
 import threading
-import time
-import wave
 
 from pingpong_game.config import config
+from pingpong_game.dsp_process import DspFrontEnd
+from pingpong_game.event_log import EventLog
 from pingpong_game.game import Game
-from pingpong_game.state_machine import StartState,GameState
+from pingpong_game.recording import get_recorder
+from pingpong_game.remote_mic import RemoteSignal, RemoteSignalCapture, accept_node, listen
+from pingpong_game.score_server import ScoreServer
 from pingpong_game.scoreboard import Scoreboard
-from pingpong_game.sig.signal_capture import SignalCapture
-from pingpong_game.sig.signal_tools import StreamSignal, get_pingpong_filter
+from pingpong_game.sig.kernels import warm_up
+from pingpong_game.sig.multirate import get_signal_capture
+from pingpong_game.sig.signal_capture import get_capture_gate
+from pingpong_game.sig.signal_tools import PingPongFilter, StreamSignal
 
 
 # set up global settings using the config file
@@ -26,21 +28,18 @@ MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
 filter_low_thresh = config["filter_low_thresh"]
 filter_high_thresh = config["filter_high_thresh"]
 K = 6
-[b,a] = get_pingpong_filter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
-lch_states = np.zeros(K*2)
-rch_states = np.zeros(K*2)
 
 SERVE_TIMEOUT = config["serve_timeout"]
 GAME_EVENT_TIMEOUT = config["game_event_timeout"]
 POST_SCORING_TIMEOUT = config["post_scoring_timeout"]
 
 
-def audio_thread_func(sig, sig_cap, quit_, pause, output_file):
+def audio_thread_func(sig, sig_cap, quit_, pause, recorder, filt):
     '''
-    read next audio block and process via the SignalCapture class
+    read next audio block, filter it using the stateful bandpass filter and process via the SignalCapture class.
+    with the multirate front end filt is None, the signal capture object takes the unfiltered signal.
+    each block is handed to the recorder, marked active if a sound was being captured or finished in it
     '''
-    global lch_states, rch_states
-
     # keep track of current index in a given channel of the audio stream
     # used for identifying the frame boundaries of a captured sound - mainly helpful for debugging
     audio_idx = 0
@@ -56,19 +55,21 @@ def audio_thread_func(sig, sig_cap, quit_, pause, output_file):
         # multiply right channel by calculated / preconfigured polarity
         rch = data[1::2] * config["polarity"]
         # filter each channel to only detect relevant frequency band
-        [lch, lch_states] = signal.lfilter(b,a,lch,zi=lch_states)
-        [rch, rch_states] = signal.lfilter(b,a,rch,zi=rch_states)
+        if filt is not None:
+            [lch, rch] = filt.filter(lch, rch)
 
         # process segment to check if high power in signal
         # the signal capture class uses condition.notify to let the game
         # engine know if a ping-pong sound was detected
         sig_cap.condition.acquire()
+        n_detected = sig_cap.n_captures + sig_cap.n_rejected
         sig_cap.process(lch, rch, frame_offset=audio_idx)
+        active = sig_cap.is_capturing or (sig_cap.n_captures + sig_cap.n_rejected != n_detected)
         sig_cap.condition.release()
-        # we are tracking frame index so just offset by block length
-        audio_idx += BLOCK_LEN
+        # we are tracking frame index so just offset by the number of frames read
+        audio_idx += len(lch)
         # write captured signal to file for post-processing, testing, validating
-        output_file.writeframesraw(data.tobytes())
+        recorder.write(data, active)
 
 
 def game_event_thread(game):
@@ -85,11 +86,12 @@ def game_event_thread(game):
             post_scoring_state = game.scoreboard.update_score(game.current_state)
             # exit loop if game over
             if post_scoring_state.state_name == "EndState":
+                game.current_state = post_scoring_state
                 break
             #ignore any sounds for small period of time after a player has scored
             game.scoreboard.pause.value = 1
             game.sig_cap.clear_captures()
-            time.sleep(POST_SCORING_TIMEOUT)
+            game.clock.sleep(POST_SCORING_TIMEOUT)
             game.scoreboard.pause.value = 0
             # wait for the next serve
             event = game.wait_for_game_event(SERVE_TIMEOUT)
@@ -99,24 +101,28 @@ def game_event_thread(game):
         else:
             # wait for next in-game event, i.e. a ping-pong related sound
             event = game.wait_for_game_event(GAME_EVENT_TIMEOUT)
+        # pause or quit was pressed while waiting, there is no event and the loop condition ends the thread
+        if event is None:
+            break
         # transition to next game state based on current state and current event
         game.current_state = game.game_state.transition(game.current_state, event)
 
 
-def game_engine_thread(game):
+def game_engine_thread(game, score_server=None):
     """
     initialized the game. after players are identified and game state is initialized,
     start the game event thread while updating the scoreboard and checking for pause/quit events
     after the game is over, write a message to the user indicating the outcome of the game
+    if a score server is given, the state of the game is published to it along with the scoreboard updates
     """
     # do this in thread
     game.identify_players()
     # set up a gamestate object to keep track of the current game
-    game.game_state = GameState(game.p1, game.p2)
+    game.new_game()
     game.scoreboard.message(f"begin game when ready, {game.p1} serves")
     game.scoreboard.root.update()
     # initialize state
-    game.current_state = StartState(game.p1)
+    game.set_start_state(game.p1)
 
     # start game event thread which listens for incoming events
     game_thread = threading.Thread(target=game_event_thread, args=(game,))
@@ -131,6 +137,9 @@ def game_engine_thread(game):
         game.scoreboard.p1_score_var.set(p1_score)
         game.scoreboard.p2_score_var.set(p2_score)
         game.scoreboard.root.update()
+        # the server drops snapshots that haven't changed, so this only sends something on a change
+        if score_server is not None:
+            score_server.publish(game.get_snapshot())
         if game.scoreboard.pause.value == 1:
             # send notification to game even thread which will cause 
             # it to drop out of its loop, then we wait for the resume button to be pressed
@@ -144,7 +153,7 @@ def game_engine_thread(game):
             # after game is un-paused, treat the state is if starting a game,
             # though the score will remain unchanged from before
             serving = game.scoreboard.serving
-            game.current_state = StartState(serving)
+            game.set_start_state(serving)
             game_thread = threading.Thread(target=game_event_thread, args=(game,))
             game_thread.start()
 
@@ -160,6 +169,8 @@ def game_engine_thread(game):
 
     # wait for event processing thread to finish then handle end game state
     game_thread.join()
+    if score_server is not None:
+        score_server.publish(game.get_snapshot())
 
     # handle various end-game states by sending relevant messages to the user
     if game.current_state.state_name == "ErrorState":
@@ -177,22 +188,50 @@ def game_engine_thread(game):
     game.scoreboard.root.update()
 
 
-def main(fname):
+def main(fname, log_fname):
+    # compile the capture and beamformer kernels before the first block arrives, see sig/kernels.py
+    warm_up()
     quit_ = Value('i', 0)
     # pause is used in this case to turn off signal captures, it is used
     # when getting input from the user, in which case we don't want to do anything
     # with incoming signals
     pause = Value('i', 0)
+    # everything that happens in the game is written to an event log for going over points afterwards
+    # see event_log.py for replaying it
+    event_log = EventLog(log_fname)
     # save incoming signal for replaying after game - useful for testing
-    output_file = wave.open(fname, "wb")
-    output_file.setnchannels(2)
-    output_file.setsampwidth(2)
-    output_file.setframerate(Fs)
+    # config["recording_mode"] selects the whole session, only the audio around sounds or the whole session in
+    # segment files indexed by the event log's game time, see recording.py
+    recorder = get_recorder(fname, Fs, clock=event_log.now)
 
-    # set up an input audio stream signal and a signal capture object
-    # the signal capture class is responsible for detecting high-power audio events
-    sig = StreamSignal(frames_per_buffer=5*256)
-    sig_cap = SignalCapture(SIG_CAP_WINDOW_LEN, SIG_CAP_POWER, MAX_SIG_BUFFER_LEN)
+    # with config["dsp_process"] the audio is read, filtered and captured in a separate process, which also
+    # provides the pause and quit flags and a stand in for the signal capture object, see dsp_process.py
+    dsp = None
+    # with config["remote_mic_port"] the microphones are on a node which connects over tcp, see remote_mic.py.
+    # a raw mode node replaces the audio device, a captures mode node replaces the audio thread altogether
+    remote = None
+    if config["dsp_process"]:
+        dsp = DspFrontEnd(recorder)
+        [pause, quit_] = [dsp.pause, dsp.quit]
+        sig_cap = dsp.sig_cap
+    elif config["remote_mic_port"] is not None:
+        print(f"waiting for a microphone node on port {config['remote_mic_port']}")
+        listener = listen(config["remote_mic_port"])
+        node = accept_node(listener)
+        listener.close()
+        if node.mode == "captures":
+            remote = RemoteSignalCapture(node, pause, gate=get_capture_gate())
+            sig_cap = remote
+        else:
+            sig = RemoteSignal(node)
+            sig_cap = get_signal_capture(Fs)
+    else:
+        # set up an input audio stream signal and a signal capture object
+        # the signal capture class is responsible for detecting high-power audio events
+        sig = StreamSignal(frames_per_buffer=5*256)
+        # captures that fail the configured gate are dropped before they reach the game
+        # config["front_end"] selects full rate or multirate detection, see sig/multirate.py
+        sig_cap = get_signal_capture(Fs)
 
     # initialize the scoreboard - this is the tk interface
     sb = Scoreboard()
@@ -200,23 +239,47 @@ def main(fname):
     sb.init_tk(pause, quit_)
     # initialize a new game object, passing the signal capture object (which sends events to the game)
     # and the scoreboard object, which is used to interact with the players
-    game = Game(sig_cap, sb)
+    game = Game(sig_cap, sb, event_log=event_log)
+    # optionally publish the score to spectator displays over http, see score_server.py
+    score_server = None
+    if config["score_server_enabled"]:
+        score_server = ScoreServer().start()
+        print(f"publishing score on http://{score_server.host}:{score_server.port}/")
 
     # start the audio processing thread - this listens to the audio and passed the signal to the signal capture object
-    audio_thread = threading.Thread(
-        target=audio_thread_func,
-        args=(sig, sig_cap, quit_, pause, output_file),
-    )
-    audio_thread.start()
+    # the filter is designed here instead of at import so that importing this module stays cheap
+    if dsp is not None:
+        dsp.start()
+    elif remote is not None:
+        # only the captures are sent, so there is nothing to record
+        remote.start()
+    else:
+        filt = None
+        if config["front_end"] == "full":
+            filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
+        audio_thread = threading.Thread(
+            target=audio_thread_func,
+            args=(sig, sig_cap, quit_, pause, recorder, filt),
+        )
+        audio_thread.start()
     # run the main game loop
-    game_engine_thread(game)
-    # after the game has ended, wait for the audio thread and close up any open files
-    audio_thread.join()
-    sig.close()
-    output_file.close()
+    game_engine_thread(game, score_server)
+    # after the game has ended, wait for the audio thread (or the dsp process) and close up any open files
+    if dsp is not None:
+        dsp.stop()
+    elif remote is not None:
+        remote.stop()
+    else:
+        audio_thread.join()
+        sig.close()
+    recorder.close()
+    event_log.close()
+    if score_server is not None:
+        score_server.stop()
 
 
 if __name__ == "__main__":
-    # update this filename if you want to save the output for testing
+    # update these filenames if you want to save the output for testing
     fname = "game-output.wav"
-    main(fname)
+    log_fname = "game-log.jsonl"
+    main(fname, log_fname)
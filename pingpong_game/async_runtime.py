@@ -0,0 +1,361 @@
+'''
+    asyncio runtime for the capture -> game pipeline. the threaded game (__main__.py, multi_table.py) links the
+    audio thread and the game threads through the condition variable of each SignalCapture object, which is
+    also used to wake the game thread for quit and pause. here everything runs as tasks on one event loop:
+
+        audio callback      pushes each block of samples onto a bounded asyncio queue from the audio device's
+                            thread. if the queue is full the block is dropped and counted
+        detection task      hands each block to a single detection thread (an executor), which filters it and
+                            runs each table's SignalCapture over its channels. the finished captures are put on
+                            each table's capture queue back on the loop
+        table tasks         one per table, awaits the next capture (or a timeout) and passes the resulting game
+                            event through the state machine. the delay estimation is run on a process pool
+
+    the cpu heavy work (filtering, capture detection and delay estimation) is all done off the loop, so with many
+    tables the timeouts and the score server aren't held up by it. the signal captures are only ever touched by
+    the detection thread, one block at a time, so no locks or notifications are needed, there are no flags to
+    race on, and quitting is just cancelling the tasks. this makes several tables plus network outputs (e.g. the
+    score server) practical in one process. like multi-table mode there is no gui, player sides come from the
+    config file and each table writes an event log.
+
+    a recording can be played through the runtime in real time instead of using the audio device, e.g. to try it
+    out without microphones: python -m pingpong_game.async_runtime --file game-output.wav
+
+    usage: python -m pingpong_game.async_runtime [n_channels] [--file recording.wav]
+'''
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+from multiprocessing import Value
+import signal
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.event_log import EventLog
+from pingpong_game.game import Game
+from pingpong_game.score_server import ScoreServer
+from pingpong_game.scoreboard import Scoreboard
+from pingpong_game.sig.kernels import warm_up
+from pingpong_game.sig.multirate import get_demodulator, get_signal_capture
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter, StreamSignal, estimate_delay_at_onset
+
+
+Fs = config["fs"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_POWER = config["sig_cap_power"]
+MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
+DELAY_MAX = config["delay_max"]
+filter_low_thresh = config["filter_low_thresh"]
+filter_high_thresh = config["filter_high_thresh"]
+K = 6
+
+SERVE_TIMEOUT = config["serve_timeout"]
+GAME_EVENT_TIMEOUT = config["game_event_timeout"]
+POST_SCORING_TIMEOUT = config["post_scoring_timeout"]
+BLOCK_QUEUE_LEN = config["async_block_queue_len"]
+
+log = logging.getLogger()
+
+
+class AsyncTable:
+    '''
+    signal capture, scoreboard and game for one table, fed by channels 2*idx (left) and 2*idx+1 (right).
+    captures are handed to the game through an asyncio queue instead of the signal capture's condition.
+    process runs on the detection thread, everything else on the loop
+    '''
+    def __init__(self, idx, executor=None, event_log=None, score_server=None):
+        self.idx = idx
+        self.executor = executor
+        self.score_server = score_server
+        self.sig_cap = get_signal_capture(Fs, use_lock=False)
+        self.captures = asyncio.Queue()
+        # the scoreboard is only used for its scorekeeping logic, there is no tk interface
+        self.scoreboard = Scoreboard()
+        self.scoreboard.pause = Value('i', 0)
+        self.scoreboard.quit = Value('i', 0)
+        self.game = Game(self.sig_cap, self.scoreboard, event_log=event_log)
+        self.game.p1.name = f"table {idx} player one"
+        self.game.p2.name = f"table {idx} player two"
+        self.game.p1.position = config["multi_table_p1_position"]
+        self.game.p2.position = config["multi_table_p2_position"]
+        self.event_log = event_log
+        # frame index up to which audio has been delivered, captures that ended before clear_after are dropped
+        self.frame_idx = 0
+        self.clear_after = 0
+
+    def process(self, lch, rch, frame_offset, envelope=None):
+        '''
+        run the next filtered block of this table's channels through its signal capture object and return the
+        captures it finished. envelope is given with the multirate front end. runs on the detection thread
+        '''
+        if envelope is None:
+            self.sig_cap.process(lch, rch, frame_offset=frame_offset)
+        else:
+            self.sig_cap.process(lch, rch, frame_offset=frame_offset, envelope=envelope)
+        caps = []
+        while self.sig_cap.capture_ready:
+            caps.append(self.sig_cap.get_next_capture())
+        return caps
+
+    def deliver(self, caps, frame_idx):
+        '''
+        queue the captures finished in a block of audio ending at frame_idx for the game
+        '''
+        self.frame_idx = frame_idx
+        for cap in caps:
+            if cap[-1][1] > self.clear_after:
+                self.captures.put_nowait(cap)
+
+    def clear_captures(self):
+        '''
+        drop every capture that has ended so far. the signal capture belongs to the detection thread, so
+        instead of clearing it captures that end before this point are dropped when they are delivered
+        '''
+        self.clear_after = self.frame_idx
+        while not self.captures.empty():
+            self.captures.get_nowait()
+
+    def publish(self):
+        '''
+        send the state of this table's game to the score server, if there is one
+        '''
+        if self.score_server is not None:
+            self.score_server.publish(self.game.get_snapshot(), key=f"table-{self.idx:02}")
+
+    async def wait_for_sound(self, timeout):
+        '''
+        wait for the next valid capture, returns None if there is none within timeout seconds
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if not self.captures.empty():
+                signal_cap = self.captures.get_nowait()
+            else:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    signal_cap = await asyncio.wait_for(self.captures.get(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+            # captures are normally already gated by the signal capture, without a gate the game checks them.
+            # rejected captures count against the timeout, same as the threaded game
+            if self.game.check_capture(signal_cap):
+                return signal_cap
+
+    async def wait_for_game_event(self, timeout):
+        '''
+        asyncio version of Game.wait_for_game_event
+        '''
+        signal_cap = await self.wait_for_sound(timeout)
+        if signal_cap is None:
+            return self.game.get_timeout_event()
+        loop = asyncio.get_running_loop()
+        delay, confidence, full_capture = await loop.run_in_executor(
+            self.executor, estimate_delay_at_onset,
+            signal_cap[0], signal_cap[1], DELAY_MAX, self.game.get_onset_idx(signal_cap),
+        )
+        return self.game.get_event_from_delay(
+            signal_cap, delay, confidence=confidence, full_capture=full_capture
+        )
+
+
+def detect_block(block, tables, filt, demod, audio_idx):
+    '''
+    filter one block of all channels together and run each table's signal capture over its pair of channels,
+    returns the captures each table finished. with the multirate front end filt is None and demod demodulates
+    all the channels together, each table gets its pair of envelope channels. runs on the detection thread
+    '''
+    if filt is not None:
+        block = filt.filter_block(block)
+    envelope = None
+    if demod is not None:
+        envelope = demod.envelope(block)
+    caps = []
+    for table in tables:
+        i = 2*table.idx
+        table_envelope = None if envelope is None else envelope[:, i:i + 2]
+        caps.append(table.process(block[:, i], block[:, i + 1], audio_idx, envelope=table_envelope))
+    return caps
+
+
+async def detect_task(blocks, tables, filt, n_channels, demod=None):
+    '''
+    pass each block of the queue to the detection thread and deliver the finished captures to the tables.
+    a block of None ends the task. there is a single detection thread so the blocks are processed in order
+    and each signal capture is only used by one thread
+    '''
+    loop = asyncio.get_running_loop()
+    # the right channel of each pair is multiplied by the configured polarity
+    polarity = np.ones(n_channels)
+    polarity[1::2] = config["polarity"]
+    with ThreadPoolExecutor(1, thread_name_prefix="detect") as executor:
+        while True:
+            item = await blocks.get()
+            if item is None:
+                break
+            [audio_idx, data] = item
+            block = data.reshape(-1, n_channels) * polarity
+            caps = await loop.run_in_executor(executor, detect_block, block, tables, filt, demod, audio_idx)
+            for table, table_caps in zip(tables, caps):
+                table.deliver(table_caps, audio_idx + block.shape[0])
+
+
+class BlockQueue(asyncio.Queue):
+    '''
+    bounded queue of (frame index, block) items. blocks from the audio device that don't fit are dropped, the
+    frame index keeps the capture indices right across the gap
+    '''
+    def __init__(self, maxsize=BLOCK_QUEUE_LEN):
+        super().__init__(maxsize)
+        self.n_frames = 0
+        self.n_dropped = 0
+
+    def put_block(self, data, n_channels):
+        '''
+        called on the loop for each block from the audio device
+        '''
+        try:
+            self.put_nowait((self.n_frames, data))
+        except asyncio.QueueFull:
+            self.n_dropped += 1
+            # one warning per second of dropped audio at most
+            if self.n_dropped % max(1, Fs // BLOCK_LEN) == 1:
+                log.warning(f"detection is falling behind, {self.n_dropped} blocks of audio dropped")
+        self.n_frames += len(data) // n_channels
+
+    async def put_file_block(self, data, n_channels):
+        '''
+        called for each block of a recording, waits for room instead of dropping it
+        '''
+        await self.put((self.n_frames, data))
+        self.n_frames += len(data) // n_channels
+
+
+async def table_task(table):
+    '''
+    asyncio version of the headless game loop in multi_table.py. games are played back to back,
+    and a table that times out waiting for a serve just goes back to waiting for the next serve
+    '''
+    game = table.game
+    scoreboard = table.scoreboard
+    game.new_game()
+    game.set_start_state(game.p1)
+    while True:
+        table.publish()
+        state_name = game.current_state.state_name
+        timeout = GAME_EVENT_TIMEOUT
+        if state_name == "ScoreState":
+            post_scoring_state = scoreboard.update_score(game.current_state)
+            print(f"table {table.idx}: {scoreboard.score[0]} - {scoreboard.score[1]}")
+            if post_scoring_state.state_name == "EndState":
+                print(f"table {table.idx}: {post_scoring_state.player} wins")
+                game.current_state = post_scoring_state
+                table.publish()
+                scoreboard.score = [0, 0]
+                game.new_game()
+                # the reset is logged so a replay of the table's log starts the next game at 0 - 0
+                scoreboard.log_score("new_game")
+                game.set_start_state(game.p1)
+                continue
+            table.clear_captures()
+            await asyncio.sleep(POST_SCORING_TIMEOUT)
+            timeout = SERVE_TIMEOUT
+        elif state_name == "ErrorState":
+            game.set_start_state(game.game_state.current_player)
+            continue
+        elif state_name == "StartState":
+            timeout = SERVE_TIMEOUT
+        event = await table.wait_for_game_event(timeout)
+        game.current_state = game.game_state.transition(game.current_state, event)
+
+
+async def play_file(fname, blocks):
+    '''
+    push the blocks of a two channel recording onto the queue at the rate they were recorded
+    '''
+    loop = asyncio.get_running_loop()
+    sig = FileSignal(fname)
+    start = loop.time()
+    n_frames = 0
+    while not sig.done:
+        await blocks.put_file_block(sig.read(BLOCK_LEN), 2)
+        n_frames += BLOCK_LEN
+        await asyncio.sleep(max(0, start + n_frames/sig.rate - loop.time()))
+    sig.close()
+
+
+async def run(n_channels=2, fname=None):
+    loop = asyncio.get_running_loop()
+    if fname is not None:
+        n_channels = 2
+    n_tables = n_channels // 2
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    blocks = BlockQueue()
+    # compile the capture and beamformer kernels before the first block arrives, see sig/kernels.py
+    warm_up()
+    filt = None
+    demod = None
+    if config["front_end"] == "full":
+        filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K, n_channels=n_channels)
+    else:
+        demod = get_demodulator(Fs, n_channels)
+    score_server = None
+    if config["score_server_enabled"]:
+        score_server = ScoreServer().start()
+        print(f"publishing scores on http://{score_server.host}:{score_server.port}/?key=table-00")
+
+    with ProcessPoolExecutor(config["multi_table_angle_workers"]) as pool:
+        tables = [
+            AsyncTable(i, executor=pool, event_log=EventLog(f"table-{i:02}-log.jsonl"), score_server=score_server)
+            for i in range(n_tables)
+        ]
+        game_tasks = [asyncio.create_task(table_task(table)) for table in tables]
+        detector = asyncio.create_task(detect_task(blocks, tables, filt, n_channels, demod))
+        waiters = [asyncio.create_task(stop.wait())]
+        sig = None
+        if fname is not None:
+            waiters.append(asyncio.create_task(play_file(fname, blocks)))
+        else:
+            # the callback runs on the audio device's thread, so blocks are handed to the loop thread-safely
+            sig = StreamSignal(frames_per_buffer=BLOCK_LEN, channels=n_channels)
+            sig.open(callback=lambda data: loop.call_soon_threadsafe(blocks.put_block, data, n_channels))
+        print(f"scoring {n_tables} tables, press ctrl-c to quit")
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+
+        if sig is not None:
+            sig.close()
+        # let the detector work through whatever is still queued, then let the games handle the last captures
+        await blocks.put(None)
+        await detector
+        if not stop.is_set():
+            await asyncio.sleep(GAME_EVENT_TIMEOUT)
+        for task in game_tasks + waiters:
+            task.cancel()
+        await asyncio.gather(*game_tasks, *waiters, return_exceptions=True)
+
+    for table in tables:
+        table.event_log.close()
+    if score_server is not None:
+        score_server.stop()
+    return tables
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="score one or more tables using the asyncio runtime")
+    parser.add_argument("n_channels", nargs="?", type=int, default=2,
+                        help="number of input channels, two per table")
+    parser.add_argument("--file", help="play a two channel recording through the runtime instead of the mics")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.n_channels, args.file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+'''
+    clocks used by the game for timeouts. the game never calls time.time or time.sleep directly, it asks its
+    clock instead. the realtime game uses the wall clock. replaying recorded audio uses a sample clock, where time
+    is the number of audio frames processed divided by the sample rate, so a replay can run much faster than real
+    time while the serve and game event timeouts still fire at the same point in the audio as they would live.
+
+    both clocks have the same interface:
+        time()                      current time in seconds
+        sleep(seconds)              block until the given amount of clock time has passed
+        wait(condition, timeout)    wait on a condition (which the caller holds) until notified or until timeout
+                                    seconds of clock time have passed
+        finished                    True once the clock will not move any more, e.g. at the end of a recording.
+                                    waits and sleeps return straight away and the game stops waiting for sounds
+'''
+from threading import Condition, Lock
+import time
+
+
+class WallClock:
+    '''
+    clock backed by the system time, used for the realtime game
+    '''
+    # the wall clock never stops
+    finished = False
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, condition, timeout):
+        return condition.wait(timeout)
+
+
+class SampleClock:
+    '''
+    virtual clock driven by the audio. the producer calls advance with the number of frames it has processed
+    and any waiters whose timeout has been reached are woken up.
+
+    with lockstep set, advance blocks until the consumer is waiting on the clock again. the producer then can't
+    run ahead of the game thread while it handles a capture, which keeps replays deterministic no matter how fast
+    they run. max_stall is a wall clock limit on that blocking so the producer can't hang if the consumer exits,
+    and on each wait of a consumer so it can't hang if the producer stops advancing the clock. the producer calls
+    finish once it is done, which wakes every waiter
+    '''
+    def __init__(self, Fs, start_frame=0, lockstep=False, max_stall=1.0):
+        self.Fs = Fs
+        self.frames = start_frame
+        self.lockstep = lockstep
+        self.max_stall = max_stall
+        self.lock = Lock()
+        # conditions currently being waited on, mapped to the clock time at which they time out
+        self.waiters = {}
+        # used for sleep and to let a lockstep producer know a consumer has started waiting
+        self.sleep_condition = Condition()
+        self.waiter_condition = Condition()
+        self.finished = False
+
+    def time(self):
+        return self.frames/self.Fs
+
+    def advance(self, n_frames):
+        '''
+        move the clock forward by n_frames and wake anything whose timeout has passed
+        '''
+        if self.lockstep:
+            with self.waiter_condition:
+                self.waiter_condition.wait_for(lambda: len(self.waiters) > 0, self.max_stall)
+        with self.lock:
+            self.frames += n_frames
+            now = self.frames/self.Fs
+            due = [cond for cond, deadline in self.waiters.items() if deadline <= now]
+            # woken conditions stop counting as waiting until they wait on the clock again
+            for cond in due:
+                del self.waiters[cond]
+        for cond in due:
+            # conditions are assumed to use the default reentrant lock, so this is safe even if
+            # the producer is already holding the condition
+            with cond:
+                cond.notify_all()
+
+    def notify(self, condition):
+        '''
+        notify a condition that may be waiting on the clock, e.g. when a capture is ready. the condition is
+        no longer counted as waiting, so a lockstep producer holds off until it has handled the notification
+        and started waiting again. the caller must hold the condition
+        '''
+        with self.lock:
+            self.waiters.pop(condition, None)
+        condition.notify_all()
+
+    def finish(self):
+        '''
+        called by the producer when the clock won't advance any more (end of the recording or playback).
+        wakes every waiter, later waits and sleeps return straight away
+        '''
+        with self.lock:
+            self.finished = True
+            waiting = list(self.waiters)
+            self.waiters.clear()
+        for cond in waiting + [self.sleep_condition]:
+            with cond:
+                cond.notify_all()
+
+    def set_frame(self, frame):
+        '''
+        move the clock to an absolute frame, e.g. the position of an audio player. the clock never goes backwards
+        '''
+        n_frames = frame - self.frames
+        if n_frames > 0:
+            self.advance(n_frames)
+
+    def wait(self, condition, timeout):
+        '''
+        wait on condition, which must be held by the caller, until notified or until the clock passes timeout.
+        returns False if the wait timed out. the wait also returns (with True if the clock hasn't reached the
+        deadline) after max_stall seconds of wall time, so a caller looping on the clock can check its own quit
+        flag if the producer stalls
+        '''
+        deadline = self.time() + timeout
+        with self.lock:
+            if self.finished:
+                return self.time() < deadline
+            self.waiters[condition] = deadline
+        with self.waiter_condition:
+            self.waiter_condition.notify_all()
+        try:
+            # the deadline is registered before the condition is released by wait, so a producer
+            # advancing the clock past it can't notify before this thread is waiting
+            condition.wait(self.max_stall)
+        finally:
+            with self.lock:
+                self.waiters.pop(condition, None)
+        return self.time() < deadline
+
+    def sleep(self, seconds):
+        deadline = self.time() + seconds
+        with self.sleep_condition:
+            while (self.time() < deadline) and (not self.finished):
+                self.wait(self.sleep_condition, deadline - self.time())
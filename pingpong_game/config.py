@@ -1,4 +1,5 @@
 # set up the config file used at runtime
+import os
 
 config = dict()
 
@@ -15,6 +16,12 @@ config["sig_cap_window_len"] = int(.01*Fs)
 config["signal_block_len"] = config["sig_cap_window_len"]*1
 # minimum power required for each block to be added to a captured signal
 config["sig_cap_power"] = 50
+# capture detection front end. "full" bandpass filters every sample and detects on the full rate signal,
+# "multirate" detects on the decimated envelope of the band and only filters a segment of up to
+# multirate_segment_len samples around each sound at full rate (see sig/multirate.py)
+config["front_end"] = "full"
+config["multirate_decimation"] = 8
+config["multirate_segment_len"] = int(.05*Fs)
 # max buffer size for the signal capture, no sonic events should be longer than a second so this gives plenty of buffer
 config["max_sig_buffer_len"] = 5*Fs
 # frequency bounds for the bandpass filter used to limit input signal to just ping-pong sounds
@@ -39,11 +46,80 @@ config["delay_max"] = int((config["mic_diameter_m"]/340)*Fs)
 # also this can allow for other means of filtering out captures in the future - e.g. classification on incoming
 # signals instead of using the mean power between the signals
 config["mean_signal_power_min"] = 80
+# gate applied by the signal capture to every finished capture (see capture_gates in sig/signal_capture.py)
+# rejected captures are only counted instead of waking the game. "power" applies the mean_signal_power_min check
+# above using statistics gathered while capturing. set to None to pass every capture to the game
+config["capture_gate"] = "power"
+# log the spectral centroid and the fraction of energy in the ping pong band of every capture the game checks
+# (see sig/spectrum.py), a starting point for telling different kinds of sounds apart. the features are taken
+# from the onset window (see onset_window_len) so the cost doesn't grow with the capture. with the full rate
+# front end the captures are already bandpass filtered and the band fraction is close to 1
+config["log_spectral_features"] = False
+# localization of each sound (see estimate_delay_at_onset in sig/signal_tools.py). with "onset" the delay is
+# estimated from a fixed length window starting a little before the onset of the sound instead of the whole
+# capture, falling back to the whole capture if the channels don't line up with at least the min confidence
+# (normalized correlation). "full" always uses the whole capture
+config["localization_mode"] = "onset"
+config["onset_pre_roll"] = int(.002*Fs)
+config["onset_window_len"] = int(.02*Fs)
+config["onset_min_confidence"] = .5
 # pre-configured sign difference between the two mics. in my case the channels had opposite signs
 # so i need to multiply one of the channels by -1 before processing. this assumption is checked when
 # determing the players position in the calibration stage, and changed if the polarity is estimated to be the same
 config["polarity"] = -1
 
+# use the numba compiled kernels for the capture window loop and the beamformer when numba is installed
+# (see sig/kernels.py). the numpy code is used otherwise, results are the same either way
+config["jit_kernels"] = True
+
+# on-disk cache used by the offline tools for filtered signals and rms envelopes, see sig/signal_cache.py
+# entries are evicted least-recently-used first once the cache grows past the max size in bytes
+config["signal_cache_enabled"] = True
+config["signal_cache_dir"] = os.environ.get("PINGPONG_CACHE_DIR", "~/.cache/pingpong_game")
+config["signal_cache_max_bytes"] = 4*1024**3
+
+# multi-table mode (see multi_table.py): one multichannel input with a pair of channels per table
+# channels 2i and 2i+1 are the left and right microphones of table i
+config["multi_table_channels"] = 16
+# sides of the players at each table, the same for every table
+config["multi_table_p1_position"] = "Left"
+config["multi_table_p2_position"] = "Right"
+# number of worker processes shared by all tables for estimating the angle of each sound
+config["multi_table_angle_workers"] = 4
+# asyncio runtime (see async_runtime.py): most blocks of audio waiting for the detection task. if the loop falls
+# further behind than this, new blocks from the audio device are dropped (and counted) instead of piling up
+config["async_block_queue_len"] = 200
+
+# run the audio front end (device read, filtering, capture detection) in its own process instead of a thread of
+# the game process, see dsp_process.py. the samples are passed back through a ring of dsp_ring_seconds of audio
+config["dsp_process"] = False
+config["dsp_ring_seconds"] = 10
+
+# port the realtime game listens on for a remote microphone node (see remote_mic.py) instead of reading the
+# local audio device, None to use the local device
+config["remote_mic_port"] = None
+
+# what the realtime game records, see recording.py. "full" writes the whole session to the wave file, "sparse"
+# only writes the audio around sounds, from sparse_pre_roll seconds before each one to sparse_post_roll seconds
+# after it, and where each part was in the session to an index next to the file. "segmented" writes the whole
+# session to a new directory for each run, in files of recording_segment_seconds, and brings the header of the
+# file being written up to date every recording_header_interval seconds
+config["recording_mode"] = "full"
+config["sparse_pre_roll"] = .5
+config["sparse_post_roll"] = 1.
+config["recording_segment_seconds"] = 600
+config["recording_header_interval"] = 1.
+
+# score publication server (see score_server.py), pushes score changes to spectator displays over http
+# updates are sent at most once every min_interval seconds
+config["score_server_enabled"] = False
+config["score_server_host"] = "127.0.0.1"
+config["score_server_port"] = 8765
+config["score_server_min_interval"] = .1
+
+# video playback version: frames decoded ahead of presentation by the decoder thread
+config["video_queue_len"] = 32
+
 # files used by video playback version
 
 # src dir is the top level directory containing the entire project
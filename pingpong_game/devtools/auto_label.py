@@ -0,0 +1,155 @@
+"""
+    NOTE: this code is not part of the final project. proposes video labels (the captures/<video>_caps_NNN.json
+    files used by evaluate_model.py and the segment players) from motion in the video, so building the labels
+    for a new match is a matter of confirming the proposals with the segment players instead of finding every
+    segment by hand.
+
+    the video is split into chunks which are scanned in parallel by a pool of processes. each process decodes
+    its chunk, downscales every frame to a small grayscale image and takes the absolute difference between
+    consecutive frames a batch of frames at a time with numpy, giving the amount of motion in each frame for
+    the left and right half of the picture. frames with much more motion than usual (median plus k times the
+    median absolute deviation, after a short moving average) are grouped into segments, segments separated by
+    fewer than gap frames are merged and those shorter than min_len frames dropped. each segment is labelled
+    with the half of the picture that had more motion, "left" or "right".
+
+    the proposals are written in the same shape as the hand made files, a json list of [start, end, label]
+    with start and end in video frames, to the next free name from helper.get_capture_fname.
+
+    usage: python -m pingpong_game.devtools.auto_label video.mp4 [--workers N] [--width 160] [--k 6]
+           [--min-len 3] [--gap 5] [--dry-run]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import time
+
+import numpy as np
+
+from pingpong_game.sig.helper import get_capture_fname
+
+
+BATCH_LEN = 256
+
+
+def get_motion(video_fname, start, stop, width):
+    '''
+    motion in the left and right half of each frame from start to stop, shape (stop - start, 2): the mean absolute
+    difference from the frame before, on grayscale frames downscaled to the given width. the first frame of the
+    video has no motion
+    '''
+    import cv2
+    video = cv2.VideoCapture(video_fname)
+    # the frame before the chunk is needed for the difference of its first frame
+    first = max(start - 1, 0)
+    video.set(cv2.CAP_PROP_POS_FRAMES, first)
+    motion = np.zeros((stop - start, 2), dtype=np.float32)
+    prev = None
+    idx = first
+    while idx < stop:
+        batch = []
+        while (len(batch) < BATCH_LEN) and (idx + len(batch) < stop):
+            [ret, frame] = video.read()
+            if not ret:
+                break
+            height = max(1, frame.shape[0]*width // frame.shape[1])
+            small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            batch.append(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+        if not batch:
+            break
+        frames = np.stack(batch).astype(np.int16)
+        # the difference for a frame is taken from the frame before it, which for the first frame of the
+        # batch is the last frame of the previous batch
+        if prev is None:
+            diff_start = idx + 1
+        else:
+            frames = np.concatenate([prev[None], frames])
+            diff_start = idx
+        diff = np.abs(np.diff(frames, axis=0))
+        half = diff.shape[2] // 2
+        values = np.stack([diff[:, :, :half].mean(axis=(1, 2)), diff[:, :, half:].mean(axis=(1, 2))], axis=1)
+        diff_idx = diff_start + np.arange(len(values))
+        keep = (diff_idx >= start) & (diff_idx < stop)
+        motion[diff_idx[keep] - start] = values[keep]
+        prev = frames[-1]
+        idx += len(batch)
+    video.release()
+    return motion
+
+
+def get_segments(motion, k=6., min_len=3, gap=5, smooth=3):
+    '''
+    [start, end, label] of each run of frames with unusually high motion, see the module docstring
+    '''
+    total = motion.sum(axis=1)
+    if smooth > 1:
+        total = np.convolve(total, np.ones(smooth)/smooth, mode="same")
+    median = np.median(total)
+    mad = np.median(np.abs(total - median))
+    # a static video has no deviation at all, any motion counts then
+    active = total > median + k*max(mad, 1e-3)
+    # start and end of each run of active frames
+    edges = np.diff(np.concatenate([[0], active.astype(np.int8), [0]]))
+    runs = list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+    merged = []
+    for start, end in runs:
+        if merged and (start - merged[-1][1] < gap):
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    segments = []
+    for start, end in merged:
+        if end - start < min_len:
+            continue
+        [left, right] = motion[start:end].sum(axis=0)
+        segments.append([int(start), int(end), "left" if left >= right else "right"])
+    return segments
+
+
+def scan_video(video_fname, workers=None, width=160, chunk_len=None):
+    '''
+    motion of every frame of the video, scanned in chunks in parallel
+    '''
+    import cv2
+    video = cv2.VideoCapture(video_fname)
+    n_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+    if workers is None:
+        workers = os.cpu_count()
+    if chunk_len is None:
+        # a few chunks per worker so the pool stays busy if some chunks decode slower
+        chunk_len = max(BATCH_LEN, -(-n_frames // (4*workers)))
+    bounds = [(lb, min(lb + chunk_len, n_frames)) for lb in range(0, n_frames, chunk_len)]
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(get_motion, video_fname, lb, ub, width) for lb, ub in bounds]
+        return np.concatenate([f.result() for f in futures]) if futures else np.zeros((0, 2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="propose video labels from motion")
+    parser.add_argument("video_fname")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, all cores by default")
+    parser.add_argument("--width", type=int, default=160, help="width of the downscaled frames")
+    parser.add_argument("--k", type=float, default=6., help="threshold in median absolute deviations")
+    parser.add_argument("--min-len", type=int, default=3, help="shortest segment in frames")
+    parser.add_argument("--gap", type=int, default=5, help="merge segments closer than this many frames")
+    parser.add_argument("--dry-run", action="store_true", help="print the segments instead of writing them")
+    args = parser.parse_args(argv)
+
+    s = time.perf_counter()
+    motion = scan_video(args.video_fname, args.workers, args.width)
+    segments = get_segments(motion, args.k, args.min_len, args.gap)
+    print(f"{len(motion)} frames scanned in {time.perf_counter() - s:.1f} s, {len(segments)} segments proposed")
+    if args.dry_run:
+        for segment in segments:
+            print(*segment)
+        return
+    os.makedirs("pingpong_game/devtools/captures", exist_ok=True)
+    fname = get_capture_fname(os.path.basename(args.video_fname))
+    with open(fname, "w") as f:
+        json.dump(segments, f)
+    print(f"wrote {fname}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+    NOTE: this code is not part of the final project. it is a check for the offline and analysis code paths,
+    making sure they can be imported on a headless machine without pulling in the audio, gui or video libraries.
+
+    each module is imported in a fresh interpreter so that the measured time is what a newly spawned batch job
+    would pay. exits with a non-zero status if any forbidden module is loaded or an import takes longer than
+    the time budget.
+
+    usage: python -m pingpong_game.devtools.check_imports [budget_seconds]
+"""
+import json
+import subprocess
+import sys
+
+
+# modules that only the realtime and video playback programs should need
+FORBIDDEN_MODULES = ["pyaudio", "tkinter", "cv2"]
+
+# modules used by the offline / analysis code paths
+OFFLINE_MODULES = [
+    "pingpong_game.config",
+    "pingpong_game.state_machine",
+    "pingpong_game.player",
+    "pingpong_game.scoreboard",
+    "pingpong_game.game",
+    "pingpong_game.event_log",
+    "pingpong_game.score_recording",
+    "pingpong_game.sig.signal_tools",
+    "pingpong_game.sig.signal_capture",
+    "pingpong_game.sig.signal_cache",
+    "pingpong_game.sig.spectrum",
+    "pingpong_game.sig.envelope",
+    "pingpong_game.sig.multirate",
+    "pingpong_game.sig.kernels",
+    "pingpong_game.__main__",
+    "pingpong_game.signal_capture_demo",
+    "pingpong_game.multi_table",
+    "pingpong_game.async_runtime",
+    "pingpong_game.recording",
+]
+
+# runs in the child interpreter, prints the import time and any forbidden modules that were loaded
+CHILD_CODE = """
+import importlib, json, sys, time
+s = time.perf_counter()
+importlib.import_module({module!r})
+e = time.perf_counter()
+loaded = [m for m in {forbidden!r} if m in sys.modules]
+print(json.dumps({{"seconds": e - s, "loaded": loaded}}))
+"""
+
+
+def check_module(module):
+    '''
+    import module in a fresh interpreter and return (import_seconds, forbidden_modules_loaded)
+    '''
+    code = CHILD_CODE.format(module=module, forbidden=FORBIDDEN_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    info = json.loads(result.stdout.strip().splitlines()[-1])
+    return info["seconds"], info["loaded"]
+
+
+def main(budget):
+    failed = False
+    for module in OFFLINE_MODULES:
+        try:
+            seconds, loaded = check_module(module)
+        except subprocess.CalledProcessError as e:
+            print(f"{module}: import failed\n{e.stderr}")
+            failed = True
+            continue
+        status = "ok"
+        if loaded:
+            status = f"loaded {', '.join(loaded)}"
+            failed = True
+        elif seconds > budget:
+            status = f"over budget of {budget}s"
+            failed = True
+        print(f"{module:40} {seconds*1000:8.1f} ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    sys.exit(main(budget))
@@ -0,0 +1,144 @@
+"""
+    NOTE: this code is not part of the final project. compares the capture latency of the threaded audio front
+    end (__main__.py) with the dsp process (dsp_process.py, config["dsp_process"]) while the game process is
+    busy, and doesn't need an audio interface.
+
+    a recording is played in real time through each front end (FileSignal with realtime set, which hands out each
+    block once it would have been recorded). a consumer thread stands in for the game thread and takes each
+    capture as soon as it is notified, and a number of load threads keep the interpreter of the game process busy
+    the way a busy tk loop does. the latency of a capture is the time from the block that finished it being read
+    to the consumer having it. in dsp process mode the recording written by the recorder thread is also checked
+    against the source.
+
+    usage: python -m pingpong_game.devtools.dsp_latency recording.wav [--load 2] [--mode both]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.dsp_process import DspFrontEnd
+from pingpong_game.recording import WaveRecorder
+from pingpong_game.sig.multirate import get_signal_capture
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter, load_signal
+
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+
+
+def load_thread_func(stop):
+    '''
+    pure python work that holds the GIL, like the tk loop redrawing the scoreboard
+    '''
+    while not stop.is_set():
+        sum(i*i for i in range(2000))
+
+
+def consumer_thread_func(sig_cap, stop, latencies):
+    '''
+    take every capture as soon as it is ready, recording how long after its block was read it arrived
+    '''
+    with sig_cap.condition:
+        while not stop.is_set():
+            if not sig_cap.capture_ready:
+                sig_cap.condition.wait(.1)
+            while sig_cap.capture_ready:
+                cap = sig_cap.get_next_capture()
+                latencies.append((time.monotonic_ns() - cap.read_ns)/1e6)
+
+
+def audio_thread_func(fname, sig_cap):
+    '''
+    the audio thread of __main__.py reading from a file in real time, stamping each capture with the time the
+    block that finished it was read
+    '''
+    sig = FileSignal(fname, realtime=True)
+    filt = None
+    if config["front_end"] == "full":
+        filt = PingPongFilter(config["filter_low_thresh"], config["filter_high_thresh"], Fs, K=6)
+    audio_idx = 0
+    while not sig.done:
+        data = sig.read(2*BLOCK_LEN)
+        read_ns = time.monotonic_ns()
+        n = (len(data)//2 // SIG_CAP_WINDOW_LEN) * SIG_CAP_WINDOW_LEN
+        lch = data[:2*n:2]
+        rch = data[1:2*n:2] * config["polarity"]
+        if filt is not None:
+            [lch, rch] = filt.filter(lch, rch)
+        with sig_cap.condition:
+            n_caps = len(sig_cap.caps)
+            sig_cap.process(lch, rch, frame_offset=audio_idx)
+            for cap in sig_cap.caps[n_caps:]:
+                cap.read_ns = read_ns
+        audio_idx += len(data)//2
+    sig.close()
+
+
+def run(fname, mode, n_load):
+    '''
+    play the recording through the given front end with n_load load threads, returns the latencies in ms
+    '''
+    stop = threading.Event()
+    latencies = []
+    loads = [threading.Thread(target=load_thread_func, args=(stop,)) for _ in range(n_load)]
+    if mode == "threaded":
+        sig_cap = get_signal_capture(Fs)
+        producer = threading.Thread(target=audio_thread_func, args=(fname, sig_cap))
+        dsp = None
+    else:
+        out_fname = os.path.join(tempfile.mkdtemp(), "dsp_latency.wav")
+        recorder = WaveRecorder(out_fname, Fs)
+        dsp = DspFrontEnd(recorder, source=fname)
+        sig_cap = dsp.sig_cap
+    consumer = threading.Thread(target=consumer_thread_func, args=(sig_cap, stop, latencies))
+    for thread in loads + [consumer]:
+        thread.start()
+    if dsp is None:
+        producer.start()
+        producer.join()
+    else:
+        dsp.start()
+        while dsp.dsp_state["done"] == 0:
+            time.sleep(.1)
+    # give the consumer time to take the last capture
+    time.sleep(.2)
+    stop.set()
+    for thread in loads + [consumer]:
+        thread.join()
+    if dsp is not None:
+        dsp.stop()
+        recorder.close()
+        [source, _] = load_signal(fname, split_channels=False)
+        [recorded, _] = load_signal(out_fname, split_channels=False)
+        print(f"  recording matches the source: {np.array_equal(source, recorded)}")
+        os.remove(out_fname)
+    return np.array(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="capture latency of the threaded front end vs the dsp process")
+    parser.add_argument("fname", help="two channel wave file")
+    parser.add_argument("--load", type=int, default=2, help="number of threads keeping the game process busy")
+    parser.add_argument("--mode", choices=["threaded", "process", "both"], default="both")
+    args = parser.parse_args(argv)
+
+    modes = ["threaded", "process"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(f"{mode}, {args.load} load threads:")
+        latencies = run(args.fname, mode, args.load)
+        if len(latencies) == 0:
+            print("  no captures")
+            continue
+        [p50, p95] = np.percentile(latencies, [50, 95])
+        print(f"  {len(latencies)} captures, latency median {p50:.1f} ms, 95th percentile {p95:.1f} ms, "
+              f"max {latencies.max():.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+    NOTE: this code is not part of the final project. waveform browser for long recordings using the envelope
+    pyramid (sig/envelope.py), built and stored next to the recording on first use.
+
+    only the visible span is drawn, at the pyramid level with about one block per pixel, and the axes, grid and
+    labels are drawn once and blitted: scrolling only redraws the two envelope lines and the time label. the x
+    axis is the time within the visible span, the start of the span is shown in the top left corner.
+
+        right / left            scroll a quarter of the span (shift + arrow: a whole span)
+        mouse wheel             scroll
+        up / down               zoom in / out
+        home / end              jump to the start / end
+
+    with --benchmark the viewer scrolls through the whole recording without a window and reports the time per
+    frame instead.
+
+    usage: python -m pingpong_game.devtools.envelope_viewer recording.wav [--span 10] [--benchmark]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from pingpong_game.sig.envelope import load_envelope_pyramid
+
+
+def zigzag(idx, mins, maxs):
+    '''
+    x and y data for a line going from the min to the max of each point, which draws as a filled envelope
+    '''
+    return np.repeat(idx, 2), np.stack([mins, maxs], axis=1).ravel()
+
+
+class EnvelopeViewer:
+    def __init__(self, pyramid, span=10.):
+        from matplotlib import pyplot
+        self.pyramid = pyramid
+        self.Fs = pyramid.Fs
+        self.span = int(span*self.Fs)
+        self.start = 0
+        self.fig, self.axes = pyplot.subplots(2, 1, sharex=True, figsize=(15, 8))
+        # the coarsest level gives the range of the whole recording
+        top = pyramid.levels[-1]
+        y_lim = 1.05*max(np.abs(top[..., 0]).max(), np.abs(top[..., 1]).max(), 1)
+        self.lines = []
+        for ax, name in zip(self.axes, ["left", "right"]):
+            [line] = ax.plot([], [], linewidth=.8, animated=True)
+            self.lines.append(line)
+            ax.set_ylim(-y_lim, y_lim)
+            ax.set_ylabel(name)
+            ax.grid(alpha=.3)
+        self.axes[-1].set_xlabel("time in view (s)")
+        self.label = self.axes[0].text(.01, .9, "", transform=self.axes[0].transAxes, animated=True)
+        self.background = None
+        self.fig.tight_layout()
+        self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+        self.fig.canvas.mpl_connect("key_press_event", self.on_key)
+        self.fig.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.set_span(self.span)
+
+    def set_span(self, span):
+        '''
+        change the length of the visible span, which changes the x axis so everything is redrawn
+        '''
+        self.span = int(min(max(span, 100), self.pyramid.n_samples))
+        self.axes[-1].set_xlim(0, self.span/self.Fs)
+        self.background = None
+        self.fig.canvas.draw_idle()
+
+    def on_draw(self, event):
+        # everything but the animated artists, restored before each frame
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_frame()
+
+    def draw_frame(self):
+        canvas = self.fig.canvas
+        if self.background is None:
+            return
+        canvas.restore_region(self.background)
+        n_points = int(self.axes[0].bbox.width)
+        [idx, mins, maxs] = self.pyramid.get_span(self.start, self.start + self.span, n_points)
+        for ch, (ax, line) in enumerate(zip(self.axes, self.lines)):
+            [x, y] = zigzag((idx - self.start)/self.Fs, mins[:, ch], maxs[:, ch])
+            line.set_data(x, y)
+            ax.draw_artist(line)
+        seconds = self.start/self.Fs
+        self.label.set_text(f"{int(seconds // 60)}:{seconds % 60:06.3f} + {self.span/self.Fs:g} s")
+        self.axes[0].draw_artist(self.label)
+        canvas.blit(self.fig.bbox)
+
+    def scroll_to(self, start):
+        self.start = int(min(max(start, 0), max(0, self.pyramid.n_samples - self.span)))
+        self.draw_frame()
+
+    def on_key(self, event):
+        step = self.span if (event.key or "").startswith("shift") else self.span//4
+        if event.key in ("right", "shift+right"):
+            self.scroll_to(self.start + step)
+        elif event.key in ("left", "shift+left"):
+            self.scroll_to(self.start - step)
+        elif event.key == "home":
+            self.scroll_to(0)
+        elif event.key == "end":
+            self.scroll_to(self.pyramid.n_samples)
+        elif event.key in ("up", "down"):
+            center = self.start + self.span//2
+            self.set_span(self.span/2 if event.key == "up" else self.span*2)
+            self.start = int(min(max(center - self.span//2, 0), max(0, self.pyramid.n_samples - self.span)))
+
+    def on_scroll(self, event):
+        self.scroll_to(self.start - int(event.step*self.span//8))
+
+
+def benchmark(pyramid, span):
+    '''
+    scroll through the whole recording a quarter span at a time, returns (number of frames, seconds per frame)
+    '''
+    viewer = EnvelopeViewer(pyramid, span)
+    viewer.fig.canvas.draw()
+    n_frames = 0
+    s = time.perf_counter()
+    for start in range(0, pyramid.n_samples, viewer.span//4):
+        viewer.scroll_to(start)
+        n_frames += 1
+    return n_frames, (time.perf_counter() - s)/n_frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="browse the waveform of a long recording")
+    parser.add_argument("fname", help="two channel wave file")
+    parser.add_argument("--span", type=float, default=10., help="seconds visible at once")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the envelope pyramid")
+    parser.add_argument("--benchmark", action="store_true", help="time scrolling instead of showing a window")
+    args = parser.parse_args(argv)
+
+    s = time.perf_counter()
+    pyramid = load_envelope_pyramid(args.fname, rebuild=args.rebuild)
+    print(f"envelope ready in {time.perf_counter() - s:.2f} s, levels of {pyramid.block_sizes} samples")
+    if args.benchmark:
+        from matplotlib import use
+        use("Agg")
+        [n_frames, per_frame] = benchmark(pyramid, args.span)
+        print(f"{n_frames} frames, {per_frame*1e3:.2f} ms per frame")
+        return
+    from matplotlib import pyplot
+    EnvelopeViewer(pyramid, args.span)
+    pyplot.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,17 @@ from scipy import signal
 import time
 import wave
 
-from helper import get_capture_fname, get_overlap
-from signal_capture import preprocess_signal
-from signal_tools import load_signal, estimate_delay
+from pingpong_game.sig.helper import get_capture_fname, get_overlap
+from pingpong_game.sig.signal_capture import preprocess_signal
+from pingpong_game.sig.signal_tools import load_signal, estimate_delay_cross_corr as estimate_delay
 
 
-media_dir = "media_files"
+media_dir = "pingpong_game/devtools/media_files"
 media_fname = "pp_003"
 
 video_fname = f"{media_dir}/{media_fname}.mp4"
 audio_fname = f"{media_dir}/{media_fname}.wav"
-cap_fname = f"captures/{media_fname}_caps_001.json"
+cap_fname = f"pingpong_game/devtools/captures/{media_fname}_caps_001.json"
 
 wf_temp = wave.open(audio_fname)
 Fs = wf_temp.getframerate()
@@ -32,9 +32,9 @@ power_thresh = 50
 
 mic_diameter_inches = 5
 mic_diameter_m = (5/12)*.3048
-delay_max = (mic_diameter_m / 330)*Fs
+delay_max = int((mic_diameter_m / 330)*Fs)
 
-audio_segments = preprocess_signal(audio_fname, power_thresh, window_len=.01)
+audio_segments = preprocess_signal(audio_fname, power_thresh, window_len=.01*Fs)
 
 with open(cap_fname) as f:
     video_segments = json.load(f)
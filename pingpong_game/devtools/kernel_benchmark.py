@@ -0,0 +1,98 @@
+"""
+    NOTE: this code is not part of the final project. it checks and times the kernels in sig/kernels.py.
+
+    the filtered recording is run through SignalCapture.process block by block as it would be live, and the per
+    window rms and peaks are compared against calling get_rms and abs().max() on each window (the loop process
+    used before). the delay of every capture is then estimated with the numpy beamformer and, when numba is
+    installed, the compiled one, and the delays are compared. timings are given per window and per capture.
+    the first call of each compiled kernel is left out of the timings since it includes compilation.
+
+    usage: python -m pingpong_game.devtools.kernel_benchmark [recording.wav]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig import kernels
+from pingpong_game.sig.signal_cache import load_filtered_signal
+from pingpong_game.sig.signal_capture import SignalCapture
+from pingpong_game.sig.signal_tools import beamformer_time_delay_numpy, get_rms
+
+
+BLOCK_LEN = config["signal_block_len"]
+WINDOW_LEN = config["sig_cap_window_len"]
+DELAY_MAX = config["delay_max"]
+
+
+def per_window_stats(lsig, rsig, window_len):
+    '''
+    window rms and peaks computed one window at a time, as SignalCapture.process used to
+    '''
+    stats = []
+    for i in range(len(lsig) // window_len):
+        lblock = lsig[i*window_len:(i + 1)*window_len]
+        rblock = rsig[i*window_len:(i + 1)*window_len]
+        stats.append((get_rms(lblock), get_rms(rblock), np.abs(lblock).max(), np.abs(rblock).max()))
+    return np.array(stats).T
+
+
+def time_func(func, args_list):
+    s = time.perf_counter()
+    results = [func(*args) for args in args_list]
+    return time.perf_counter() - s, results
+
+
+def run_capture(blocks):
+    '''
+    run the blocks through a SignalCapture, returns the elapsed time and the captures
+    '''
+    sig_cap = SignalCapture(WINDOW_LEN, config["sig_cap_power"], config["max_sig_buffer_len"], use_lock=False)
+    s = time.perf_counter()
+    for i, (lblock, rblock) in enumerate(blocks):
+        sig_cap.process(lblock, rblock, frame_offset=i*BLOCK_LEN)
+    return time.perf_counter() - s, sig_cap.caps
+
+
+def main(fname=None):
+    if fname is None:
+        fname = config["audio_fname"]
+    [lch, rch, Fs] = load_filtered_signal(
+        fname, low=config["filter_low_thresh"], high=config["filter_high_thresh"], K=6,
+        polarity=config["polarity"],
+    )
+    print(f"{fname}: {len(lch)/Fs:.1f}s, compiled kernels {'on' if kernels.USE_JIT else 'off (numba not installed or disabled)'}")
+
+    blocks = [
+        (lch[lb:lb + BLOCK_LEN].astype(np.int32), rch[lb:lb + BLOCK_LEN].astype(np.int32))
+        for lb in range(0, len(lch) - BLOCK_LEN + 1, BLOCK_LEN)
+    ]
+    # warm up (and compile) before timing
+    kernels.warm_up()
+    [t_capture, caps] = run_capture(blocks)
+    n_windows = len(blocks)*(BLOCK_LEN // WINDOW_LEN)
+
+    t_ref, ref = time_func(per_window_stats, [block + (WINDOW_LEN,) for block in blocks])
+    t_new, new = time_func(kernels.window_stats, [block + (WINDOW_LEN,) for block in blocks])
+    identical = all(np.array_equal(r, np.array(n)) for r, n in zip(ref, new))
+    print(f"capture: {len(caps)} captures, process {t_capture/len(lch)*Fs:.4f} of real time")
+    print(f"window stats: {'identical' if identical else 'DIFFERENT'}, per window "
+          f"{t_ref/n_windows*1e6:.2f} us one window at a time, {t_new/n_windows*1e6:.2f} us in one go")
+
+    if not caps:
+        return
+    args = [(cap[0], cap[1], DELAY_MAX) for cap in caps]
+    t_np, delays_np = time_func(beamformer_time_delay_numpy, args)
+    print(f"beamformer numpy: {t_np/len(caps)*1e3:.2f} ms per capture "
+          f"(mean capture length {np.mean([len(cap[0]) for cap in caps]):.0f} samples)")
+    if kernels.beamformer_time_delay is not None:
+        kernels.beamformer_time_delay(*args[0])
+        t_jit, delays_jit = time_func(kernels.beamformer_time_delay, args)
+        n_same = sum(a == b for a, b in zip(delays_np, delays_jit))
+        print(f"beamformer compiled: {t_jit/len(caps)*1e3:.2f} ms per capture ({t_np/t_jit:.1f}x), "
+              f"{n_same} of {len(caps)} delays identical")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,138 @@
+"""
+    NOTE: this code is not part of the final project. it is a scaling benchmark for the multi-table mode
+    (pingpong_game/multi_table.py) and doesn't need an audio interface.
+
+    a synthetic recording with a pair of channels per table (noise plus a bounce every half second on each table)
+    is run through the multi-table front end for an increasing number of tables. for each table count it reports
+    the processing time as a fraction of real time, for the vectorized filter used by multi_table.py, for
+    filtering each channel separately and for the multirate front end with one demodulator shared by all the
+    channels (config["front_end"] = "multirate"). it then compares the throughput of the delay estimation for a batch of
+    captures on the game thread against the shared worker pool.
+
+    usage: python -m pingpong_game.devtools.multi_table_benchmark [max_tables] [seconds]
+"""
+from concurrent.futures import ProcessPoolExecutor
+import sys
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.multirate import MultirateSignalCapture, get_demodulator
+from pingpong_game.sig.signal_capture import SignalCapture
+from pingpong_game.sig.signal_tools import PingPongFilter, technique_funcs
+
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+DELAY_MAX = config["delay_max"]
+
+
+def make_signal(n_tables, seconds, seed=0):
+    '''
+    synthetic int16 multichannel signal of shape (n_frames, 2*n_tables)
+    '''
+    rng = np.random.default_rng(seed)
+    n = int(seconds*Fs)
+    x = rng.normal(0, 20, (n, 2*n_tables))
+    burst_len = int(.03*Fs)
+    burst = 3000*np.sin(2*np.pi*9000*np.arange(burst_len)/Fs)*np.exp(-np.arange(burst_len)/300)
+    for table in range(n_tables):
+        # offset each table's bounces so they don't all line up
+        for start in range(int((.1 + .05*table)*Fs), n - burst_len - 10, Fs//2):
+            delay = rng.integers(-DELAY_MAX, DELAY_MAX + 1)
+            x[start:start + burst_len, 2*table] += burst
+            x[start + 5 + delay:start + 5 + delay + burst_len, 2*table + 1] += burst
+    return np.clip(x, -32768, 32767).astype(np.int16)
+
+
+def run_multirate(x):
+    '''
+    demodulate all channels together and capture every table's channels from its pair of envelope channels,
+    the way multi_table.py does with the multirate front end. returns (elapsed seconds, captures)
+    '''
+    n_channels = x.shape[1]
+    demod = get_demodulator(Fs, n_channels)
+    sig_caps = [
+        MultirateSignalCapture(config["sig_cap_window_len"], config["sig_cap_power"], config["max_sig_buffer_len"],
+                               Fs, use_lock=False)
+        for _ in range(n_channels//2)
+    ]
+    s = time.perf_counter()
+    for lb in range(0, x.shape[0] - BLOCK_LEN + 1, BLOCK_LEN):
+        block = x[lb:lb + BLOCK_LEN]
+        envelope = demod.envelope(block)
+        for i, sig_cap in enumerate(sig_caps):
+            sig_cap.process(block[:, 2*i], block[:, 2*i + 1], frame_offset=lb, envelope=envelope[:, 2*i:2*i + 2])
+    e = time.perf_counter()
+    captures = [cap for sig_cap in sig_caps for cap in sig_cap.caps]
+    return e - s, captures
+
+
+def run_front_end(x, vectorized=True):
+    '''
+    filter and capture every table's channels block by block, returns (elapsed seconds, captures)
+    '''
+    n_channels = x.shape[1]
+    low, high = config["filter_low_thresh"], config["filter_high_thresh"]
+    if vectorized:
+        filters = [PingPongFilter(low, high, Fs, n_channels=n_channels)]
+    else:
+        filters = [PingPongFilter(low, high, Fs, n_channels=1) for _ in range(n_channels)]
+    sig_caps = [
+        SignalCapture(config["sig_cap_window_len"], config["sig_cap_power"], config["max_sig_buffer_len"],
+                      use_lock=False)
+        for _ in range(n_channels//2)
+    ]
+    s = time.perf_counter()
+    for lb in range(0, x.shape[0] - BLOCK_LEN + 1, BLOCK_LEN):
+        block = x[lb:lb + BLOCK_LEN]
+        if vectorized:
+            filtered = filters[0].filter_block(block)
+        else:
+            filtered = np.stack(
+                [filters[ch].filter(block[:, ch])[0] for ch in range(n_channels)], axis=1
+            )
+        for i, sig_cap in enumerate(sig_caps):
+            sig_cap.process(filtered[:, 2*i], filtered[:, 2*i + 1], frame_offset=lb)
+    e = time.perf_counter()
+    captures = [cap for sig_cap in sig_caps for cap in sig_cap.caps]
+    return e - s, captures
+
+
+def estimate_delay(cap):
+    return technique_funcs["beamforming"](cap[0], cap[1], DELAY_MAX)
+
+
+def main(max_tables=8, seconds=10):
+    print(f"front end, {seconds}s of audio per table, time as a fraction of real time")
+    print(f"{'tables':>6} {'vectorized':>11} {'per channel':>12} {'multirate':>10} {'captures':>9} {'multirate':>10}")
+    n_tables = 1
+    captures = []
+    while n_tables <= max_tables:
+        x = make_signal(n_tables, seconds)
+        t_vec, captures = run_front_end(x, vectorized=True)
+        t_loop, _ = run_front_end(x, vectorized=False)
+        t_multi, multi_captures = run_multirate(x)
+        print(f"{n_tables:6} {t_vec/seconds:11.3f} {t_loop/seconds:12.3f} {t_multi/seconds:10.3f} {len(captures):9} "
+              f"{len(multi_captures):10}")
+        n_tables *= 2
+
+    workers = config["multi_table_angle_workers"]
+    print(f"\ndelay estimation for {len(captures)} captures")
+    s = time.perf_counter()
+    serial = [estimate_delay(cap) for cap in captures]
+    t_serial = time.perf_counter() - s
+    with ProcessPoolExecutor(workers) as pool:
+        # warm up the workers so process start up isn't counted
+        list(pool.map(estimate_delay, captures[:workers]))
+        s = time.perf_counter()
+        pooled = list(pool.map(estimate_delay, captures))
+        t_pool = time.perf_counter() - s
+    assert serial == pooled
+    print(f"game thread: {t_serial:.3f}s, pool of {workers} workers: {t_pool:.3f}s")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args)
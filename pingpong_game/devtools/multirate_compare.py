@@ -0,0 +1,128 @@
+"""
+    NOTE: this code is not part of the final project. it validates the multirate front end (sig/multirate.py)
+    against the full rate detector.
+
+    a two channel recording is fed block by block through both front ends as it would be live: the full rate
+    bandpass filter plus SignalCapture, and MultirateSignalCapture on the unfiltered signal. captures are matched
+    by overlap and the script reports the captures found by only one of them, the difference between the onsets,
+    the start and stop indices and the mean rms the capture gate sees, whether the estimated delays agree, and the processing time of each front end as a fraction of real time.
+    the per block cost of the bandpass filter and of the demodulator on their own is also given for more channels,
+    as in multi-table mode, since that is the part of the work the multirate front end reduces.
+
+    usage: python -m pingpong_game.devtools.multirate_compare [recording.wav]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.multirate import Demodulator, MultirateSignalCapture
+from pingpong_game.sig.signal_capture import SignalCapture, get_capture_gate
+from pingpong_game.sig.signal_tools import PingPongFilter, estimate_delay_at_onset, load_signal
+
+
+BLOCK_LEN = config["signal_block_len"]
+WINDOW_LEN = config["sig_cap_window_len"]
+POWER = config["sig_cap_power"]
+MAX_CAPTURE_LEN = config["max_sig_buffer_len"]
+DELAY_MAX = config["delay_max"]
+
+
+def run_full_rate(lch, rch, Fs):
+    filt = PingPongFilter(config["filter_low_thresh"], config["filter_high_thresh"], Fs)
+    sig_cap = SignalCapture(WINDOW_LEN, POWER, MAX_CAPTURE_LEN, use_lock=False, gate=get_capture_gate())
+    s = time.perf_counter()
+    for lb in range(0, len(lch) - BLOCK_LEN + 1, BLOCK_LEN):
+        [lblock, rblock] = filt.filter(lch[lb:lb + BLOCK_LEN], rch[lb:lb + BLOCK_LEN])
+        sig_cap.process(lblock, rblock, frame_offset=lb)
+    return time.perf_counter() - s, sig_cap.caps
+
+
+def run_multirate(lch, rch, Fs):
+    sig_cap = MultirateSignalCapture(WINDOW_LEN, POWER, MAX_CAPTURE_LEN, Fs, use_lock=False, gate=get_capture_gate())
+    s = time.perf_counter()
+    for lb in range(0, len(lch) - BLOCK_LEN + 1, BLOCK_LEN):
+        sig_cap.process(lch[lb:lb + BLOCK_LEN], rch[lb:lb + BLOCK_LEN], frame_offset=lb)
+    return time.perf_counter() - s, sig_cap.caps
+
+
+def stage_cost(Fs, n_channels, n_blocks=1000):
+    '''
+    microseconds per block for the full rate bandpass filter and for the demodulator over n_channels
+    '''
+    low, high = config["filter_low_thresh"], config["filter_high_thresh"]
+    filt = PingPongFilter(low, high, Fs, n_channels=n_channels)
+    demod = Demodulator((low + high)/2, Fs, decimation=config["multirate_decimation"],
+                        cutoff=(high - low)/2 + 500, n_channels=n_channels)
+    block = np.random.randn(BLOCK_LEN, n_channels)
+    costs = []
+    for func in (filt.filter_block, demod.process):
+        s = time.perf_counter()
+        for _ in range(n_blocks):
+            func(block)
+        costs.append((time.perf_counter() - s)/n_blocks*1e6)
+    return costs
+
+
+def onset_frame(cap):
+    return cap[-1][0] - cap.stats.offset + cap.stats.onset_idx
+
+
+def main(fname=None):
+    if fname is None:
+        fname = config["audio_fname"]
+    [lch, rch, Fs] = load_signal(fname)
+    rch = rch * config["polarity"]
+    seconds = len(lch)/Fs
+
+    t_full, full_caps = run_full_rate(lch, rch, Fs)
+    t_multi, multi_caps = run_multirate(lch, rch, Fs)
+
+    matched = []
+    unmatched_multi = list(multi_caps)
+    for cap in full_caps:
+        start, stop = cap[-1]
+        match = None
+        for other in unmatched_multi:
+            if (other[-1][0] < stop + WINDOW_LEN) and (other[-1][1] > start - WINDOW_LEN):
+                match = other
+                break
+        if match is not None:
+            unmatched_multi.remove(match)
+            matched.append((cap, match))
+    n_missed = len(full_caps) - len(matched)
+
+    onset_diffs = [onset_frame(m) - onset_frame(c) for c, m in matched]
+    extent_diffs = [np.subtract(m[-1], c[-1]) for c, m in matched]
+    rms_ratios = [m.stats.mean_rms/c.stats.mean_rms for c, m in matched]
+    delay_diffs = []
+    for cap, other in matched:
+        d_full = estimate_delay_at_onset(cap[0], cap[1], DELAY_MAX, cap.stats.onset_idx)[0]
+        d_multi = estimate_delay_at_onset(other[0], other[1], DELAY_MAX, other.stats.onset_idx)[0]
+        delay_diffs.append(abs(d_full - d_multi))
+
+    print(f"{fname}: {seconds:.1f}s")
+    print(f"captures: full rate {len(full_caps)}, multirate {len(multi_caps)}, matched {len(matched)}, "
+          f"only full rate {n_missed}, only multirate {len(unmatched_multi)}")
+    if matched:
+        onset_diffs = np.array(onset_diffs)
+        delay_diffs = np.array(delay_diffs)
+        print(f"onset difference (samples): mean {onset_diffs.mean():.1f}, max abs {np.abs(onset_diffs).max()}")
+        extent_diffs = np.array(extent_diffs)
+        print(f"start / stop difference (samples): mean {extent_diffs[:, 0].mean():.1f} / "
+              f"{extent_diffs[:, 1].mean():.1f}, max abs {np.abs(extent_diffs).max()}")
+        print(f"gate mean rms, multirate / full rate: median {np.median(rms_ratios):.2f}, "
+              f"range {min(rms_ratios):.2f} - {max(rms_ratios):.2f}")
+        print(f"delays: {np.sum(delay_diffs == 0)} identical, {np.sum(delay_diffs <= 1)} within one sample, "
+              f"max difference {delay_diffs.max()}")
+    print(f"processing time as a fraction of real time: full rate {t_full/seconds:.4f}, "
+          f"multirate {t_multi/seconds:.4f} ({t_full/t_multi:.1f}x)")
+    for n_channels in (2, 8, 16):
+        [t_filt, t_demod] = stage_cost(Fs, n_channels)
+        print(f"{n_channels:2} channels, per {BLOCK_LEN} frame block: bandpass filter {t_filt:.0f} us, "
+              f"demodulator {t_demod:.0f} us")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -14,6 +14,7 @@ import sys
 import time
 import wave
 
+from pingpong_game.devtools.segment_review import SegmentLoader
 from pingpong_game.sig.helper import get_capture_fname
 from pingpong_game.sig.signal_capture import preprocess_signal
 from pingpong_game.sig.signal_tools import load_signal, estimate_delay_cross_corr
@@ -31,27 +32,20 @@ indices = list(map(int, sys.argv[1].split(',')))
 with open(cap_fname) as f:
     video_segments = json.load(f)
 
-cap = cv2.VideoCapture(video_fname)
-video_fps = cap.get(cv2.CAP_PROP_FPS)
+# the requested segments are decoded ahead on a background thread (see segment_review.py)
+loader = SegmentLoader(video_fname, [video_segments[index][:2] for index in indices])
 
 idx = 0
 while idx < len(indices):
     index = indices[idx]
     video_start, video_end, _ = video_segments[index]
-    cap.set(cv2.CAP_PROP_POS_FRAMES, video_start)
-    done = False
     print(video_start, video_end)
 
-    while not done:
-        curr_frame = cap.get(cv2.CAP_PROP_POS_FRAMES)
-        if curr_frame >= video_end:
-            done = True
-        ret, frame = cap.read()
-        if ret == True:
-            cv2.imshow('Frame', frame)
-            key_ = cv2.waitKey(25)
-            if (key_ & 0xFF) == ord('q'):
-                done = True
+    for frame in loader.get_frames(idx):
+        cv2.imshow('Frame', frame)
+        key_ = cv2.waitKey(25)
+        if (key_ & 0xFF) == ord('q'):
+            break
     comm = input('command: [N/r/q]').lower()
     if comm == "r":
         pass
@@ -61,6 +55,6 @@ while idx < len(indices):
         break
 
 
-cap.release()
+loader.close()
 cv2.destroyAllWindows()
 
@@ -1,25 +1,30 @@
 '''
-    Video playback version of the scorekeeper. Most of the logic is the same as the realtime version, but slightly
-    adjusted to try to handle synchronizing the audio to the video.
+    Video playback version of the scorekeeper. Most of the logic is the same as the realtime version, but the
+    audio is not captured while it plays.
 
-    NOTE: due to the synchronization, the signal capture results are not always consistent. This is only reliable as a
-    demonstration device where you can re-run the program to get the results that would be observed in real time.
-    To simulate realtime results, it is best to use the preprocess_signal function in sig/signal_capture
+    Capture detection is decoupled from playback: the captures are found up front by running the signal capture
+    code over the whole audio file (see preprocess_signal in sig/signal_capture, the filtered audio comes from the
+    signal cache), so they are exactly the captures the realtime version would see. The audio thread then plays the
+    file from start to finish and releases each capture to the game once playback reaches the end of the capture.
+    The frames played so far are the playback clock: the game's timeouts are measured against it (see clock.py) and
+    the video process paces its frames by their timestamps against it, so the results are the same on every run
+    and don't depend on thread scheduling. The video process decodes on its own thread ahead of presentation, so
+    slow decoding shows up as dropped frames rather than as video lagging behind the audio.
 '''
 import cv2
-from multiprocessing import Process, Value
-import numpy as np
+from multiprocessing import Process
 from pyaudio import PyAudio
-from scipy import signal
+import queue
 import threading
 import time
 
+from pingpong_game.clock import SampleClock
 from pingpong_game.config import config
 from pingpong_game.game import Game
-from pingpong_game.state_machine import StartState,GameState
 from pingpong_game.scoreboard import Scoreboard
-from pingpong_game.sig.signal_capture import SignalCapture
-from pingpong_game.sig.signal_tools import get_pingpong_filter, load_signal
+from pingpong_game.shared_state import SharedControl
+from pingpong_game.sig.signal_capture import SignalCapture, preprocess_signal
+from pingpong_game.sig.signal_tools import load_signal
 
 
 Fs = config["fs"]
@@ -27,90 +32,148 @@ SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
 BLOCK_LEN = config["signal_block_len"]
 SIG_CAP_POWER = config["sig_cap_power"]
 MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
-filter_low_thresh = config["filter_low_thresh"]
-filter_high_thresh = config["filter_high_thresh"]
-K = 6
-[b,a] = get_pingpong_filter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
-lch_states = np.zeros(K*2)
-rch_states = np.zeros(K*2)
+VIDEO_QUEUE_LEN = config["video_queue_len"]
+
+# fields of the control block shared by the scoreboard, the audio thread and the video process. audio_clock is the
+# playback position in samples and audio_clock_ns the time.monotonic_ns at which it was last updated
+VIDEO_CONTROL_FIELDS = ("pause", "quit", "audio_clock", "audio_clock_ns")
 
 SERVE_TIMEOUT = config["serve_timeout"]
 GAME_EVENT_TIMEOUT = config["game_event_timeout"]
 POST_SCORING_TIMEOUT = config["post_scoring_timeout"]
 
 
-def audio_thread_func(audio_sync_idx, stream, sig, sig_cap, quit_, pause):
+def audio_thread_func(control, stream, sig, sig_cap, captures, clock, quit_, pause):
     '''
-    process audio stream as if it were real time, keeping audio index in sync
-    with video frames for better playback
+    play the audio file from start to finish. after each block the playback clock is updated and any
+    precomputed captures that have finished by that point are released to the game
     '''
-    global lch_states, rch_states
-    while quit_.value == 0:
+    # the stream buffers audio before it is heard, so the playback position lags the frames written
+    latency = int(stream.get_output_latency()*Fs)
+    n_frames = len(sig)//2
+    frames_written = 0
+    cap_idx = 0
+    while (quit_.value == 0) and (frames_written < n_frames):
         # if paused, spin wait until resumed - NOTE: could be improved with signals
-        while pause.value == 1:
+        while (pause.value == 1) and (quit_.value == 0):
             time.sleep(.1)
-        # update audio index value to sync with video (video processing code sets this every frame)
-        audio_idx = audio_sync_idx.value
-        lb, ub = audio_idx, audio_idx + 2*BLOCK_LEN
-        data = sig[lb:ub]
-        audio_idx += 2*BLOCK_LEN
-        lch = data[::2]
-        rch = data[1::2]*config["polarity"]
-        [lch, lch_states] = signal.lfilter(b,a,lch,zi=lch_states)
-        [rch, rch_states] = signal.lfilter(b,a,rch,zi=rch_states)
-
-        # run signal through processor. the reason for the inconsistent results can be seen in this thread
-        # since the starting index can change at random, it is possible that different signals will be passed to the processor
-        # this can have the effect that some captures that would occur in a realtime setting may be missed in the video playback
-        # i tried various things to fix this, but in the end nothing ended up working nicely with the audio playback so i returned
-        # to this version. the corruption only happens every once and a while though and in general the results in this version
-        # resemble the realtime version. as noted above though, to get the actual results as a reference, the preprocess_signal
-        # function should be used
+        data = sig[2*frames_written : 2*(frames_written + BLOCK_LEN)]
+        # output to the audio stream, this blocks so playback runs in real time
+        stream.write(data.tobytes())
+        frames_written += len(data)//2
+        playback_idx = max(frames_written - latency, 0)
+
+        # update the playback clock shared with the video process and used for the game's timeouts
+        control.write(audio_clock=playback_idx, audio_clock_ns=time.monotonic_ns())
+        clock.set_frame(playback_idx)
+
+        # release every capture that has finished playing, using the same notification as the realtime version
         sig_cap.condition.acquire()
-        sig_cap.process(lch, rch, frame_offset=lb/2)
+        while (cap_idx < len(captures)) and (captures[cap_idx][-1][1] <= playback_idx):
+            if sig_cap.do_capture:
+                sig_cap.caps.append(captures[cap_idx])
+                sig_cap.capture_ready = True
+                sig_cap.condition.notify()
+            cap_idx += 1
         sig_cap.condition.release()
+    # the clock won't move any more, wake the game thread wherever it is waiting on it
+    clock.finish()
 
-        # update the audio index
-        audio_sync_idx.value = audio_idx
-        # output to the audio stream
-        stream.write(data.tobytes())
+
+def decode_thread_func(cap, frame_queue, QUIT):
+    '''
+    decode the video into the frame queue as (timestamp, frame), ending with None. the queue is bounded so the
+    decoder only runs a little ahead of presentation
+    '''
+    frame_time = 1/cap.get(cv2.CAP_PROP_FPS)
+    frame_number = 0
+    while QUIT.value == 0:
+        ret, frame = cap.read()
+        if ret == False:
+            break
+        item = (frame_number*frame_time, frame)
+        frame_number += 1
+        # wait for room in the queue, checking for quit so the decoder can't block forever
+        while QUIT.value == 0:
+            try:
+                frame_queue.put(item, timeout=.1)
+                break
+            except queue.Full:
+                pass
+    frame_queue.put(None)
 
 
-def play_video_proc(fname, PAUSE, QUIT, audio_sync_idx):
+def get_playback_time(control, Fs_clock, max_ahead):
     '''
-    play the video frames in a separate process. updating the audio index each frame to keep audio and video in sync
-    NOTE: the PAUSE and QUIT values are shared with the main thread and the audio thread. multiprocessing.Value variables
-    are used in all of the code instead of globals since Value variables are needed to share data between processes
-    Though they aren't needed in the realtime version, they are used so that more code could be compatible for both versions
+    (paused, quit, playback position in seconds) from one snapshot of the control block. the audio clock only moves
+    once per block, so while playing the position is moved forward by the time since the last update, by at most
+    max_ahead seconds
+    '''
+    [paused, quit_, audio_clock, audio_clock_ns] = control.read(*VIDEO_CONTROL_FIELDS)
+    playback_time = audio_clock/Fs_clock
+    if (paused == 0) and (audio_clock_ns > 0):
+        playback_time += min(max(time.monotonic_ns() - audio_clock_ns, 0)/1e9, max_ahead)
+    return paused, quit_, playback_time
+
+
+def play_video_proc(fname, control, samples_per_frame=1):
+    '''
+    play the video frames in a separate process. frames are decoded on a separate thread into a bounded queue and
+    each frame is shown once the audio playback clock reaches the frame's timestamp, so playback speed doesn't
+    depend on how long a frame takes to decode. frames that are already late are dropped so the video can't fall
+    behind the audio. control is the shared control block (see VIDEO_CONTROL_FIELDS and shared_state.py), the
+    video process only reads it. samples_per_frame is the number of channels if the audio clock counts
+    interleaved samples.
+    the number of frames shown and dropped is printed at the end, along with how often the presentation had to
+    wait for the decoder (the decoder can't keep up if that happens a lot)
     '''
     cap = cv2.VideoCapture(fname)
-    video_fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_time = 1/cap.get(cv2.CAP_PROP_FPS)
+    Fs_clock = Fs*samples_per_frame
+    block_time = BLOCK_LEN/Fs
+    QUIT = control.field("quit")
+    frame_queue = queue.Queue(maxsize=VIDEO_QUEUE_LEN)
+    decode_thread = threading.Thread(target=decode_thread_func, args=(cap, frame_queue, QUIT), daemon=True)
+    decode_thread.start()
     # set window size and location
     cv2.namedWindow("output", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("output", 200, 100)
     cv2.moveWindow("output", 50,380)
+    n_shown = 0
+    n_dropped = 0
+    n_underruns = 0
     # display video
-    while(cap.isOpened()):
-        ret, frame = cap.read()
-        if ret == True:
-            cv2.imshow('output', frame)
-            key_ = cv2.waitKey(25)
-
-            # break if quit button pressed
-            if QUIT.value == 1:
-                break
-
-            # if paused, just wait for resume button
-            while PAUSE.value == 1:
-                key_ = cv2.waitKey(5)
-            frame_number = cap.get(cv2.CAP_PROP_POS_FRAMES)
-            timestamp = frame_number/video_fps
-            # set the audio index based on the current time in the video
-            audio_sync_idx.value = int(timestamp*Fs)*2
-        else:
+    while QUIT.value == 0:
+        if frame_queue.empty():
+            n_underruns += 1
+        item = frame_queue.get()
+        if item is None:
             break
+        timestamp, frame = item
+
+        # drop the frame if the audio is already past the next frame
+        [paused, quit_, audio_time] = get_playback_time(control, Fs_clock, block_time)
+        if audio_time > timestamp + frame_time:
+            n_dropped += 1
+            continue
+        # otherwise wait until the audio reaches the frame's timestamp, this also waits while paused
+        while (audio_time < timestamp) and (quit_ == 0):
+            cv2.waitKey(max(1, int(1000*(timestamp - audio_time))) if paused == 0 else 5)
+            [paused, quit_, audio_time] = get_playback_time(control, Fs_clock, block_time)
+        cv2.imshow('output', frame)
+        cv2.waitKey(1)
+        n_shown += 1
+    # let a decoder blocked on a full queue see the quit flag
+    while decode_thread.is_alive():
+        try:
+            frame_queue.get(timeout=.1)
+        except queue.Empty:
+            pass
     cap.release()
     cv2.destroyAllWindows()
+    n_frames = max(n_shown + n_dropped, 1)
+    print(f"video: {n_shown} frames shown, {n_dropped} dropped ({100*n_dropped/n_frames:.1f}%), "
+          f"waited for the decoder {n_underruns} times")
 
 
 def game_event_thread(game):
@@ -118,6 +181,9 @@ def game_event_thread(game):
     similar to the realtime function of the same name, doesn't include funcionality only needed for realtime
     '''
     event = game.wait_for_game_event(SERVE_TIMEOUT)
+    # no event if quit was pressed while waiting
+    if event is None:
+        return
     game.current_state = game.game_state.transition(game.current_state, event)
 
     while ((game.current_state.state_name not in ["ErrorState", "EndState"])
@@ -127,6 +193,8 @@ def game_event_thread(game):
             event = game.wait_for_game_event(SERVE_TIMEOUT)
         else:
             event = game.wait_for_game_event(GAME_EVENT_TIMEOUT)
+        if event is None:
+            break
         game.current_state = game.game_state.transition(game.current_state, event)
 
 
@@ -135,10 +203,10 @@ def game_engine_thread(game):
     similar to realtime version function of the same name
     '''
     game.identify_players()
-    game.game_state = GameState(game.p1, game.p2)
+    game.new_game()
     game.scoreboard.message(f"begin game when ready, {game.p1} serves")
     game.scoreboard.root.update()
-    game.current_state = StartState(game.p1)
+    game.set_start_state(game.p1)
 
     game_thread = threading.Thread(target=game_event_thread, args=(game,))
     game_thread.start()
@@ -179,18 +247,25 @@ def main():
     playback is paused at start, and resumed only after player identification takes place
     '''
     pa = PyAudio()
-    # multiprocessing.Value variables needed to share memory between processes
-    pause = Value('i', 1)
-    quit_ = Value('i', 0)
-    audio_sync_idx = Value('i', 0)
+    # flags and the audio playback clock shared with the video process, see VIDEO_CONTROL_FIELDS. the fields
+    # have the same value attribute as multiprocessing.Value, which the scoreboard and game use
+    control = SharedControl(VIDEO_CONTROL_FIELDS)
+    pause = control.field("pause")
+    quit_ = control.field("quit")
+    pause.value = 1
 
     audio_fname = config["audio_fname"]
     video_fname = config["video_fname"]
 
     # load the signal from the audio fname provided in the config
     [sig, Fs] = load_signal(audio_fname, split_channels=False)
-    # initialize a signal capture object
+    # find all of the captures up front from the sample-accurate audio
+    preprocessed = preprocess_signal(audio_fname, SIG_CAP_POWER, window_len=SIG_CAP_WINDOW_LEN)
+    captures = preprocessed.caps
+    # the game's signal capture object only receives the precomputed captures as they are played
     sig_cap = SignalCapture(SIG_CAP_WINDOW_LEN, SIG_CAP_POWER, MAX_SIG_BUFFER_LEN)
+    # the game's timeouts follow the playback position, so pausing the video also pauses the timeouts
+    clock = SampleClock(Fs)
 
     # open an output stream for playback
     stream = pa.open(
@@ -203,16 +278,16 @@ def main():
     # initialize a scoreboard interface and the game object
     sb = Scoreboard()
     sb.init_tk(pause, quit_)
-    game = Game(sig_cap, sb)
+    game = Game(sig_cap, sb, clock=clock)
 
     # start the audio processing thread and the video Process
     audio_thread = threading.Thread(
         target=audio_thread_func,
-        args=(audio_sync_idx, stream, sig, sig_cap, quit_, pause),
+        args=(control, stream, sig, sig_cap, captures, clock, quit_, pause),
     )
     vid_thread = Process(
         target=play_video_proc,
-        args=(video_fname, pause, quit_, audio_sync_idx),
+        args=(video_fname, control),
     )
     vid_thread.start()
     audio_thread.start()
@@ -225,6 +300,7 @@ def main():
 
     stream.close()
     pa.terminate()
+    control.close()
 
 
 if __name__ == "__main__":
@@ -6,7 +6,7 @@ import cv2
 import logging
 import json
 from math import asin, degrees
-from multiprocessing import Process, Value
+from multiprocessing import Process
 import numpy as np
 from pyaudio import PyAudio, paContinue
 from scipy import signal
@@ -15,10 +15,12 @@ import time
 import wave
 
 from pingpong_game.config import config
+from pingpong_game.devtools.play_video import VIDEO_CONTROL_FIELDS, play_video_proc
 from pingpong_game.game import Game
 from pingpong_game.sig.helper import get_capture_fname
 from pingpong_game.state_machine import StartState,GameState
 from pingpong_game.scoreboard import Scoreboard
+from pingpong_game.shared_state import SharedControl
 from pingpong_game.sig.signal_capture import preprocess_signal
 from pingpong_game.sig.signal_tools import get_pingpong_filter, load_signal
 
@@ -66,7 +68,7 @@ def sig_cap_notif_thread(sig_cap, quit_, audio_sync_idx):
                 more_overlap = False
 
 
-def audio_thread_func(audio_sync_idx, sig, quit_, pause, sig_cap):
+def audio_thread_func(control, sig, quit_, pause, sig_cap):
     # output stream for audio playback
     pa = PyAudio()
     stream = pa.open(
@@ -80,12 +82,12 @@ def audio_thread_func(audio_sync_idx, sig, quit_, pause, sig_cap):
         while pause.value == 1:
             # wait for signal instead
             time.sleep(.1)
-        audio_idx = audio_sync_idx.value
+        audio_idx = control["audio_clock"]
         lb, ub = audio_idx, audio_idx + 2*BLOCK_LEN # nframes * nchannels * nbytes
         data = sig[lb:ub]
         stream.write(data.tobytes())
         audio_idx += 2*BLOCK_LEN
-        audio_sync_idx.value = audio_idx
+        control.write(audio_clock=audio_idx, audio_clock_ns=time.monotonic_ns())
 
         more_overlap = True
         while more_overlap:
@@ -110,34 +112,11 @@ def audio_thread_func(audio_sync_idx, sig, quit_, pause, sig_cap):
     pa.terminate()
 
 
-def play_video_proc(fname, PAUSE, QUIT, audio_sync_idx):
-    cap = cv2.VideoCapture(fname)
-    video_fps = cap.get(cv2.CAP_PROP_FPS)
-    cv2.namedWindow("output", cv2.WINDOW_NORMAL)
-    cv2.resizeWindow("output", 200, 100)
-    cv2.moveWindow("output", 50,380)
-    while(cap.isOpened()):
-        ret, frame = cap.read()
-        if ret == True:
-            cv2.imshow('output', frame)
-            key_ = cv2.waitKey(25)
-
-            if QUIT.value == 1:
-                break
-
-            while PAUSE.value == 1:
-                key_ = cv2.waitKey(5)
-            frame_number = cap.get(cv2.CAP_PROP_POS_FRAMES)
-            timestamp = frame_number/video_fps
-            audio_sync_idx.value = int(timestamp*Fs)*2
-        else:
-            break
-    cap.release()
-    cv2.destroyAllWindows()
-
-
 def core_game_thread(game):
     event = game.wait_for_game_event(SERVE_TIMEOUT)
+    # no event if quit was pressed while waiting
+    if event is None:
+        return
     game.current_state = game.game_state.transition(game.current_state, event)
 
     while ((game.current_state.state_name not in ["ErrorState", "EndState"])
@@ -147,6 +126,8 @@ def core_game_thread(game):
             event = game.wait_for_game_event(SERVE_TIMEOUT)
         else:
             event = game.wait_for_game_event(GAME_EVENT_TIMEOUT)
+        if event is None:
+            break
         game.current_state = game.game_state.transition(game.current_state, event)
 
 
@@ -197,13 +178,15 @@ def game_engine_thread(game):
 
 
 def main():
-    # multiprocessing.Value variables are used instead of globals
+    # a shared memory control block is used instead of globals
     # this allows the variables to be shared across the different threads
-    # and processes. The pause and quit_ variables are used by the tkinter scoreboard
-    # the audio_sync_idx variable is used to keep the video and audio in sync
-    pause = Value('i', 1)
-    quit_ = Value('i', 0)
-    audio_sync_idx = Value('i', 0)
+    # and processes. The pause and quit_ fields are used by the tkinter scoreboard
+    # the audio_clock field (audio_sync_idx) is used to keep the video and audio in sync
+    control = SharedControl(VIDEO_CONTROL_FIELDS)
+    pause = control.field("pause")
+    quit_ = control.field("quit")
+    audio_sync_idx = control.field("audio_clock")
+    pause.value = 1
 
     # sample video used for demo, these paths can be changed to score different
     # videos. the mp4 and wav files should be synchronized beforehand in order
@@ -235,7 +218,7 @@ def main():
     # video are synchronized
     audio_thread = threading.Thread(
         target=audio_thread_func,
-        args=(audio_sync_idx, sig, quit_, pause, sig_cap),
+        args=(control, sig, quit_, pause, sig_cap),
     )
 
     # sigcap_thread = threading.Thread(
@@ -243,10 +226,11 @@ def main():
     #     args=(sig_cap, quit_, audio_sync_idx),
     # )
     # start video in a separate process, it doesn't work if you try
-    # to play it in a thread
+    # to play it in a thread. the audio thread owns audio_sync_idx (in
+    # interleaved samples) and the video paces its frames against it
     vid_thread = Process(
         target=play_video_proc,
-        args=(video_fname, pause, quit_, audio_sync_idx),
+        args=(video_fname, control, 2),
     )
     vid_thread.start()
     audio_thread.start()
@@ -260,6 +244,7 @@ def main():
     vid_thread.join()
     audio_thread.join()
     #sigcap_thread.join()
+    control.close()
 
 
 
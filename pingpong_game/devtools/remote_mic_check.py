@@ -0,0 +1,98 @@
+"""
+    NOTE: this code is not part of the final project. end to end check of the remote microphone protocol
+    (pingpong_game/remote_mic.py) on localhost, without microphones.
+
+    a node streams a recording (as fast as possible, or in real time with --realtime) to a listener in this
+    process, once in each mode:
+
+        raw         the blocks received through RemoteSignal must be exactly the samples of the recording
+        captures    the captures received through RemoteSignalCapture must be the captures preprocess_signal
+                    finds in the recording, with the same indices and the same delay estimates
+
+    the bytes sent by the node in each mode are reported as a rate for the length of the recording.
+
+    usage: python -m pingpong_game.devtools.remote_mic_check recording.wav [--port 9300] [--realtime]
+"""
+import argparse
+from multiprocessing import Process, Queue
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.remote_mic import RemoteSignal, RemoteSignalCapture, accept_node, listen, run_node
+from pingpong_game.sig.signal_capture import preprocess_signal
+from pingpong_game.sig.signal_tools import estimate_delay_at_onset, load_signal
+
+
+def get_delay(cap):
+    return estimate_delay_at_onset(cap[0], cap[1], config["delay_max"], onset_idx=cap.stats.onset_idx)[0]
+
+
+def node_proc(port, mode, fname, realtime, results):
+    results.put(run_node("127.0.0.1", port, mode, fname, realtime=realtime))
+
+
+def receive_raw(node):
+    sig = RemoteSignal(node)
+    blocks = []
+    while True:
+        block = sig.read(node.block_len)
+        if sig.done:
+            # the end of the stream is padded with silence, keep only what was received
+            n_received = sig.frames*sig.channels - sum(len(b) for b in blocks)
+            blocks.append(block[:n_received])
+            break
+        blocks.append(block)
+    return np.concatenate(blocks)
+
+
+def receive_captures(node):
+    sig_cap = RemoteSignalCapture(node).start()
+    sig_cap.thread.join()
+    return sig_cap.caps
+
+
+def run(fname, mode, port, realtime):
+    listener = listen(port, host="127.0.0.1")
+    results = Queue()
+    proc = Process(target=node_proc, args=(port, mode, fname, realtime, results))
+    proc.start()
+    node = accept_node(listener)
+    listener.close()
+    s = time.perf_counter()
+    received = receive_raw(node) if mode == "raw" else receive_captures(node)
+    elapsed = time.perf_counter() - s
+    n_bytes = results.get()
+    proc.join()
+    node.close()
+    return received, n_bytes, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="check the remote microphone protocol on localhost")
+    parser.add_argument("fname", help="two channel wave file")
+    parser.add_argument("--port", type=int, default=config["remote_mic_port"] or 9300)
+    parser.add_argument("--realtime", action="store_true", help="stream the recording in real time")
+    args = parser.parse_args(argv)
+
+    [sig, Fs] = load_signal(args.fname, split_channels=False)
+    seconds = len(sig)/2/Fs
+
+    [received, raw_bytes, elapsed] = run(args.fname, "raw", args.port, args.realtime)
+    print(f"raw: {raw_bytes/seconds/1e3:.1f} kB/s, {elapsed:.1f} s, "
+          f"samples match the recording: {np.array_equal(received, sig)}")
+
+    [caps, cap_bytes, elapsed] = run(args.fname, "captures", args.port, args.realtime)
+    expected = preprocess_signal(args.fname, config["sig_cap_power"]).caps
+    same_indices = [tuple(c[2]) for c in caps] == [tuple(int(i) for i in c[-1]) for c in expected]
+    max_diff = max((np.abs(np.asarray(a[0]) - np.asarray(b[0])).max() for a, b in zip(caps, expected)), default=0)
+    delays = [get_delay(c) for c in caps]
+    expected_delays = [get_delay(c) for c in expected]
+    print(f"captures: {cap_bytes/seconds/1e3:.2f} kB/s ({raw_bytes/max(cap_bytes, 1):.0f}x less), {elapsed:.1f} s, "
+          f"{len(caps)} captures, indices match: {same_indices}, largest sample difference {max_diff:.2g}, "
+          f"delays match: {delays == expected_delays}")
+
+
+if __name__ == "__main__":
+    main()
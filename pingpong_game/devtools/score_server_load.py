@@ -0,0 +1,74 @@
+"""
+    NOTE: this code is not part of the final project. it is a load test for the score server (score_server.py).
+
+    starts a server on a free local port, connects n_clients event stream clients and publishes a new score
+    n_updates times from another thread, much faster than a real game would. every snapshot is published twice
+    to check that unchanged snapshots are dropped. reports how many updates each client received (fewer than
+    published because of the coalescing) and the delay between publishing and receiving the final score.
+
+    usage: python -m pingpong_game.devtools.score_server_load [n_clients] [n_updates]
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+
+from pingpong_game.score_server import ScoreServer
+
+
+async def client(port, n_updates, results):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /events/game HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await writer.drain()
+    n_received = 0
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b"data: "):
+            snapshot = json.loads(line[6:])
+            n_received += 1
+            if snapshot["score"][0] == n_updates:
+                results.append((n_received, time.time() - snapshot["t"]))
+                break
+    writer.close()
+
+
+def publisher(server, n_updates, interval):
+    for i in range(1, n_updates + 1):
+        snapshot = {"score": [i, 0], "t": time.time()}
+        server.publish(snapshot)
+        server.publish(snapshot)
+        time.sleep(interval)
+
+
+async def run(n_clients, n_updates):
+    server = ScoreServer(port=0).start()
+    results = []
+    tasks = [asyncio.create_task(client(server.port, n_updates, results)) for _ in range(n_clients)]
+    # give the clients a moment to connect
+    while server.n_clients < n_clients:
+        await asyncio.sleep(.01)
+    s = time.time()
+    thread = threading.Thread(target=publisher, args=(server, n_updates, .001))
+    thread.start()
+    await asyncio.wait_for(asyncio.gather(*tasks), 30)
+    e = time.time()
+    thread.join()
+    server.stop()
+
+    received = [r[0] for r in results]
+    delays = sorted(r[1] for r in results)
+    print(f"{n_clients} clients, {n_updates} updates published in {e - s:.2f}s")
+    print(f"updates received per client: min {min(received)}, max {max(received)}")
+    print(f"final score delay: median {1000*delays[len(delays)//2]:.1f}ms, max {1000*delays[-1]:.1f}ms")
+
+
+def main(n_clients=500, n_updates=1000):
+    asyncio.run(run(n_clients, n_updates))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args)
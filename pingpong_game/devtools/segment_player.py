@@ -19,9 +19,10 @@ from scipy import signal
 import time
 import wave
 
-from pingpong_game.signal.helper import get_capture_fname
-from pingpong_game.signal.signal_capture import preprocess_signal
-from pingpong_game.signal.signal_tools import load_signal, estimate_delay_cross_corr
+from pingpong_game.devtools.segment_review import SegmentLoader
+from pingpong_game.sig.helper import get_capture_fname
+from pingpong_game.sig.signal_capture import preprocess_signal
+from pingpong_game.sig.signal_tools import memmap_signal, estimate_delay_cross_corr
 
 
 media_dir = "pingpong_game/devtools/media_files"
@@ -31,7 +32,9 @@ video_fname = f"{media_dir}/{media_fname}.mp4"
 audio_fname = f"{media_dir}/{media_fname}.wav"
 cap_fname = f"pingpong_game/devtools/captures/{media_fname}_caps_001.json"
 
-[sig, Fs] = load_signal(audio_fname, split_channels=False)
+# the interleaved samples are memory mapped, playback only reads the parts being played
+[frames, Fs] = memmap_signal(audio_fname)
+sig = frames.reshape(-1)
 audio_segments = preprocess_signal(audio_fname, 100)
 
 mic_diameter_inches = 5
@@ -80,17 +83,19 @@ stream = pa.open(
 
 cap = cv2.VideoCapture(video_fname)
 video_fps = cap.get(cv2.CAP_PROP_FPS)
+cap.release()
 print(f"{video_fps=}")
 
-if (cap.isOpened()== False):
-    print("Error opening video file")
+# video frames of each segment, decoded ahead on a background thread (see segment_review.py)
+video_bounds = [
+    (floor(video_fps*(sig_cap[-1][0]/Fs)), ceil(video_fps*(sig_cap[-1][1]/Fs))) for sig_cap in audio_segments.caps
+]
+loader = SegmentLoader(video_fname, video_bounds)
 
 cap_idx = 0
 while cap_idx < len(audio_segments.caps):
     sig_cap = audio_segments.caps[cap_idx]
-    audio_start, audio_end = sig_cap[-1][0], sig_cap[-1][1]
-    video_start = floor(video_fps*(audio_start/Fs))
-    video_end = ceil(video_fps*(audio_end/Fs))
+    video_start, video_end = video_bounds[cap_idx]
     overlap = get_overlap(
         (video_start, video_end),
         video_segments,
@@ -99,22 +104,13 @@ while cap_idx < len(audio_segments.caps):
         for o in overlap:
             print(o[0], o[1], o[2])
 
-    cap.set(cv2.CAP_PROP_POS_FRAMES, video_start)
-
-    done = False
-
     audio_idx = int((video_start/video_fps)*Fs)*2
     stream.start_stream()
-    while not done:
-        curr_frame = cap.get(cv2.CAP_PROP_POS_FRAMES)
-        if curr_frame >= video_end:
-            done = True
-        ret, frame = cap.read()
-        if ret == True:
-            cv2.imshow('Frame', frame)
-            key_ = cv2.waitKey(25)
-            if (key_ & 0xFF) == ord('q'):
-                done = True
+    for frame in loader.get_frames(cap_idx):
+        cv2.imshow('Frame', frame)
+        key_ = cv2.waitKey(25)
+        if (key_ & 0xFF) == ord('q'):
+            break
     stream.stop_stream()
     print(estimate_delay_cross_corr(sig_cap[0], sig_cap[1], delay_max))
     comm = input('command: [N/r/q]').lower()
@@ -126,7 +122,7 @@ while cap_idx < len(audio_segments.caps):
         break
 
 
-cap.release()
+loader.close()
 cv2.destroyAllWindows()
 
 stream.stop_stream()
@@ -0,0 +1,195 @@
+"""
+    NOTE: this code is not part of the final project. backend for the segment review tools (segment_player.py,
+    play_segment.py) which step through labelled segments of a match video one after another.
+
+    seeking a video capture to a frame (CAP_PROP_POS_FRAMES) means finding the keyframe before it and decoding
+    everything from there, which is what made stepping through segments slow. SegmentLoader instead decodes the
+    segment being reviewed and the next few after it on a background thread, into an LRU cache of decoded frames
+    with a memory budget, so by the time the reviewer moves on the next segment is usually already there.
+    segments are mostly reviewed in order, so the decoder just reads forward from one segment to the next when
+    that is cheaper than seeking. with PyAV installed the keyframes of the video are read once (from the
+    container, without decoding) and stored next to it in <video>.keyframes.json, and a seek is only done when a
+    keyframe between the current position and the next segment makes it cheaper. without PyAV a seek is done
+    when the next segment is more than MAX_GRAB_SECONDS ahead.
+
+    audio snippets for each segment are sliced from the memory mapped wave file (see memmap_signal).
+"""
+from collections import OrderedDict
+import bisect
+import json
+import os
+import threading
+
+import numpy as np
+
+from pingpong_game.sig.signal_tools import memmap_signal
+
+
+# memory budget for decoded frames, and how many segments after the current one are decoded ahead
+MAX_CACHE_BYTES = 1 << 30
+LOOKAHEAD = 4
+# without a keyframe map, read forward instead of seeking when the next segment is at most this far ahead
+MAX_GRAB_SECONDS = 2
+
+
+class FrameCache:
+    '''
+    LRU cache of the decoded frames of each segment, evicting the least recently used segments once the
+    frames take more than max_bytes
+    '''
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        frames = self.entries.get(key)
+        if frames is not None:
+            self.entries.move_to_end(key)
+        return frames
+
+    def put(self, key, frames):
+        if key in self.entries:
+            self.n_bytes -= sum(f.nbytes for f in self.entries.pop(key))
+        self.entries[key] = frames
+        self.n_bytes += sum(f.nbytes for f in frames)
+        # the newest entry is always kept, even if it is over the budget on its own
+        while (self.n_bytes > self.max_bytes) and (len(self.entries) > 1):
+            [_, evicted] = self.entries.popitem(last=False)
+            self.n_bytes -= sum(f.nbytes for f in evicted)
+
+
+def get_keyframes(video_fname):
+    '''
+    sorted frame indices of the keyframes of a video, read with PyAV and stored next to the video.
+    None if PyAV isn't installed
+    '''
+    index_fname = f"{video_fname}.keyframes.json"
+    st = os.stat(video_fname)
+    if os.path.exists(index_fname):
+        with open(index_fname) as f:
+            index = json.load(f)
+        if (index["size"] == st.st_size) and (index["mtime"] == st.st_mtime):
+            return index["keyframes"]
+    try:
+        import av
+    except ImportError:
+        return None
+    keyframes = []
+    with av.open(video_fname) as container:
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate)
+        # only the packets are read, nothing is decoded
+        for packet in container.demux(stream):
+            if packet.is_keyframe and (packet.pts is not None):
+                keyframes.append(int(round(float(packet.pts*stream.time_base)*fps)))
+    keyframes.sort()
+    with open(index_fname, "w") as f:
+        json.dump({"size": st.st_size, "mtime": st.st_mtime, "keyframes": keyframes}, f)
+    return keyframes
+
+
+class SegmentLoader:
+    '''
+    decoded frames and audio of the segments of a video, segments is a list of (start_frame, end_frame).
+    get_frames(idx) returns the frames of segment idx, waiting for them if they haven't been decoded yet,
+    and makes the background thread decode the LOOKAHEAD segments after it next
+    '''
+    def __init__(self, video_fname, segments, audio_fname=None, max_bytes=MAX_CACHE_BYTES, lookahead=LOOKAHEAD):
+        import cv2
+        self.cv2 = cv2
+        self.segments = [(int(s), int(e)) for s, e in segments]
+        self.video = cv2.VideoCapture(video_fname)
+        if not self.video.isOpened():
+            raise ValueError(f"could not open {video_fname}")
+        self.fps = self.video.get(cv2.CAP_PROP_FPS)
+        self.keyframes = get_keyframes(video_fname)
+        self.max_grab = int(MAX_GRAB_SECONDS*self.fps)
+        # frame index of the next frame read() returns
+        self.pos = 0
+        self.audio = None
+        if audio_fname is not None:
+            [self.audio, self.Fs] = memmap_signal(audio_fname)
+        self.cache = FrameCache(max_bytes)
+        self.lookahead = lookahead
+        self.current = 0
+        self.n_seeks = 0
+        self.condition = threading.Condition()
+        self.done = False
+        self.thread = threading.Thread(target=self.decode_thread, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        with self.condition:
+            self.done = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.video.release()
+
+    def get_frames(self, idx):
+        with self.condition:
+            self.current = idx
+            self.condition.notify_all()
+            while (idx not in self.cache) and (not self.done):
+                self.condition.wait()
+            return self.cache.get(idx)
+
+    def get_audio(self, idx):
+        '''
+        audio of segment idx, shape (n_frames, n_channels), sliced from the memory mapped wave file
+        '''
+        start, end = self.segments[idx]
+        return np.array(self.audio[int(start/self.fps*self.Fs):int(end/self.fps*self.Fs)])
+
+    def next_to_decode(self):
+        # the current segment first, then the ones after it in order
+        for idx in range(self.current, min(self.current + self.lookahead + 1, len(self.segments))):
+            if idx not in self.cache:
+                return idx
+        return None
+
+    def should_seek(self, start):
+        if start < self.pos:
+            return True
+        if self.keyframes is None:
+            return start - self.pos > self.max_grab
+        # seek if there is a keyframe after the current position that is at or before the start
+        i = bisect.bisect_right(self.keyframes, start)
+        return (i > 0) and (self.keyframes[i - 1] > self.pos)
+
+    def decode(self, start, end):
+        cv2 = self.cv2
+        if self.should_seek(start):
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, start)
+            self.pos = start
+            self.n_seeks += 1
+        # skip to the start without converting the frames in between
+        while self.pos < start:
+            if not self.video.grab():
+                return []
+            self.pos += 1
+        frames = []
+        while self.pos < end:
+            [ret, frame] = self.video.read()
+            if not ret:
+                break
+            self.pos += 1
+            frames.append(frame)
+        return frames
+
+    def decode_thread(self):
+        while True:
+            with self.condition:
+                idx = self.next_to_decode()
+                while (idx is None) and (not self.done):
+                    self.condition.wait()
+                    idx = self.next_to_decode()
+                if self.done:
+                    return
+            frames = self.decode(*self.segments[idx])
+            with self.condition:
+                self.cache.put(idx, frames)
+                self.condition.notify_all()
@@ -0,0 +1,111 @@
+"""
+    NOTE: this code is not part of the final project. checks the segmented recording mode
+    (pingpong_game/recording.py) on a recording, without an audio interface.
+
+    the recording is written block by block through a SegmentedRecorder with short segments, like the audio
+    thread of __main__.py does with config["recording_mode"] = "segmented", then read back through
+    SegmentedSession:
+
+        segments    every segment but the last must be exactly segment_len frames and start where the index says
+        seeking     spans read at random points (many of them across a segment boundary) must equal the
+                    recording, the time per read is reported
+        crash       a second recording is left open as if the game had crashed between header updates. the
+                    session must still read the whole of it, and after repair the last segment must be readable
+                    by the wave module in full
+
+    usage: python -m pingpong_game.devtools.segmented_recording_check recording.wav [--segment-seconds 60]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.recording import SegmentedRecorder, SegmentedSession
+from pingpong_game.sig.signal_tools import load_signal
+
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+
+
+def record(sig, fname, segment_seconds, n_frames=None):
+    '''
+    write the first n_frames of sig (all of it by default) through a SegmentedRecorder in blocks,
+    returns the recorder
+    '''
+    recorder = SegmentedRecorder(fname, Fs, segment_seconds=segment_seconds)
+    n_frames = len(sig) if n_frames is None else n_frames
+    # the audio thread reads 2*BLOCK_LEN interleaved samples at a time
+    for lb in range(0, n_frames, BLOCK_LEN):
+        recorder.write(sig[lb:min(lb + BLOCK_LEN, n_frames)].ravel())
+    return recorder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="check the segmented recording mode on a recording")
+    parser.add_argument("fname", help="two channel wave file")
+    parser.add_argument("--segment-seconds", type=float, default=60)
+    parser.add_argument("--reads", type=int, default=1000, help="number of random spans read back")
+    args = parser.parse_args(argv)
+
+    [sig, _] = load_signal(args.fname, split_channels=False)
+    sig = sig.reshape(-1, 2)
+    tmp_dir = tempfile.mkdtemp()
+
+    s = time.perf_counter()
+    recorder = record(sig, os.path.join(tmp_dir, "game-output.wav"), args.segment_seconds)
+    recorder.close()
+    elapsed = time.perf_counter() - s
+    session = SegmentedSession(recorder.path)
+    lengths = [seg["n_frames"] for seg in session.segments]
+    aligned = (all(n == session.segment_len for n in lengths[:-1])
+               and session.starts == [i*session.segment_len for i in range(len(lengths))])
+    print(f"{len(session.segments)} segments written in {elapsed:.1f} s, {session.n_frames} frames "
+          f"(recording {len(sig)}), segments aligned: {aligned}")
+
+    rng = np.random.default_rng(0)
+    n = Fs
+    # half of the spans straddle a segment boundary
+    starts = rng.integers(0, len(sig) - n, args.reads)
+    boundaries = np.array(session.starts[1:] or [n])
+    starts[::2] = np.clip(rng.choice(boundaries, len(starts[::2])) - n//2, 0, len(sig) - n)
+    timings = []
+    matches = True
+    for start in starts:
+        t = time.perf_counter()
+        frames = session.read(int(start), n)
+        timings.append(time.perf_counter() - t)
+        matches &= np.array_equal(frames, sig[start:start + n])
+    print(f"{args.reads} reads of 1 s, median {1e6*np.median(timings):.0f} us, max {1e6*max(timings):.0f} us, "
+          f"match the recording: {matches}")
+
+    # stop half way through the second segment (if there is one) and half way between two header updates
+    segment_len = int(args.segment_seconds*Fs)
+    header_interval = int(config["recording_header_interval"]*Fs)
+    n_crash = min(len(sig) - header_interval, segment_len + segment_len//2)
+    n_crash += header_interval//2 - n_crash % header_interval
+    crashed = record(sig, os.path.join(tmp_dir, "crash.wav"), args.segment_seconds, n_frames=n_crash)
+    crashed.file.flush()
+    crashed.index.flush()
+    session = SegmentedSession(crashed.path)
+    whole = np.array_equal(session.read(0, n_crash), sig[:n_crash]) and (session.n_frames == n_crash)
+    last = os.path.join(crashed.path, session.segments[-1]["file"])
+    with wave.open(last) as w:
+        before = w.getnframes()
+    repaired = session.repair()
+    with wave.open(last) as w:
+        after = w.getnframes()
+    print(f"crashed session read in full: {whole}, last segment header {before} frames before repair, "
+          f"{after} after (of {session.segments[-1]['n_frames']}), repaired {repaired}")
+    # the recorder is still open, close it before the files are removed
+    crashed.close()
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
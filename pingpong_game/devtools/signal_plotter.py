@@ -13,12 +13,14 @@ from matplotlib import pyplot, animation
 import matplotlib.patches as patches
 import numpy as np
 from pyaudio import PyAudio, paInt16
-from scipy import signal
 
-from signal_tools import load_signal
+from pingpong_game.sig.envelope import load_envelope_pyramid
+from pingpong_game.sig.signal_cache import load_filtered_signal
+from pingpong_game.sig.signal_tools import load_signal
 
+audio_fname = 'pingpong_game/devtools/media_files/pp_003.wav'
 pa = PyAudio()
-[sig, Fs] = load_signal('media_files/pp_003.wav', False)
+[sig, Fs] = load_signal(audio_fname, False)
 
 block_time = .1
 block_len = int(block_time*Fs)
@@ -33,29 +35,24 @@ stream = pa.open(
     frames_per_buffer=block_len,
 )
 
-lch = sig[::2]
-rch = sig[1::2]
-
-fcl = 2 * (8_000/Fs) # was 100
-fch = 2 * (10_000/Fs)
-fc = [fcl, fch]
-K = 6
-[b,a] = signal.cheby1(K, .5, fc, 'bandpass')
-lch = signal.lfilter(b,a,lch)
-rch = signal.lfilter(b,a,rch)
+# filtered channels come from the signal cache so re-running the plotter doesn't re-filter the whole file
+[lch, rch, _] = load_filtered_signal(audio_fname, low=8_000, high=10_000, K=6, polarity=1)
 
 y_lim = max(
     np.mean(np.abs(lch[np.where(lch > 500)])),
     np.mean(np.abs(rch[np.where(rch > 500)])),
 )
-ts = np.arange(len(lch))/Fs
 
 fig, ax = pyplot.subplots(1)
 fig.set_size_inches(15,8)
 print(len(lch))
 
-[g1] = ax.plot(ts, lch-100)
-[g2] = ax.plot(ts, rch+200)
+# draw the min/max envelope at about one point per pixel instead of every sample, see sig/envelope.py
+pyramid = load_envelope_pyramid(audio_fname, low=8_000, high=10_000, polarity=1)
+[idx, mins, maxs] = pyramid.get_span(0, len(lch), int(fig.get_size_inches()[0]*fig.dpi))
+ts = np.repeat(idx/Fs, 2)
+[g1] = ax.plot(ts, np.stack([mins[:, 0], maxs[:, 0]], axis=1).ravel()-100)
+[g2] = ax.plot(ts, np.stack([mins[:, 1], maxs[:, 1]], axis=1).ravel()+200)
 
 ax.set_ylim(-y_lim, y_lim)
 rect = patches.Rectangle(
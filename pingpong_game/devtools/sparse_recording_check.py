@@ -0,0 +1,113 @@
+"""
+    NOTE: this code is not part of the final project. checks the sparse recording mode (pingpong_game/recording.py)
+    on a recording, without an audio interface.
+
+    the recording is fed block by block through the signal capture and a SparseRecorder, like the audio thread
+    of __main__.py does with config["recording_mode"] = "sparse", and the session is then rebuilt from the sparse
+    file. the rebuilt file must be as long as the recording, equal to it inside the segments and silent outside
+    them, and every capture must lie inside a segment. the size of the sparse file and its index is reported
+    against the size of a full recording. with --dsp the recording is played in real time through the dsp
+    process instead.
+
+    usage: python -m pingpong_game.devtools.sparse_recording_check recording.wav [--dsp]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.dsp_process import DspFrontEnd
+from pingpong_game.recording import SparseRecorder, get_index_fname, read_index, rebuild
+from pingpong_game.sig.multirate import get_signal_capture
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter, load_signal
+
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+
+
+def record_threaded(fname, recorder):
+    '''
+    the audio thread of __main__.py reading from a file, returns the captures
+    '''
+    sig = FileSignal(fname)
+    sig_cap = get_signal_capture(Fs, use_lock=False)
+    filt = None
+    if config["front_end"] == "full":
+        filt = PingPongFilter(config["filter_low_thresh"], config["filter_high_thresh"], Fs, K=6)
+    audio_idx = 0
+    while not sig.done:
+        data = sig.read(2*BLOCK_LEN)
+        n = (len(data)//2 // SIG_CAP_WINDOW_LEN) * SIG_CAP_WINDOW_LEN
+        lch = data[:2*n:2]
+        rch = data[1:2*n:2] * config["polarity"]
+        if filt is not None:
+            [lch, rch] = filt.filter(lch, rch)
+        n_detected = sig_cap.n_captures + sig_cap.n_rejected
+        sig_cap.process(lch, rch, frame_offset=audio_idx)
+        active = sig_cap.is_capturing or (sig_cap.n_captures + sig_cap.n_rejected != n_detected)
+        recorder.write(data, active)
+        audio_idx += len(data)//2
+    sig.close()
+    return sig_cap.caps
+
+
+def record_dsp(fname, recorder):
+    '''
+    the dsp process playing the file in real time, returns the captures
+    '''
+    dsp = DspFrontEnd(recorder, source=fname)
+    dsp.start()
+    while dsp.dsp_state["done"] == 0:
+        time.sleep(.1)
+    dsp.stop()
+    return dsp.sig_cap.caps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="check the sparse recording mode on a recording")
+    parser.add_argument("fname", help="two channel wave file")
+    parser.add_argument("--dsp", action="store_true", help="record through the dsp process in real time")
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp()
+    sparse_fname = os.path.join(tmp_dir, "sparse.wav")
+    rebuilt_fname = os.path.join(tmp_dir, "rebuilt.wav")
+    recorder = SparseRecorder(sparse_fname, Fs)
+    s = time.perf_counter()
+    caps = record_dsp(args.fname, recorder) if args.dsp else record_threaded(args.fname, recorder)
+    recorder.close()
+    elapsed = time.perf_counter() - s
+
+    [sig, _] = load_signal(args.fname, split_channels=False)
+    sig = sig.reshape(-1, 2)
+    [_, segments, n_frames] = read_index(sparse_fname)
+    rebuild(sparse_fname, rebuilt_fname)
+    [rebuilt, _] = load_signal(rebuilt_fname, split_channels=False)
+    rebuilt = rebuilt.reshape(-1, 2)
+
+    inside = np.zeros(len(sig), dtype=bool)
+    for segment in segments:
+        inside[segment["start"]:segment["start"] + segment["n_frames"]] = True
+    matches = (len(rebuilt) == len(sig)) and np.array_equal(rebuilt[inside], sig[inside])
+    silent = not rebuilt[~inside].any() if len(rebuilt) == len(sig) else False
+    covered = all(inside[int(c[2][0]):int(c[2][1])].all() for c in caps)
+
+    full_bytes = 2*sig.size
+    sparse_bytes = os.path.getsize(sparse_fname) + os.path.getsize(get_index_fname(sparse_fname))
+    print(f"{len(caps)} captures in {len(segments)} segments, {elapsed:.1f} s")
+    print(f"sparse recording {sparse_bytes/1e6:.2f} MB of {full_bytes/1e6:.2f} MB "
+          f"({100*(1 - sparse_bytes/full_bytes):.1f}% less)")
+    print(f"session length {n_frames} frames (recording {len(sig)}), segments match the recording: {matches}, "
+          f"silent between segments: {silent}, captures inside segments: {covered}")
+    for f in [sparse_fname, get_index_fname(sparse_fname), rebuilt_fname]:
+        os.remove(f)
+    os.rmdir(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+    NOTE: this code is not part of the final project. spectral survey of the sounds in one or more recordings,
+    used to pick the filter band (filter_low_thresh / filter_high_thresh in the config file) for a new table,
+    ball or microphone setup.
+
+    captures are found with the usual signal capture on the recording filtered to a wide detection band
+    (--detect-band, 1-20 kHz by default) rather than the configured filter band, so sounds whose energy lies
+    outside the current band are still found and don't bias the survey towards it. a fixed length segment of
+    the unfiltered recording starting a little before the onset of each capture is taken from both channels.
+    all segments are windowed and transformed together at one fft size with scipy.fft's worker threads, in
+    batches so thousands of captures don't need all their spectra in memory at once. the results are:
+
+        spectrum.png    mean and 10th/50th/90th percentile power spectrum over all captures and channels
+        bands.csv       energy of each capture (both channels) in each band of band_width Hz
+        summary         printed: number of captures, peak frequency of the median spectrum and the band around
+                        it within 6 dB of the peak, a starting point for the filter band
+
+    usage: python -m pingpong_game.devtools.spectral_survey recording.wav [recording2.wav ...]
+           [--nfft 2048] [--band-width 1000] [--detect-band 1000 20000] [--workers -1] [--output-dir survey]
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.signal_capture import preprocess_signal
+from pingpong_game.sig.signal_tools import load_signal
+
+
+PRE_ROLL = config["onset_pre_roll"]
+BATCH_SIZE = 1024
+# band in Hz of the filter applied before detecting captures
+DETECT_BAND = (1000, 20000)
+
+
+def get_segments(fname, nfft, power, detect_band=DETECT_BAND):
+    '''
+    fixed length segments of the unfiltered channels starting PRE_ROLL samples before the onset of each capture,
+    captures are detected on the channels filtered to detect_band (low, high) in Hz.
+    returns (segments of shape (n_caps, 2, nfft), capture indices, Fs)
+    '''
+    [lch, rch, Fs] = load_signal(fname)
+    sig_cap = preprocess_signal(fname, power, low=detect_band[0], high=detect_band[1])
+    segments = []
+    indices = []
+    for cap in sig_cap.caps:
+        # frame index of the onset in the recording, the capture array starts stats.offset samples before cap[-1][0]
+        onset = cap[-1][0] - cap.stats.offset + cap.stats.onset_idx
+        lb = min(max(0, onset - PRE_ROLL), max(0, len(lch) - nfft))
+        segment = np.zeros((2, nfft))
+        n = min(nfft, len(lch) - lb)
+        segment[0, :n] = lch[lb:lb + n]
+        segment[1, :n] = rch[lb:lb + n]
+        segments.append(segment)
+        indices.append(tuple(int(i) for i in cap[-1]))
+    return np.array(segments).reshape(-1, 2, nfft), indices, Fs
+
+
+def get_power_spectra(segments, workers=-1):
+    '''
+    power spectrum of every segment of every capture, shape (n_caps, 2, nfft//2 + 1),
+    computed in batches with all cores
+    '''
+    from scipy import fft
+    nfft = segments.shape[-1]
+    window = np.hanning(nfft)
+    power = np.empty(segments.shape[:2] + (nfft//2 + 1,))
+    for lb in range(0, len(segments), BATCH_SIZE):
+        X = fft.rfft(segments[lb:lb + BATCH_SIZE]*window, axis=-1, workers=workers)
+        power[lb:lb + BATCH_SIZE] = np.abs(X)**2
+    return power
+
+
+def get_band_energy(power, freqs, band_width):
+    '''
+    energy of each capture and channel in consecutive bands of band_width Hz, shape (n_caps, 2, n_bands)
+    '''
+    band_idx = (freqs // band_width).astype(int)
+    n_bands = band_idx.max() + 1
+    energy = np.zeros(power.shape[:2] + (n_bands,))
+    for band in range(n_bands):
+        energy[..., band] = power[..., band_idx == band].sum(axis=-1)
+    return energy
+
+
+def get_peak_band(median_db, freqs, drop_db=6):
+    '''
+    peak frequency of the median spectrum and the contiguous band around it within drop_db of the peak
+    '''
+    peak = median_db.argmax()
+    lb = peak
+    while (lb > 0) and (median_db[lb - 1] >= median_db[peak] - drop_db):
+        lb -= 1
+    ub = peak
+    while (ub < len(median_db) - 1) and (median_db[ub + 1] >= median_db[peak] - drop_db):
+        ub += 1
+    return freqs[peak], freqs[lb], freqs[ub]
+
+
+def save_plot(fname, freqs, mean_db, percentiles_db):
+    from matplotlib import use
+    use("Agg")
+    from matplotlib import pyplot
+    fig, ax = pyplot.subplots(figsize=(10, 5))
+    ax.plot(freqs, mean_db, label="mean", color="black")
+    for q, spectrum_db in percentiles_db.items():
+        ax.plot(freqs, spectrum_db, label=f"{q}th percentile", alpha=.7)
+    ax.set_xlabel("frequency (Hz)")
+    ax.set_ylabel("power (dB)")
+    ax.legend()
+    ax.grid(alpha=.3)
+    fig.tight_layout()
+    fig.savefig(fname)
+    pyplot.close(fig)
+
+
+def save_band_table(fname, rows, freqs_per_band, band_width):
+    with open(fname, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["fname", "start", "stop"]
+            + [f"{b*band_width}-{(b + 1)*band_width}" for b in range(freqs_per_band)]
+        )
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="spectral survey of the captured sounds in recordings")
+    parser.add_argument("fnames", nargs="+", help="two channel wave files")
+    parser.add_argument("--nfft", type=int, default=2048, help="fft size, also the length of each segment")
+    parser.add_argument("--band-width", type=int, default=1000, help="width in Hz of the bands in bands.csv")
+    parser.add_argument("--power", type=float, default=config["sig_cap_power"], help="capture power threshold")
+    parser.add_argument(
+        "--detect-band", type=float, nargs=2, default=DETECT_BAND, metavar=("LOW", "HIGH"),
+        help="band in Hz the recording is filtered to before detecting captures",
+    )
+    parser.add_argument("--workers", type=int, default=-1, help="scipy.fft worker threads, -1 for all cores")
+    parser.add_argument("--output-dir", default="survey", help="directory for spectrum.png and bands.csv")
+    args = parser.parse_args(argv)
+
+    all_power = []
+    rows = []
+    Fs = None
+    for fname in args.fnames:
+        segments, indices, Fs = get_segments(fname, args.nfft, args.power, args.detect_band)
+        if len(segments) == 0:
+            print(f"{fname}: no captures")
+            continue
+        power = get_power_spectra(segments, args.workers)
+        freqs = np.fft.rfftfreq(args.nfft, 1/Fs)
+        energy = get_band_energy(power, freqs, args.band_width)
+        for (start, stop), cap_energy in zip(indices, energy):
+            rows.append([fname, start, stop] + [float(e) for e in cap_energy.sum(axis=0)])
+        all_power.append(power)
+        print(f"{fname}: {len(segments)} captures")
+    if not all_power:
+        return
+
+    # every channel of every capture counts as one observation
+    power = np.concatenate(all_power).reshape(-1, args.nfft//2 + 1)
+    freqs = np.fft.rfftfreq(args.nfft, 1/Fs)
+    db = 10*np.log10(power + 1e-12)
+    mean_db = 10*np.log10(power.mean(axis=0) + 1e-12)
+    percentiles_db = dict(zip([10, 50, 90], np.percentile(db, [10, 50, 90], axis=0)))
+    [peak, low, high] = get_peak_band(percentiles_db[50], freqs)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    save_plot(os.path.join(args.output_dir, "spectrum.png"), freqs, mean_db, percentiles_db)
+    save_band_table(
+        os.path.join(args.output_dir, "bands.csv"), rows, len(rows[0]) - 3, args.band_width
+    )
+    print(f"{len(rows)} captures, median spectrum peaks at {peak:.0f} Hz, "
+          f"within 6 dB from {low:.0f} to {high:.0f} Hz")
+    print(f"wrote {args.output_dir}/spectrum.png and {args.output_dir}/bands.csv")
+
+
+if __name__ == "__main__":
+    main()
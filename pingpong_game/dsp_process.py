@@ -0,0 +1,253 @@
+'''
+    runs the audio front end of the realtime game (reading the device, filtering, capture detection and handing
+    the audio to the recorder) in a process of its own, selected with config["dsp_process"]. in the threaded
+    game the audio thread shares the interpreter with the tk loop and the game thread, and when those are busy it
+    waits for the GIL and falls behind the device. a separate process has its own interpreter, so how quickly a
+    capture is detected doesn't depend on how busy the interface is.
+
+        dsp process         reads each block from the device, writes it to the sample ring, filters it and runs the
+                            signal capture over it. the samples of each capture are written to the capture ring
+                            and a short message (where the capture is in the ring, its start and stop index, its
+                            stats and when the block that finished it was read) is sent down a pipe
+        receiver thread     in the game process, waits on the pipe, copies each capture out of the capture ring
+                            and hands it to the game through the usual condition (see ProcessSignalCapture)
+        recorder thread     in the game process, copies the sample ring to the recorder (see recording.py). the
+                            ring has a third channel saying whether each block was active, i.e. whether a sound
+                            was being captured or finished in it
+
+    the rings and the pause and quit flags are in shared memory (see shared_state.py), so only the messages are
+    pickled. the dsp process reads the flags every block, pausing turns off the capture like in the audio thread.
+    the dsp process reports its progress in a second control block, which only it writes.
+
+    devtools/dsp_latency.py compares the time from a block being read to its capture reaching the game in both
+    modes while the game process is kept busy.
+'''
+import logging
+from multiprocessing import Pipe, Process
+from threading import Condition, Thread
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.shared_state import SharedControl, SharedRing
+from pingpong_game.sig.kernels import warm_up
+from pingpong_game.sig.multirate import get_signal_capture
+from pingpong_game.sig.signal_capture import Capture, get_capture_gate
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter, StreamSignal
+
+
+log = logging.getLogger()
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
+DSP_RING_SECONDS = config["dsp_ring_seconds"]
+filter_low_thresh = config["filter_low_thresh"]
+filter_high_thresh = config["filter_high_thresh"]
+K = 6
+
+# flags written by the game process and read by the dsp process
+CONTROL_FIELDS = ("pause", "quit")
+# progress of the dsp process, written only by the dsp process
+DSP_STATE_FIELDS = ("frames", "n_captures", "n_rejected", "done")
+
+
+def dsp_process_func(source, control, dsp_state, sample_ring, capture_ring, conn):
+    '''
+    body of the dsp process, the same loop as the audio thread in __main__.py. source is None for the audio
+    device or the name of a wave file played in real time
+    '''
+    # compile the capture kernels before the device is opened, see sig/kernels.py
+    warm_up()
+    if source is None:
+        sig = StreamSignal(frames_per_buffer=5*256)
+    else:
+        sig = FileSignal(source, realtime=True)
+    sig_cap = get_signal_capture(Fs, use_lock=False)
+    # with the multirate front end the signal capture object takes the unfiltered signal
+    filt = None
+    if config["front_end"] == "full":
+        filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
+    audio_idx = 0
+    try:
+        while (control["quit"] == 0) and (not getattr(sig, "done", False)):
+            sig_cap.do_capture = control["pause"] == 0
+            data = sig.read(2*BLOCK_LEN)
+            read_ns = time.monotonic_ns()
+            # drop any partial window, which only happens at the end of a file
+            n = (len(data)//2 // SIG_CAP_WINDOW_LEN) * SIG_CAP_WINDOW_LEN
+            lch = data[:2*n:2]
+            rch = data[1:2*n:2] * config["polarity"]
+            if filt is not None:
+                [lch, rch] = filt.filter(lch, rch)
+            n_detected = sig_cap.n_captures + sig_cap.n_rejected
+            sig_cap.process(lch, rch, frame_offset=audio_idx)
+            active = sig_cap.is_capturing or (sig_cap.n_captures + sig_cap.n_rejected != n_detected)
+            frames = data.reshape(-1, 2)
+            sample_ring.write(np.column_stack([frames, np.full(len(frames), active, dtype=np.int16)]))
+            audio_idx += len(data)//2
+            for cap in sig_cap.caps:
+                pos = capture_ring.write_pos
+                capture_ring.write(np.stack([cap[0], cap[1]], axis=1))
+                conn.send((pos, len(cap[0]), cap[2], cap.stats, read_ns))
+            sig_cap.caps = []
+            dsp_state.write(frames=audio_idx, n_captures=sig_cap.n_captures, n_rejected=sig_cap.n_rejected)
+    finally:
+        dsp_state.write(done=1)
+        conn.send(None)
+        conn.close()
+        sig.close()
+
+
+class ProcessSignalCapture:
+    '''
+    stands in for the signal capture object in the game process, with the parts of the SignalCapture interface
+    the game uses. captures arrive from the dsp process on the receiver thread, each with read_ns set to the
+    time.monotonic_ns at which the block that finished it was read
+    '''
+    def __init__(self, dsp_state, capture_ring, conn, gate=None):
+        self.dsp_state = dsp_state
+        self.capture_ring = capture_ring
+        self.conn = conn
+        self.gate = gate
+        self.condition = Condition()
+        self.caps = []
+        self.consumed_caps = []
+        self.capture_ready = False
+        self.n_lost = 0
+
+    @property
+    def n_captures(self):
+        return self.dsp_state["n_captures"]
+
+    @property
+    def n_rejected(self):
+        return self.dsp_state["n_rejected"]
+
+    def clear_captures(self):
+        '''
+        drop the captures that haven't been consumed. a capture in progress in the dsp process is not affected,
+        the game pauses the capture around the places it clears them
+        '''
+        with self.condition:
+            self.caps = []
+            self.capture_ready = False
+
+    def get_next_capture(self):
+        capture = self.caps.pop(0)
+        self.consumed_caps.append(capture)
+        if len(self.caps) == 0:
+            self.capture_ready = False
+        return capture
+
+    def receive_thread(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                # the dsp process exited without saying so
+                break
+            if message is None:
+                break
+            [pos, n, indices, stats, read_ns] = message
+            frames = self.capture_ring.read(pos, n)
+            if (frames is None) or (len(frames) < n):
+                # the ring holds many captures, this means the game process stalled for a long time
+                self.n_lost += 1
+                log.warning(f"capture {indices} overwritten before it was received")
+                continue
+            cap = Capture([frames[:, 0].copy(), frames[:, 1].copy(), indices], stats=stats, Fs=Fs)
+            cap.read_ns = read_ns
+            with self.condition:
+                self.caps.append(cap)
+                self.capture_ready = True
+                self.condition.notify()
+
+
+def write_frames(recorder, frames):
+    '''
+    hand frames read from the sample ring to the recorder, in runs of blocks with the same active flag
+    '''
+    active = frames[:, 2]
+    bounds = [0] + list(np.flatnonzero(np.diff(active)) + 1) + [len(frames)]
+    for lb, ub in zip(bounds[:-1], bounds[1:]):
+        recorder.write(np.ascontiguousarray(frames[lb:ub, :2]), bool(active[lb]))
+
+
+def record_thread_func(sample_ring, dsp_state, recorder):
+    '''
+    copy the sample ring to the recorder until the dsp process is done. if the recorder thread falls more than
+    the length of the ring behind, the lost frames are written as silence so the recording stays aligned with the
+    sample indices of the captures
+    '''
+    pos = 0
+    while True:
+        done = dsp_state["done"]
+        write_pos = sample_ring.write_pos
+        while pos < write_pos:
+            frames = sample_ring.read(pos, write_pos - pos)
+            if frames is None:
+                lost = sample_ring.start_pos - pos
+                if lost <= 0:
+                    continue
+                log.warning(f"recorder fell behind, {lost} frames lost")
+                recorder.write(np.zeros((lost, 2), dtype=np.int16))
+                pos += lost
+                continue
+            write_frames(recorder, frames)
+            pos += len(frames)
+        if done:
+            break
+        time.sleep(BLOCK_LEN/Fs)
+
+
+class DspFrontEnd:
+    '''
+    the dsp process and the threads of the game process that talk to it. pause and quit have the value
+    attribute of a multiprocessing.Value and are given to the scoreboard, sig_cap is given to the game.
+    recorder is the recorder for the audio (see recording.py), or None
+    '''
+    def __init__(self, recorder=None, source=None):
+        self.control = SharedControl(CONTROL_FIELDS)
+        self.pause = self.control.field("pause")
+        self.quit = self.control.field("quit")
+        self.dsp_state = SharedControl(DSP_STATE_FIELDS)
+        # left, right and the active flag of each frame's block
+        self.sample_ring = SharedRing(3, int(DSP_RING_SECONDS*Fs))
+        # captures are at most the length of the signal capture's buffer, this holds several of the longest
+        self.capture_ring = SharedRing(2, 8*MAX_SIG_BUFFER_LEN, dtype=np.float64)
+        [recv_conn, self.send_conn] = Pipe(duplex=False)
+        self.sig_cap = ProcessSignalCapture(self.dsp_state, self.capture_ring, recv_conn, gate=get_capture_gate())
+        self.recorder = recorder
+        self.process = Process(
+            target=dsp_process_func,
+            args=(source, self.control, self.dsp_state, self.sample_ring, self.capture_ring, self.send_conn),
+            daemon=True,
+        )
+        self.threads = []
+
+    def start(self):
+        self.process.start()
+        # the dsp process has its own copy, closing this one lets the receiver see the pipe close if it exits
+        self.send_conn.close()
+        self.threads.append(Thread(target=self.sig_cap.receive_thread, daemon=True))
+        if self.recorder is not None:
+            self.threads.append(
+                Thread(target=record_thread_func, args=(self.sample_ring, self.dsp_state, self.recorder))
+            )
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        '''
+        stop the dsp process if it is still running, wait for the recording to be written and free the shared memory
+        '''
+        self.quit.value = 1
+        self.process.join()
+        for thread in self.threads:
+            thread.join()
+        for shared in [self.control, self.dsp_state, self.sample_ring, self.capture_ring]:
+            shared.close()
@@ -0,0 +1,179 @@
+'''
+    append-only log of everything that happens in a game: captures (sample indices, rms, delay and angle), game
+    events, state transitions and score changes. records are put on a queue by the game threads and written as
+    json lines by a background thread which flushes the file periodically, so logging costs the game thread little
+    more than a queue put. each record has a type, the game clock time in seconds and the record's fields, e.g.
+
+        {"indices":[590880,592320],"rms":412.7,"accepted":true,"type":"capture","t":12.31}
+        {"player":2,"etype":"contact_event","indices":[590880,592320],"delay":-7,"angle":-61.2,"type":"event","t":12.31}
+
+    the log can be replayed to rebuild the state of the game at any point, which is useful for going over
+    disputed points without having to record and re-analyze the full audio.
+
+    usage: python -m pingpong_game.event_log game-log.jsonl [--until seconds]
+'''
+import argparse
+import json
+import queue
+import threading
+import time
+
+from pingpong_game.player import Player
+from pingpong_game.state_machine import Event, GameState, StartState
+
+
+class EventLog:
+    '''
+    writes log records to fname from a background thread. the clock is used to timestamp records,
+    by default the time is seconds since the log was opened. unless append is False, records are
+    added to the end of an existing log
+    '''
+    def __init__(self, fname, clock=None, flush_interval=1.0, append=True):
+        self.fname = fname
+        self.clock = clock
+        self.start_time = time.time()
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.file = open(fname, "a" if append else "w")
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def now(self):
+        if self.clock is not None:
+            return self.clock.time()
+        return time.time() - self.start_time
+
+    def log(self, record_type, **fields):
+        '''
+        queue a record to be written. fields must be json serializable
+        '''
+        fields["type"] = record_type
+        fields["t"] = round(self.now(), 4)
+        self.queue.put(fields)
+
+    def _writer(self):
+        last_flush = time.time()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is not None:
+                if record is StopIteration:
+                    break
+                self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            if time.time() - last_flush >= self.flush_interval:
+                self.file.flush()
+                last_flush = time.time()
+        self.file.flush()
+
+    def close(self):
+        '''
+        write any queued records and close the file
+        '''
+        self.queue.put(StopIteration)
+        self.thread.join()
+        self.file.close()
+
+
+def read_log(fname):
+    '''
+    return the list of records in a log file, skipping a partially written last line
+    '''
+    records = []
+    with open(fname) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+class ReplayState:
+    '''
+    state of a game rebuilt from the records of a log
+    '''
+    def __init__(self):
+        self.players = {}
+        self.game_state = None
+        self.current_state = None
+        self.score = [0, 0]
+        self.t = 0
+        self.n_captures = 0
+        self.n_rejected = 0
+        self.n_gated = 0
+
+    def apply(self, record):
+        '''
+        update the state with the next record in the log
+        '''
+        self.t = record["t"]
+        rtype = record["type"]
+        # captures rejected by the signal capture's gate never reach the game, only their count is logged
+        self.n_gated = record.get("rejected", self.n_gated)
+        if rtype == "players":
+            # a players record starts a new game, e.g. when a log is appended to by a later session
+            self.game_state = None
+            self.score = [0, 0]
+            for p in record["players"]:
+                self.players[p["id"]] = Player(id=p["id"], name=p["name"], position=p["position"])
+        elif rtype == "start":
+            p1, p2 = self.players[1], self.players[2]
+            if self.game_state is None:
+                self.game_state = GameState(p1, p2)
+            self.current_state = StartState(self.players[record["player"]])
+        elif rtype == "capture":
+            self.n_captures += 1
+            if not record["accepted"]:
+                self.n_rejected += 1
+        elif rtype == "event":
+            # events are run back through the state machine, the logged transition is used as a check
+            event = Event(self.players[record["player"]], record["etype"])
+            self.current_state = self.game_state.transition(self.current_state, event)
+        elif rtype == "transition":
+            if (self.current_state is not None) and (self.current_state.state_name != record["to"]):
+                print(f"warning: replayed state {self.current_state.state_name} does not match "
+                      f"logged state {record['to']} at t={self.t}")
+        elif rtype == "score":
+            self.score = list(record["score"])
+
+    def describe(self):
+        state_name = self.current_state.state_name if self.current_state is not None else None
+        names = [str(self.players[i]) if i in self.players else f"player {i}" for i in [1, 2]]
+        return (f"t={self.t:.2f}s {names[0]} {self.score[0]} - {self.score[1]} {names[1]}, state: {state_name}, "
+                f"captures: {self.n_captures + self.n_gated} ({self.n_rejected + self.n_gated} rejected)")
+
+
+def replay(fname, until=None):
+    '''
+    rebuild the state of the game logged in fname, up to and including time until (seconds) if given
+    '''
+    state = ReplayState()
+    for record in read_log(fname):
+        if (until is not None) and (record["t"] > until):
+            break
+        state.apply(record)
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay a game event log")
+    parser.add_argument("fname", help="event log written by the game")
+    parser.add_argument("--until", type=float, help="only replay records up to this time in seconds")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every record as it is replayed")
+    args = parser.parse_args(argv)
+
+    state = ReplayState()
+    for record in read_log(args.fname):
+        if (args.until is not None) and (record["t"] > args.until):
+            break
+        state.apply(record)
+        if args.verbose:
+            fields = ", ".join(f"{k}={v}" for k, v in record.items() if k not in ["t", "type"])
+            print(f"{record['t']:9.3f} {record['type']:10} {fields}")
+    print(state.describe())
+
+
+if __name__ == "__main__":
+    main()
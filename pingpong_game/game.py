@@ -1,28 +1,34 @@
 """
 Game class - used to store main mechanisms used for the pingpong game
 """
-import time
-
+from pingpong_game.clock import WallClock
 from pingpong_game.config import config
 from pingpong_game.player import Player
-from pingpong_game.state_machine import Event
+from pingpong_game.state_machine import Event, GameState, StartState
 from pingpong_game.sig.signal_tools import (
-    get_angle_from_sound,
-    get_rms,
-    get_polarity,
+    delay_to_angle,
+    estimate_delay_at_onset,
+    get_onset_window,
 )
+from pingpong_game.sig.spectrum import CaptureSpectrum, get_spectrum
 
 # config values explained in config.py and at relevant parts of code
 DELAY_MAX = config["delay_max"]
 MEAN_SIGNAL_POWER_MIN = config["mean_signal_power_min"]
+LOCALIZATION_MODE = config["localization_mode"]
+LOG_SPECTRAL_FEATURES = config["log_spectral_features"]
 
 
 class Game:
-    def __init__(self, sig_cap, scoreboard):
+    def __init__(self, sig_cap, scoreboard, clock=None, event_log=None, angle_executor=None):
         '''
         initialize a new game with new player objects
         requires a signal capture object which can send events whenever a new signal is captured
         as well as a scoreboard object which is used to communicate with players
+        the clock is used for all timeouts, it defaults to the wall clock (see clock.py)
+        if an event log is given, captures, events, state transitions and score changes are logged to it
+        if an executor (e.g. a concurrent.futures process pool shared by several games) is given, the delay
+        estimation for each capture is run on it instead of the game thread
         '''
         self.p1 = Player(id=1)
         self.p2 = Player(id=2)
@@ -30,6 +36,60 @@ class Game:
         scoreboard.p1 = self.p1
         scoreboard.p2 = self.p2
         self.sig_cap = sig_cap
+        # records are timestamped with a given clock (e.g. a sample clock when replaying a recording),
+        # with the default wall clock the log keeps its own time since it was opened
+        if (event_log is not None) and (event_log.clock is None) and (clock is not None):
+            event_log.clock = clock
+        if clock is None:
+            clock = WallClock()
+        self.clock = clock
+        self.event_log = event_log
+        self.angle_executor = angle_executor
+        scoreboard.event_log = event_log
+        self.game_state = None
+        self.current_state = None
+        # True if the last wait_for_sound returned without a sound because it was interrupted, not timed out
+        self.interrupted = False
+
+    def log(self, record_type, **fields):
+        '''
+        write a record to the event log, if there is one
+        '''
+        if self.event_log is not None:
+            self.event_log.log(record_type, **fields)
+
+    def new_game(self):
+        '''
+        set up a new game state object to keep track of the game once the players are identified
+        '''
+        self.game_state = GameState(self.p1, self.p2, event_log=self.event_log)
+        self.log(
+            "players",
+            players=[
+                {"id": p.id, "name": p.name, "position": p.position} for p in [self.p1, self.p2]
+            ],
+        )
+
+    def set_start_state(self, player):
+        '''
+        (re)start the game with the given player serving
+        '''
+        self.current_state = StartState(player)
+        self.scoreboard.serving = player
+        self.log("start", player=getattr(player, "id", None))
+
+    def get_snapshot(self):
+        '''
+        json serializable summary of the game for spectators, published by the score server (see score_server.py)
+        '''
+        state = self.current_state
+        return {
+            "players": [{"id": p.id, "name": str(p), "position": p.position} for p in [self.p1, self.p2]],
+            "score": list(self.scoreboard.score),
+            "serving": str(self.scoreboard.serving) if self.scoreboard.serving is not None else None,
+            "state": state.state_name if state is not None else None,
+            "winner": str(state.player) if (state is not None) and (state.state_name == "EndState") else None,
+        }
 
     def wait_for_sound(self, timeout=None):
         '''
@@ -44,67 +104,213 @@ class Game:
 
         sound_detected = False
         timed_out = False
+        signal_cap = None
         self.sig_cap.condition.acquire()
+        deadline = self.clock.time() + timeout
 
-        while (not sound_detected) and (not timed_out) and (self.scoreboard.quit.value != 1):
+        while (not sound_detected) and (not timed_out) and (not self.is_interrupted()):
             # if the sig_cap already has a capture ready, don't need to wait for a notification
-            if self.sig_cap.capture_ready:
-                s = e = time.time()
-                capture_ready = True
-            else:
-                s = time.time()
+            if not self.sig_cap.capture_ready:
+                remaining = deadline - self.clock.time()
                 # aside from the sig_cap object, the game processing loop can send a notification
                 # if for example the quit or pause buttons have been pressed. that will cause this
                 # code to stop waiting and ultimately return control to the main thread
-                capture_ready = self.sig_cap.condition.wait(timeout)
-                e = time.time()
+                if remaining > 0:
+                    self.clock.wait(self.sig_cap.condition, remaining)
 
             # check if captured signal meets criteria for a valid capture. right now this just means
             # checking if it has high enough mean power between the channels, but future improvements
             # could change this to classify the signal as a table/paddle strike vs a floor bounce, etc
-            if capture_ready and (self.scoreboard.quit.value != 1) and (self.scoreboard.pause != 1):
+            if self.sig_cap.capture_ready and (not self.is_interrupted()):
                 signal_cap = self.sig_cap.get_next_capture()
                 self.sig_cap.condition.notify() # let producer know the capture has been consumed
-                mean_rms = (get_rms(signal_cap[0])+ get_rms(signal_cap[1]))/2
-                if (mean_rms > MEAN_SIGNAL_POWER_MIN):
+                if self.check_capture(signal_cap):
                     sound_detected = True
                 else:
-                    # print that the capture was rejected (for debugging) and update the timeout
-                    # to reflect how much time remains before the timeout expires
-                    print(f"capture rejected: {signal_cap[-1]}, {mean_rms=}")
-                    timeout = timeout - (e-s)
-            else:
+                    # the deadline is unchanged so the time spent on this capture counts against the timeout
+                    signal_cap = None
+            elif (self.clock.time() >= deadline) and (not self.is_interrupted()):
                 # if timed out, set the captured signal to None and indicate that a time out occurred
                 signal_cap = None
                 timed_out = True
 
+        # a pause or quit (or the end of a replay) stops the wait without a sound and without a timeout
+        self.interrupted = (not sound_detected) and (not timed_out)
         # release the semaphore while no longer waiting for a sound
         self.sig_cap.condition.release()
         return signal_cap
 
-    def wait_for_game_event(self, timeout=None):
+    def is_interrupted(self):
+        '''
+        True if waiting for sounds should stop: quit or pause has been pressed, or the clock has finished
+        (e.g. at the end of a replayed recording, see clock.py)
+        '''
+        return ((self.scoreboard.quit.value == 1) or (self.scoreboard.pause.value == 1)
+                or self.clock.finished)
+
+    def wait_for_game_event(self, timeout=None, verbose=True):
         '''
         wait for a captured sound or timeout. if a sound is detected,
         estimate the angle and use the angle to determine which side the sound came from
-        return a contact event according to the side, i.e. the side the player is on
+        return a contact event according to the side, i.e. the side the player is on.
+        returns None if the wait was interrupted by quit or pause (see wait_for_sound), in which case there
+        is no event to pass to the state machine and no timeout is logged
         '''
         signal_cap = self.wait_for_sound(timeout)
         if signal_cap is None:
-            player = self.current_state.player
-            return Event(player, "timeout")
+            if self.interrupted:
+                return None
+            return self.get_timeout_event()
+        return self.get_event_from_capture(signal_cap, verbose=verbose)
+
+    def get_timeout_event(self):
+        '''
+        timeout event for the player of the current state, used when no sound is heard in time
+        '''
+        player = self.current_state.player
+        self.log("event", player=getattr(player, "id", None), etype="timeout", **self.get_gate_fields())
+        return Event(player, "timeout")
 
+    def get_gate_fields(self):
+        '''
+        log fields with the number of captures the signal capture's gate has rejected so far, if it has a gate
+        '''
+        if self.sig_cap.gate is None:
+            return {}
+        return {"rejected": self.sig_cap.n_rejected}
+
+    def check_capture(self, signal_cap):
+        '''
+        check if a capture is valid (see is_valid_capture), logging the result. rejected captures are printed
+        for debugging. if the signal capture object has a gate, captures have already been checked before
+        reaching the game and only the signal capture's count of rejected captures is logged
+        '''
+        mean_rms = self.get_mean_rms(signal_cap)
+        if self.sig_cap.gate is not None:
+            accepted = True
+        else:
+            accepted = mean_rms > MEAN_SIGNAL_POWER_MIN
+        fields = self.get_gate_fields()
+        stats = getattr(signal_cap, "stats", None)
+        if stats is not None:
+            fields.update(
+                peak=[round(stats.l_peak, 1), round(stats.r_peak, 1)],
+                onset=stats.onset,
+                windows=stats.n_windows,
+            )
+        if LOG_SPECTRAL_FEATURES:
+            fields.update(self.get_onset_spectrum(signal_cap).features())
+        self.log(
+            "capture",
+            indices=[int(i) for i in signal_cap[-1]],
+            rms=round(float(mean_rms), 2),
+            accepted=bool(accepted),
+            **fields,
+        )
+        if not accepted:
+            print(f"capture rejected: {signal_cap[-1]}, {mean_rms=}")
+        return accepted
+
+    def get_onset_spectrum(self, signal_cap):
+        '''
+        spectrum of the onset window of a capture (the window used to localize it), so that logging the spectral
+        features costs the same however long the capture is. the whole capture if it has no statistics
+        '''
+        stats = getattr(signal_cap, "stats", None)
+        if stats is None:
+            return get_spectrum(signal_cap)
+        lch, rch = signal_cap[0], signal_cap[1]
+        lb, ub = get_onset_window(len(lch), stats.onset_idx, config["onset_pre_roll"], config["onset_window_len"])
+        return CaptureSpectrum(lch[lb:ub], rch[lb:ub], Fs=getattr(signal_cap, "Fs", None))
+
+    def get_mean_rms(self, signal_cap):
+        '''
+        mean of the rms of both channels of a signal capture. captures from SignalCapture carry
+        statistics collected while capturing (see CaptureStats), so the samples aren't read again.
+        otherwise it comes from the capture's spectrum, which the spectral features reuse
+        '''
+        stats = getattr(signal_cap, "stats", None)
+        if stats is not None:
+            return stats.mean_rms
+        return get_spectrum(signal_cap).mean_rms
+
+    def is_valid_capture(self, signal_cap):
+        '''
+        check if captured signal meets criteria for a valid capture. right now this just means
+        checking if it has high enough mean power between the channels
+        '''
+        return self.get_mean_rms(signal_cap) > MEAN_SIGNAL_POWER_MIN
+
+    def get_event_from_capture(self, signal_cap, verbose=False):
+        '''
+        estimate the angle of a captured sound and return a contact event for the player
+        on that side of the table
+        '''
         # get signal info from the signal capture received
         # signal captures are of the form (left_ch_signal, right_ch_signal, signal_indices)
         lch, rch = signal_cap[0], signal_cap[1]
-        indces = signal_cap[-1]
-        angle = get_angle_from_sound(lch, rch, DELAY_MAX, "beamforming")
+        delay, confidence, full_capture = self.estimate_delay(lch, rch, onset_idx=self.get_onset_idx(signal_cap))
+        return self.get_event_from_delay(
+            signal_cap, delay, verbose=verbose, confidence=confidence, full_capture=full_capture
+        )
+
+    def get_event_from_delay(self, signal_cap, delay, verbose=False, confidence=None, full_capture=None):
+        '''
+        return a contact event for the player on the side of the table given by the delay between
+        the channels of a capture, e.g. when the delay was estimated somewhere else
+        the confidence of the estimate and whether the whole capture was used are logged if given
+        '''
+        fields = {}
+        if confidence is not None:
+            fields["confidence"] = round(confidence, 3)
+        if full_capture is not None:
+            fields["full_capture"] = bool(full_capture)
+        angle = delay_to_angle(delay, DELAY_MAX)
         pos = self.get_position_from_angle(angle)
-        # print sound detection info to console for debugging
-        print(pos, angle, round((get_rms(lch)+get_rms(rch))/2,2))
+        if verbose:
+            # print sound detection info to console for debugging
+            print(pos, angle, round(self.get_mean_rms(signal_cap),2))
         if pos == self.p1.position:
-            return Event(self.p1, "contact_event")
+            player = self.p1
         else:
-            return Event(self.p2, "contact_event")
+            player = self.p2
+        self.log(
+            "event",
+            player=player.id,
+            etype="contact_event",
+            indices=[int(i) for i in signal_cap[-1]],
+            delay=delay,
+            angle=round(angle, 2),
+            **fields,
+        )
+        return Event(player, "contact_event")
+
+    def get_onset_idx(self, signal_cap):
+        '''
+        sample index of the onset of a capture, used to localize the sound from a window around the onset.
+        None (use the whole capture) if onset localization is turned off or the capture has no statistics
+        '''
+        stats = getattr(signal_cap, "stats", None)
+        if (LOCALIZATION_MODE != "onset") or (stats is None):
+            return None
+        return stats.onset_idx
+
+    def estimate_delay(self, lch, rch, technique="beamforming", onset_idx=None):
+        '''
+        estimate the delay between the channels of a capture, using the angle executor if there is one
+        returns (delay, confidence, used_full_capture), see estimate_delay_at_onset
+        '''
+        args = (lch, rch, DELAY_MAX, onset_idx, technique)
+        if self.angle_executor is not None:
+            return self.angle_executor.submit(estimate_delay_at_onset, *args).result()
+        return estimate_delay_at_onset(*args)
+
+    def get_angle_from_capture(self, signal_cap):
+        '''
+        angle of a captured sound, estimated the same way as during the game (see get_event_from_capture)
+        '''
+        delay, _, _ = self.estimate_delay(signal_cap[0], signal_cap[1], onset_idx=self.get_onset_idx(signal_cap))
+        return delay_to_angle(delay, DELAY_MAX)
 
     def get_position_from_angle(self, angle):
         '''
@@ -148,8 +354,7 @@ class Game:
             self.scoreboard.root.update()
             self.scoreboard.pause.value = 0
             signal_cap = self.wait_for_sound()
-            lch, rch = signal_cap[0], signal_cap[1]
-            angle = get_angle_from_sound(lch, rch, DELAY_MAX, "beamforming")
+            angle = self.get_angle_from_capture(signal_cap)
             pos = self.get_position_from_angle(angle)
             player_pos_msg = (
                 f"it seems that {current_player.name} is on the {pos} side of the table, is this correct?"
@@ -164,7 +369,7 @@ class Game:
             else:
                 # if angle wasn't correct, it is possible the default polarity
                 # is wrong, in which case this will estimate it and update
-                polarity = get_polarity(lch, rch)
+                polarity = get_spectrum(signal_cap).polarity
                 if polarity == config["polarity"]:
                     print('estimated polarity matches config value, no update needed')
                 else:
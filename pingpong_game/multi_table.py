@@ -0,0 +1,215 @@
+'''
+    multi-table mode. one process scores several tables from a single multichannel audio interface instead of
+    running one program (and one laptop) per table. the interface is opened as a single N channel stream, every
+    block of all channels goes through the bandpass filter (or with the multirate front end, the demodulator) in
+    one vectorized call, and each pair of channels is handed to its own SignalCapture and Game. the delay estimation for every table runs on a shared pool of
+    worker processes so that several tables handling sounds at the same time don't contend for one interpreter.
+
+    there is no gui in this mode. player positions are set in the config file, score changes are printed to the
+    console and each table writes an event log (see event_log.py). if the score server is enabled in the config,
+    each table's score is also published under the key table-XX (see score_server.py).
+
+    usage: python -m pingpong_game.multi_table [n_channels]
+'''
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Value
+import sys
+import threading
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.event_log import EventLog
+from pingpong_game.game import Game
+from pingpong_game.score_server import ScoreServer
+from pingpong_game.scoreboard import Scoreboard
+from pingpong_game.sig.kernels import warm_up
+from pingpong_game.sig.multirate import get_demodulator, get_signal_capture
+from pingpong_game.sig.signal_tools import PingPongFilter, StreamSignal
+
+
+Fs = config["fs"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_POWER = config["sig_cap_power"]
+MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
+filter_low_thresh = config["filter_low_thresh"]
+filter_high_thresh = config["filter_high_thresh"]
+K = 6
+
+SERVE_TIMEOUT = config["serve_timeout"]
+GAME_EVENT_TIMEOUT = config["game_event_timeout"]
+POST_SCORING_TIMEOUT = config["post_scoring_timeout"]
+
+
+class Table:
+    '''
+    signal capture, scoreboard and game for one table, fed by channels 2*idx (left) and 2*idx+1 (right)
+    the quit value is shared by all tables
+    '''
+    def __init__(self, idx, quit_, angle_executor=None, event_log=None, score_server=None):
+        self.idx = idx
+        self.score_server = score_server
+        self.sig_cap = get_signal_capture(Fs)
+        # the scoreboard is only used for its scorekeeping logic, there is no tk interface
+        self.scoreboard = Scoreboard()
+        self.scoreboard.pause = Value('i', 0)
+        self.scoreboard.quit = quit_
+        self.game = Game(self.sig_cap, self.scoreboard, event_log=event_log, angle_executor=angle_executor)
+        self.game.p1.name = f"table {idx} player one"
+        self.game.p2.name = f"table {idx} player two"
+        self.game.p1.position = config["multi_table_p1_position"]
+        self.game.p2.position = config["multi_table_p2_position"]
+        self.event_log = event_log
+
+    def process(self, lch, rch, frame_offset, envelope=None):
+        '''
+        run the next filtered block of this table's channels through its signal capture object
+        (unfiltered with the multirate front end, along with the envelope of the channels)
+        '''
+        self.sig_cap.condition.acquire()
+        if envelope is None:
+            self.sig_cap.process(lch, rch, frame_offset=frame_offset)
+        else:
+            self.sig_cap.process(lch, rch, frame_offset=frame_offset, envelope=envelope)
+        self.sig_cap.condition.release()
+
+    def publish(self):
+        '''
+        send the state of this table's game to the score server, if there is one
+        '''
+        if self.score_server is not None:
+            self.score_server.publish(self.game.get_snapshot(), key=f"table-{self.idx:02}")
+
+    def wake(self):
+        '''
+        wake the game thread if it is waiting for a sound, e.g. when quitting
+        '''
+        self.sig_cap.condition.acquire()
+        self.sig_cap.condition.notify()
+        self.sig_cap.condition.release()
+
+
+def audio_thread_func(sig, tables, filt, quit_, demod=None):
+    '''
+    read the next block of all channels, filter them together and pass each table its pair of channels.
+    with the multirate front end filt is None, demod demodulates all the channels together and each table's
+    signal capture gets its pair of envelope channels and filters its own captures
+    '''
+    n_channels = sig.channels
+    # the right channel of each pair is multiplied by the configured polarity
+    polarity = np.ones(n_channels)
+    polarity[1::2] = config["polarity"]
+    audio_idx = 0
+    while quit_.value == 0:
+        data = sig.read(BLOCK_LEN)
+        block = data.reshape(-1, n_channels) * polarity
+        if filt is not None:
+            block = filt.filter_block(block)
+        envelope = None
+        if demod is not None:
+            envelope = demod.envelope(block)
+        for table in tables:
+            i = 2*table.idx
+            table_envelope = None if envelope is None else envelope[:, i:i + 2]
+            table.process(block[:, i], block[:, i + 1], audio_idx, envelope=table_envelope)
+        audio_idx += block.shape[0]
+
+
+def table_game_thread(table, quit_):
+    '''
+    headless version of the game event thread in __main__ for one table. games are played back to back,
+    and a table that times out waiting for a serve just goes back to waiting for the next serve
+    '''
+    game = table.game
+    scoreboard = table.scoreboard
+    game.new_game()
+    game.set_start_state(game.p1)
+    while quit_.value == 0:
+        table.publish()
+        state_name = game.current_state.state_name
+        timeout = GAME_EVENT_TIMEOUT
+        if state_name == "ScoreState":
+            post_scoring_state = scoreboard.update_score(game.current_state)
+            print(f"table {table.idx}: {scoreboard.score[0]} - {scoreboard.score[1]}")
+            if post_scoring_state.state_name == "EndState":
+                print(f"table {table.idx}: {post_scoring_state.player} wins")
+                game.current_state = post_scoring_state
+                table.publish()
+                scoreboard.score = [0, 0]
+                game.new_game()
+                # the reset is logged so a replay of the table's log starts the next game at 0 - 0
+                scoreboard.log_score("new_game")
+                game.set_start_state(game.p1)
+                continue
+            game.sig_cap.condition.acquire()
+            game.sig_cap.clear_captures()
+            game.sig_cap.condition.release()
+            game.clock.sleep(POST_SCORING_TIMEOUT)
+            timeout = SERVE_TIMEOUT
+        elif state_name == "ErrorState":
+            # e.g. nobody served before the serve timeout, keep the score and wait for the next serve
+            game.set_start_state(game.game_state.current_player)
+            continue
+        elif state_name == "StartState":
+            timeout = SERVE_TIMEOUT
+        event = game.wait_for_game_event(timeout, verbose=False)
+        # no event if quit was pressed while waiting
+        if event is None:
+            break
+        game.current_state = game.game_state.transition(game.current_state, event)
+
+
+def main(n_channels=None):
+    if n_channels is None:
+        n_channels = config["multi_table_channels"]
+    n_tables = n_channels // 2
+    quit_ = Value('i', 0)
+    # compile the capture and beamformer kernels before the first block arrives, see sig/kernels.py
+    warm_up()
+
+    sig = StreamSignal(frames_per_buffer=5*256, channels=n_channels)
+    filt = None
+    demod = None
+    if config["front_end"] == "full":
+        filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K, n_channels=n_channels)
+    else:
+        demod = get_demodulator(Fs, n_channels)
+    score_server = None
+    if config["score_server_enabled"]:
+        score_server = ScoreServer().start()
+        print(f"publishing scores on http://{score_server.host}:{score_server.port}/?key=table-00")
+    with ProcessPoolExecutor(config["multi_table_angle_workers"]) as pool:
+        tables = [
+            Table(i, quit_, angle_executor=pool, event_log=EventLog(f"table-{i:02}-log.jsonl"),
+                  score_server=score_server)
+            for i in range(n_tables)
+        ]
+        game_threads = [
+            threading.Thread(target=table_game_thread, args=(table, quit_)) for table in tables
+        ]
+        audio_thread = threading.Thread(target=audio_thread_func, args=(sig, tables, filt, quit_, demod))
+        for thread in game_threads:
+            thread.start()
+        audio_thread.start()
+        print(f"scoring {n_tables} tables, press ctrl-c to quit")
+        try:
+            while audio_thread.is_alive():
+                audio_thread.join(timeout=.5)
+        except KeyboardInterrupt:
+            pass
+        quit_.value = 1
+        for table in tables:
+            table.wake()
+        for thread in game_threads:
+            thread.join()
+        audio_thread.join()
+    sig.close()
+    for table in tables:
+        table.event_log.close()
+    if score_server is not None:
+        score_server.stop()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
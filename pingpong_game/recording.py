@@ -0,0 +1,451 @@
+'''
+    recordings of the realtime game's audio. the audio thread (or the recorder thread of the dsp process) hands
+    every block to a recorder with write(data, active), where data is the block's interleaved 16 bit samples and
+    active says whether the signal capture was in the middle of a sound, or finished one, in that block.
+    config["recording_mode"] selects the recorder, see get_recorder:
+
+        full        every block is written to one wave file
+        sparse      only the audio around sounds is written. the last sparse_pre_roll seconds are kept in memory,
+                    and when a block is active they are written along with it and everything up to
+                    sparse_post_roll seconds after the last active block. the segments are written one after the
+                    other to the wave file, and where each one was in the session goes to an index next to it
+        segmented   every block is written, to a new directory for each session (fname without its extension,
+                    followed by the date and time) holding wave files of recording_segment_seconds each and an
+                    index of where each file starts in the session, in frames and in game time
+
+    the index of a sparse recording (fname + ".index.jsonl") is json lines: a header with the format and margins,
+    a record per segment with its first frame in the session, its length and where it starts in the sparse file,
+    and the length of the session once the recording is closed, e.g.
+
+        {"type":"header","fs":48000,"channels":2,"pre_roll":0.5,"post_roll":1.0}
+        {"type":"segment","start":590400,"n_frames":98304,"offset":0}
+        {"type":"end","n_frames":8640000}
+
+    rebuild writes a wave file of the whole session from a sparse recording, with silence between the segments,
+    so the sample indices in the event log line up with it like they do with a full recording.
+
+    the index of a segmented session (index.jsonl in its directory) has the same header, with the length of the
+    segments, and a record for each segment file as it is opened, e.g.
+
+        {"type":"header","fs":48000,"channels":2,"segment_len":28800000,"time":1792300000.0}
+        {"type":"segment","file":"segment-00001.wav","start":28800000,"t":600.02}
+
+    start is the index in the session of the segment's first frame, the index the captures in the event log use,
+    and t is the game time (the event log's clock) when it was opened. SegmentedSession finds the segment holding
+    any frame or game time from the index and reads from the memory mapped segment files, so going to a point
+    in a long session costs the same wherever it is. the header of the segment being written is brought up to
+    date every recording_header_interval seconds, and repair fixes the header of a segment left by a crash.
+
+    usage: python -m pingpong_game.recording game-output.wav rebuilt.wav
+           python -m pingpong_game.recording game-output-20261018-143000 [span.wav --start 3600 --end 3660]
+'''
+import argparse
+from bisect import bisect_right
+from collections import deque
+import json
+import logging
+import os
+import struct
+import time
+import wave
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.event_log import read_log
+from pingpong_game.sig.signal_tools import memmap_signal
+
+
+log = logging.getLogger()
+
+# frames of silence written at a time when rebuilding
+REBUILD_CHUNK_LEN = 1 << 16
+# the wave module writes a 44 byte header for pcm data, the segment files are read from this offset
+WAVE_HEADER_LEN = 44
+
+
+def get_index_fname(fname):
+    return fname + ".index.jsonl"
+
+
+def open_wave(fname, Fs, channels=2):
+    output_file = wave.open(fname, "wb")
+    output_file.setnchannels(channels)
+    output_file.setsampwidth(2)
+    output_file.setframerate(Fs)
+    return output_file
+
+
+class WaveRecorder:
+    '''
+    writes every block to the wave file fname
+    '''
+    def __init__(self, fname, Fs, channels=2):
+        self.output_file = open_wave(fname, Fs, channels)
+
+    def write(self, data, active=False):
+        self.output_file.writeframesraw(data.tobytes())
+
+    def close(self):
+        self.output_file.close()
+
+
+class SparseRecorder:
+    '''
+    writes the blocks around sounds to the wave file fname and where they were in the session to its index.
+    pre_roll and post_roll are in seconds, by default config["sparse_pre_roll"] and config["sparse_post_roll"]
+    '''
+    def __init__(self, fname, Fs, channels=2, pre_roll=None, post_roll=None):
+        if pre_roll is None:
+            pre_roll = config["sparse_pre_roll"]
+        if post_roll is None:
+            post_roll = config["sparse_post_roll"]
+        self.channels = channels
+        self.pre_roll = int(pre_roll*Fs)
+        self.post_roll = int(post_roll*Fs)
+        # segments are rare, so the header of the wave file is updated with every write (writeframes instead of
+        # writeframesraw), which keeps the file readable if the game doesn't exit cleanly
+        self.output_file = open_wave(fname, Fs, channels)
+        self.index = open(get_index_fname(fname), "w")
+        self.write_record(type="header", fs=Fs, channels=channels, pre_roll=pre_roll, post_roll=post_roll)
+        # the most recent blocks, as bytes, covering at least pre_roll frames
+        self.history = deque()
+        self.history_len = 0
+        # frames seen so far, i.e. the index in the session of the first frame of the next block
+        self.frames = 0
+        # frames written to the sparse file so far
+        self.written = 0
+        # [start in the session, offset in the sparse file] of the segment being written, None between segments
+        self.segment = None
+        # frames left to write after the last active block
+        self.post_roll_left = 0
+
+    def write_record(self, **record):
+        self.index.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.index.flush()
+
+    def write_frames(self, data):
+        self.output_file.writeframes(data)
+        self.written += len(data)//(2*self.channels)
+
+    def end_segment(self):
+        [start, offset] = self.segment
+        self.write_record(type="segment", start=start, n_frames=self.written - offset, offset=offset)
+        self.segment = None
+
+    def write(self, data, active=False):
+        n = data.size//self.channels
+        data = data.tobytes()
+        if active:
+            if self.segment is None:
+                self.segment = [self.frames - self.history_len, self.written]
+                for block in self.history:
+                    self.write_frames(block)
+                self.history.clear()
+                self.history_len = 0
+            self.write_frames(data)
+            self.post_roll_left = self.post_roll
+        elif self.segment is not None:
+            self.write_frames(data)
+            self.post_roll_left -= n
+            if self.post_roll_left <= 0:
+                self.end_segment()
+        else:
+            self.history.append(data)
+            self.history_len += n
+            # drop the oldest block as long as the rest still cover the pre-roll
+            while self.history and (self.history_len - len(self.history[0])//(2*self.channels) >= self.pre_roll):
+                self.history_len -= len(self.history.popleft())//(2*self.channels)
+        self.frames += n
+
+    def close(self):
+        if self.segment is not None:
+            self.end_segment()
+        self.write_record(type="end", n_frames=self.frames)
+        self.index.close()
+        self.output_file.close()
+        if self.frames > 0:
+            log.info(f"sparse recording: {self.written} of {self.frames} frames written "
+                     f"({100*self.written/self.frames:.1f}%)")
+
+
+class SegmentedRecorder:
+    '''
+    writes every block to a directory of segment files of segment_seconds each (config["recording_segment_seconds"]
+    by default), named after fname and the time the recording started. clock returns the game time in seconds,
+    by default the time since the recorder was opened
+    '''
+    def __init__(self, fname, Fs, channels=2, segment_seconds=None, clock=None):
+        if segment_seconds is None:
+            segment_seconds = config["recording_segment_seconds"]
+        self.start_time = time.time()
+        self.path = f"{os.path.splitext(fname)[0]}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.start_time))}"
+        os.makedirs(self.path)
+        self.Fs = Fs
+        self.channels = channels
+        self.segment_len = int(segment_seconds*Fs)
+        self.header_interval = int(config["recording_header_interval"]*Fs)
+        self.clock = clock
+        self.index = open(os.path.join(self.path, "index.jsonl"), "w")
+        self.write_record(type="header", fs=Fs, channels=channels, segment_len=self.segment_len, time=self.start_time)
+        # frames written so far, in the session and to the current segment file
+        self.frames = 0
+        self.segment_frames = 0
+        self.n_segments = 0
+        # frames written to the current segment since its header was last updated
+        self.unpatched = 0
+        self.file = None
+        self.output_file = None
+
+    def now(self):
+        if self.clock is not None:
+            return self.clock()
+        return time.time() - self.start_time
+
+    def write_record(self, **record):
+        self.index.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.index.flush()
+
+    def close_segment(self):
+        # closing the wave file updates its header, the file object is ours to close
+        self.output_file.close()
+        self.file.close()
+        self.output_file = None
+
+    def open_segment(self):
+        segment_fname = f"segment-{self.n_segments:05}.wav"
+        self.file = open(os.path.join(self.path, segment_fname), "wb")
+        self.output_file = open_wave(self.file, self.Fs, self.channels)
+        self.segment_frames = 0
+        self.unpatched = 0
+        self.n_segments += 1
+        self.write_record(type="segment", file=segment_fname, start=self.frames, t=round(self.now(), 4))
+
+    def write_frames(self, data):
+        self.output_file.writeframesraw(data.tobytes())
+        n = len(data)
+        self.frames += n
+        self.segment_frames += n
+        self.unpatched += n
+        if self.unpatched >= self.header_interval:
+            # writeframes updates the header when it is behind the data, then the file is handed to the os so a
+            # crash of the game loses at most header_interval of audio
+            self.output_file.writeframes(b"")
+            self.file.flush()
+            self.unpatched = 0
+        if self.segment_frames >= self.segment_len:
+            self.close_segment()
+
+    def write(self, data, active=False):
+        frames = data.reshape(-1, self.channels)
+        # blocks are split at the segment boundaries, so every segment but the last is exactly segment_len long
+        while len(frames) > 0:
+            if self.output_file is None:
+                self.open_segment()
+            n = min(len(frames), self.segment_len - self.segment_frames)
+            self.write_frames(frames[:n])
+            frames = frames[n:]
+
+    def close(self):
+        if self.output_file is not None:
+            self.close_segment()
+        self.write_record(type="end", n_frames=self.frames, t=round(self.now(), 4))
+        self.index.close()
+        log.info(f"recording written to {self.path}, {self.n_segments} segments")
+
+
+def get_recorder(fname, Fs, channels=2, mode=None, clock=None):
+    '''
+    open the recorder selected by config["recording_mode"] (or mode) for writing to fname. clock returns the
+    game time, which the segmented recorder writes to its index
+    '''
+    if mode is None:
+        mode = config["recording_mode"]
+    if mode == "full":
+        return WaveRecorder(fname, Fs, channels)
+    if mode == "sparse":
+        return SparseRecorder(fname, Fs, channels)
+    if mode == "segmented":
+        return SegmentedRecorder(fname, Fs, channels, clock=clock)
+    raise ValueError(f"unknown recording mode {mode}")
+
+
+def read_index(fname):
+    '''
+    return [header, segments, n_frames] from the index of the sparse recording fname. if the recording wasn't
+    closed n_frames is the end of the last segment
+    '''
+    records = read_log(get_index_fname(fname))
+    header = records[0]
+    segments = [r for r in records if r["type"] == "segment"]
+    ends = [r["n_frames"] for r in records if r["type"] == "end"]
+    if ends:
+        n_frames = ends[0]
+    else:
+        n_frames = max((s["start"] + s["n_frames"] for s in segments), default=0)
+    return [header, segments, n_frames]
+
+
+def rebuild(fname, out_fname):
+    '''
+    write the whole session of the sparse recording fname to the wave file out_fname, with silence between
+    the segments. returns the number of frames written
+    '''
+    [header, segments, n_frames] = read_index(fname)
+    [frames, _] = memmap_signal(fname)
+    output_file = open_wave(out_fname, header["fs"], header["channels"])
+    zeros = np.zeros((REBUILD_CHUNK_LEN, header["channels"]), dtype=np.int16)
+
+    def write_silence(n):
+        while n > 0:
+            output_file.writeframesraw(zeros[:n].tobytes())
+            n -= min(n, REBUILD_CHUNK_LEN)
+
+    pos = 0
+    for segment in segments:
+        write_silence(segment["start"] - pos)
+        output_file.writeframesraw(frames[segment["offset"]:segment["offset"] + segment["n_frames"]].tobytes())
+        pos = segment["start"] + segment["n_frames"]
+    write_silence(n_frames - pos)
+    output_file.close()
+    return n_frames
+
+
+def repair_wave(fname):
+    '''
+    set the lengths in the header of a wave file written by the wave module to the length of the file, for a
+    segment that was being written when the game stopped. returns True if the header was changed
+    '''
+    data_len = os.path.getsize(fname) - WAVE_HEADER_LEN
+    with open(fname, "r+b") as f:
+        header = f.read(WAVE_HEADER_LEN)
+        [block_align] = struct.unpack("<H", header[32:34])
+        data_len -= data_len % block_align
+        if struct.unpack("<I", header[40:44])[0] == data_len:
+            return False
+        f.seek(4)
+        f.write(struct.pack("<I", 36 + data_len))
+        f.seek(40)
+        f.write(struct.pack("<I", data_len))
+    return True
+
+
+class SegmentedSession:
+    '''
+    a session written by SegmentedRecorder, read through its index. each segment is a dict with the file name,
+    the index of its first frame in the session (start), its game time (t) and its length (n_frames, from the
+    size of its file so that a segment left by a crash is read in full)
+    '''
+    def __init__(self, path):
+        self.path = path
+        records = read_log(os.path.join(path, "index.jsonl"))
+        header = records[0]
+        self.Fs = header["fs"]
+        self.channels = header["channels"]
+        self.segment_len = header["segment_len"]
+        self.segments = [r for r in records if r["type"] == "segment"]
+        for segment in self.segments:
+            size = os.path.getsize(os.path.join(path, segment["file"]))
+            segment["n_frames"] = max(0, size - WAVE_HEADER_LEN)//(2*self.channels)
+        self.starts = [s["start"] for s in self.segments]
+        self.times = [s["t"] for s in self.segments]
+        self.n_frames = self.starts[-1] + self.segments[-1]["n_frames"] if self.segments else 0
+        # memory maps of the segment files, opened as they are first read
+        self.maps = {}
+
+    def find_segment(self, frame):
+        '''
+        index of the segment holding the given frame of the session, -1 if it is before the first one
+        '''
+        return bisect_right(self.starts, frame) - 1
+
+    def frame_at(self, t):
+        '''
+        index of the frame recorded at game time t, from the game time of the segment it is in. blocks are
+        timestamped as they are written, so this is good to a few blocks
+        '''
+        i = max(0, bisect_right(self.times, t) - 1)
+        segment = self.segments[i]
+        return segment["start"] + max(0, int(round((t - segment["t"])*self.Fs)))
+
+    def get_map(self, i):
+        if i not in self.maps:
+            segment = self.segments[i]
+            self.maps[i] = np.memmap(
+                os.path.join(self.path, segment["file"]), dtype=np.int16, mode="r", offset=WAVE_HEADER_LEN,
+                shape=(segment["n_frames"], self.channels),
+            )
+        return self.maps[i]
+
+    def read(self, start, n):
+        '''
+        frames start up to start + n of the session as an array of shape (n, channels), silence where nothing
+        was recorded
+        '''
+        frames = np.zeros((n, self.channels), dtype=np.int16)
+        i = max(0, self.find_segment(start))
+        while (i < len(self.segments)) and (self.starts[i] < start + n):
+            segment = self.segments[i]
+            lb = max(start, segment["start"])
+            ub = min(start + n, segment["start"] + segment["n_frames"])
+            if ub > lb:
+                frames[lb - start:ub - start] = self.get_map(i)[lb - segment["start"]:ub - segment["start"]]
+            i += 1
+        return frames
+
+    def repair(self):
+        '''
+        fix the headers of segments left by a crash, returns the names of the files changed
+        '''
+        self.maps = {}
+        return [s["file"] for s in self.segments if repair_wave(os.path.join(self.path, s["file"]))]
+
+
+def extract(session, out_fname, start, n):
+    '''
+    write n frames of the session from frame start to the wave file out_fname
+    '''
+    output_file = open_wave(out_fname, session.Fs, session.channels)
+    for lb in range(start, start + n, REBUILD_CHUNK_LEN):
+        output_file.writeframesraw(session.read(lb, min(REBUILD_CHUNK_LEN, start + n - lb)).tobytes())
+    output_file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rebuild a sparse recording, or look at a segmented session")
+    parser.add_argument("fname", help="sparse recording or segmented session directory written by the game")
+    parser.add_argument("out_fname", nargs="?", help="wave file to write")
+    parser.add_argument("--start", type=float, default=0, help="start of the span to write from a session, seconds")
+    parser.add_argument("--end", type=float, help="end of the span to write from a session, seconds")
+    parser.add_argument("--game-time", action="store_true", help="start and end are game times from the event log")
+    parser.add_argument("--repair", action="store_true", help="fix the headers of segments left by a crash")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.fname):
+        if args.out_fname is None:
+            parser.error("a sparse recording needs out_fname to rebuild into")
+        [header, segments, _] = read_index(args.fname)
+        n_frames = rebuild(args.fname, args.out_fname)
+        recorded = sum(s["n_frames"] for s in segments)
+        print(f"{len(segments)} segments, {recorded/header['fs']:.1f} s of {n_frames/header['fs']:.1f} s recorded, "
+              f"written to {args.out_fname}")
+        return
+
+    session = SegmentedSession(args.fname)
+    print(f"{len(session.segments)} segments, {session.n_frames/session.Fs:.1f} s")
+    if args.repair:
+        for segment_fname in session.repair():
+            print(f"repaired the header of {segment_fname}")
+    if args.out_fname is not None:
+        if args.game_time:
+            start = session.frame_at(args.start)
+            end = session.n_frames if args.end is None else session.frame_at(args.end)
+        else:
+            start = int(args.start*session.Fs)
+            end = session.n_frames if args.end is None else int(args.end*session.Fs)
+        extract(session, args.out_fname, start, max(0, end - start))
+        print(f"frames {start} to {end} written to {args.out_fname}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+'''
+    remote microphone nodes. a small machine next to the table reads the microphones and streams them over tcp
+    to the machine running the game, which then doesn't need to be near the table, and one scoring machine can
+    take the nodes of several tables (each node connects to its own port).
+
+    a node either streams the raw int16 blocks (mode "raw", the scoring machine filters and detects captures as
+    if the microphones were attached locally, see RemoteSignal) or filters and detects captures itself and only
+    sends the finished captures (mode "captures", see RemoteSignalCapture). captures are a few tenths of a
+    second of audio every few seconds, so the second needs a small fraction of the bandwidth of the first.
+
+    every message is a fixed 20 byte header followed by a payload:
+
+        type        uint8       HELLO, BLOCK, CAPTURE or END
+        version     uint8       PROTOCOL_VERSION
+        n_channels  uint16
+        seq         uint32      sequence number of the message, the HELLO is 0
+        sample_idx  uint64      index of the first frame of a block, or the start index of a capture
+        length      uint32      payload length in bytes
+
+        HELLO       mode (uint8, 0 raw / 1 captures), sample rate (uint32), frames per block (uint32)
+        BLOCK       interleaved int16 samples
+        CAPTURE     CAPTURE_HEADER (start and stop index, number of frames, the capture's CaptureStats, the
+                    number of captures the node's gate has rejected and the sample format) followed by the
+                    window rms values (float32) and then the samples of both channels, interleaved. the signal
+                    capture holds whole numbers, which are sent as int16 when they fit and float32 otherwise
+        END         empty, the node is done
+
+    all numbers are little endian. the node connects to the scoring machine (which listens, see listen and
+    accept_node) and retries until it is there.
+
+    usage (node):   python -m pingpong_game.remote_mic scoring-host [--port 9300] [--mode captures]
+                    [--file recording.wav]
+    on the scoring machine set config["remote_mic_port"] and start the game as usual.
+'''
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.dsp_process import ProcessSignalCapture
+from pingpong_game.sig.kernels import warm_up
+from pingpong_game.sig.multirate import get_signal_capture
+from pingpong_game.sig.signal_capture import Capture, CaptureStats
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter, StreamSignal
+
+
+log = logging.getLogger()
+
+Fs = config["fs"]
+BLOCK_LEN = config["signal_block_len"]
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+filter_low_thresh = config["filter_low_thresh"]
+filter_high_thresh = config["filter_high_thresh"]
+K = 6
+
+PROTOCOL_VERSION = 2
+HELLO, BLOCK, CAPTURE, END = range(4)
+MODES = ["raw", "captures"]
+HEADER = struct.Struct("<BBHIQI")
+HELLO_PAYLOAD = struct.Struct("<BII")
+# start, stop, n_frames, window_len, offset, onset, n_windows, n_samples, l_sum_sq, r_sum_sq, l_peak, r_peak,
+# max_rise, n_rejected, sample format (an index into SAMPLE_FORMATS). the offset is signed, multirate captures
+# can start after the first window of the sound (see sig/multirate.py)
+CAPTURE_HEADER = struct.Struct("<QQIIiIIQdddddIB")
+SAMPLE_FORMATS = [np.float32, np.int16]
+
+
+def recv_exact(sock, n):
+    '''
+    exactly n bytes from the socket, None if it is closed first
+    '''
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        n_read = sock.recv_into(view[pos:])
+        if n_read == 0:
+            return None
+        pos += n_read
+    return buf
+
+
+def pack_capture(cap, n_rejected=0):
+    stats = cap.stats
+    [start, stop] = cap[2]
+    samples = np.stack([cap[0], cap[1]], axis=1)
+    fmt = 0
+    if (len(samples) > 0) and (np.abs(samples).max() <= 32767) and np.array_equal(samples, np.round(samples)):
+        fmt = 1
+    header = CAPTURE_HEADER.pack(
+        start, stop, len(cap[0]), stats.window_len, stats.offset, stats.onset, stats.n_windows, stats.n_samples,
+        stats.l_sum_sq, stats.r_sum_sq, stats.l_peak, stats.r_peak, stats.max_rise, n_rejected, fmt,
+    )
+    envelope = np.array([stats.l_window_rms, stats.r_window_rms], dtype=np.float32).T
+    return header + envelope.tobytes() + samples.astype(SAMPLE_FORMATS[fmt]).tobytes()
+
+
+def unpack_capture(payload, Fs=None):
+    '''
+    (Capture with its stats, number of captures rejected by the node so far) from a CAPTURE payload. Fs is the
+    sample rate of the node
+    '''
+    [start, stop, n, window_len, offset, onset, n_windows, n_samples, l_sum_sq, r_sum_sq, l_peak, r_peak,
+     max_rise, n_rejected, fmt] = CAPTURE_HEADER.unpack_from(payload)
+    pos = CAPTURE_HEADER.size
+    envelope = np.frombuffer(payload, dtype=np.float32, count=2*n_windows, offset=pos).reshape(-1, 2)
+    pos += envelope.nbytes
+    samples = np.frombuffer(payload, dtype=SAMPLE_FORMATS[fmt], count=2*n, offset=pos).reshape(-1, 2)
+    samples = samples.astype(np.float64)
+    stats = CaptureStats(window_len)
+    stats.offset = offset
+    stats.onset = onset
+    stats.n_samples = n_samples
+    stats.l_sum_sq, stats.r_sum_sq = l_sum_sq, r_sum_sq
+    stats.l_peak, stats.r_peak = l_peak, r_peak
+    stats.max_rise = max_rise
+    stats.l_window_rms = envelope[:, 0].astype(np.float64).tolist()
+    stats.r_window_rms = envelope[:, 1].astype(np.float64).tolist()
+    cap = Capture([samples[:, 0].copy(), samples[:, 1].copy(), (start, stop)], stats=stats, Fs=Fs)
+    return cap, n_rejected
+
+
+class NodeConnection:
+    '''
+    one end of the connection between a node and the scoring machine, sends and receives framed messages
+    and counts the bytes sent
+    '''
+    def __init__(self, sock, n_channels=2):
+        self.sock = sock
+        self.n_channels = n_channels
+        self.seq = 0
+        self.n_bytes = 0
+
+    def send(self, msg_type, payload=b"", sample_idx=0):
+        header = HEADER.pack(msg_type, PROTOCOL_VERSION, self.n_channels, self.seq, sample_idx, len(payload))
+        self.sock.sendall(header + payload)
+        self.seq += 1
+        self.n_bytes += len(header) + len(payload)
+
+    def recv(self):
+        '''
+        (type, seq, sample_idx, payload) of the next message, None once the connection is closed
+        '''
+        header = recv_exact(self.sock, HEADER.size)
+        if header is None:
+            return None
+        [msg_type, version, n_channels, seq, sample_idx, length] = HEADER.unpack(header)
+        if version != PROTOCOL_VERSION:
+            raise ValueError(f"node speaks protocol version {version}, expected {PROTOCOL_VERSION}")
+        payload = recv_exact(self.sock, length) if length > 0 else b""
+        if payload is None:
+            return None
+        if seq != self.seq:
+            log.warning(f"expected message {self.seq} from the node, got {seq}")
+        self.seq = seq + 1
+        self.n_channels = n_channels
+        return msg_type, seq, sample_idx, payload
+
+    def close(self):
+        # shutting down first wakes up a thread blocked receiving on the socket
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def listen(port, host="0.0.0.0"):
+    return socket.create_server((host, port))
+
+
+def accept_node(listener):
+    '''
+    wait for a node to connect and say hello, returns the connection with the node's mode, rate and block length
+    '''
+    [sock, addr] = listener.accept()
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn = NodeConnection(sock)
+    [msg_type, _, _, payload] = conn.recv()
+    if msg_type != HELLO:
+        conn.close()
+        raise ValueError(f"expected a hello from {addr}, got message type {msg_type}")
+    [mode, conn.rate, conn.block_len] = HELLO_PAYLOAD.unpack(payload)
+    conn.mode = MODES[mode]
+    log.info(f"microphone node {addr} connected, mode {conn.mode}")
+    return conn
+
+
+class RemoteSignal:
+    '''
+    reads blocks from a raw mode node with the same interface as StreamSignal. frames the node skipped (it
+    couldn't keep up with its device) are filled with silence so the sample indices stay aligned. once the node
+    is gone done is set and silence is returned at the rate of the audio, so the game carries on until it is quit
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+        self.rate = conn.rate
+        self.channels = conn.n_channels
+        self.buffer = np.zeros(0, dtype=np.int16)
+        # index of the frame after the last one received
+        self.frames = 0
+        self.done = False
+
+    def read(self, blocklen):
+        n = blocklen*self.channels
+        while (len(self.buffer) < n) and (not self.done):
+            message = self.conn.recv()
+            if message is None:
+                log.warning("microphone node disconnected")
+            if (message is None) or (message[0] == END):
+                self.done = True
+                break
+            [msg_type, _, sample_idx, payload] = message
+            if msg_type != BLOCK:
+                continue
+            gap = sample_idx - self.frames
+            if gap > 0:
+                log.warning(f"{gap} frames missing from the node at {self.frames}")
+                self.buffer = np.concatenate([self.buffer, np.zeros(gap*self.channels, dtype=np.int16)])
+            block = np.frombuffer(payload, dtype=np.int16)
+            self.buffer = np.concatenate([self.buffer, block])
+            self.frames = sample_idx + len(block)//self.channels
+        if len(self.buffer) < n:
+            time.sleep(blocklen/self.rate)
+            self.buffer = np.concatenate([self.buffer, np.zeros(n - len(self.buffer), dtype=np.int16)])
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def close(self):
+        self.conn.close()
+
+
+class RemoteSignalCapture(ProcessSignalCapture):
+    '''
+    stands in for the signal capture object with a captures mode node, see ProcessSignalCapture. captures that
+    arrive while pause is set are dropped, like the audio thread turning off the capture
+    '''
+    def __init__(self, conn, pause=None, gate=None):
+        super().__init__(None, None, None, gate=gate)
+        self.node = conn
+        self.pause = pause
+        self.n_remote_rejected = 0
+        self.n_received = 0
+        self.thread = None
+
+    @property
+    def n_captures(self):
+        return self.n_received
+
+    @property
+    def n_rejected(self):
+        return self.n_remote_rejected
+
+    def receive_thread(self):
+        while True:
+            message = self.node.recv()
+            if (message is None) or (message[0] == END):
+                break
+            [msg_type, _, _, payload] = message
+            if msg_type != CAPTURE:
+                continue
+            [cap, self.n_remote_rejected] = unpack_capture(payload, Fs=self.node.rate)
+            self.n_received += 1
+            if (self.pause is not None) and (self.pause.value == 1):
+                continue
+            with self.condition:
+                self.caps.append(cap)
+                self.capture_ready = True
+                self.condition.notify()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.receive_thread, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.node.close()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def connect(host, port, retry_interval=1.):
+    '''
+    connect to the scoring machine, retrying until it is listening
+    '''
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+        except OSError:
+            time.sleep(retry_interval)
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+def run_node(host, port, mode="captures", source=None, realtime=True):
+    '''
+    read the microphones (or play a wave file, in real time unless realtime is False) and stream them to the
+    scoring machine until the source ends or the connection is closed. returns the number of bytes sent
+    '''
+    if mode == "captures":
+        # compile the capture kernels before the device is opened, see sig/kernels.py
+        warm_up()
+    if source is None:
+        sig = StreamSignal(frames_per_buffer=5*256)
+    else:
+        sig = FileSignal(source, realtime=realtime)
+    conn = NodeConnection(connect(host, port))
+    conn.send(HELLO, HELLO_PAYLOAD.pack(MODES.index(mode), Fs, 2*BLOCK_LEN))
+    sig_cap = None
+    filt = None
+    if mode == "captures":
+        # the same front end as the audio thread of the realtime game
+        sig_cap = get_signal_capture(Fs, use_lock=False)
+        if config["front_end"] == "full":
+            filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
+    audio_idx = 0
+    try:
+        while not getattr(sig, "done", False):
+            data = sig.read(2*BLOCK_LEN)
+            if mode == "raw":
+                conn.send(BLOCK, data.tobytes(), sample_idx=audio_idx)
+            else:
+                n = (len(data)//2 // SIG_CAP_WINDOW_LEN) * SIG_CAP_WINDOW_LEN
+                lch = data[:2*n:2]
+                rch = data[1:2*n:2] * config["polarity"]
+                if filt is not None:
+                    [lch, rch] = filt.filter(lch, rch)
+                sig_cap.process(lch, rch, frame_offset=audio_idx)
+                for cap in sig_cap.caps:
+                    conn.send(CAPTURE, pack_capture(cap, sig_cap.n_rejected), sample_idx=cap[2][0])
+                sig_cap.caps = []
+            audio_idx += len(data)//2
+        conn.send(END)
+    except (BrokenPipeError, ConnectionResetError):
+        log.warning("scoring machine closed the connection")
+    finally:
+        conn.close()
+        sig.close()
+    return conn.n_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stream the microphones to the scoring machine")
+    parser.add_argument("host", help="scoring machine")
+    parser.add_argument("--port", type=int, default=config["remote_mic_port"] or 9300)
+    parser.add_argument("--mode", choices=MODES, default="captures",
+                        help="send the raw audio or only the captures detected on the node")
+    parser.add_argument("--file", help="stream a two channel recording in real time instead of the microphones")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    n_bytes = run_node(args.host, args.port, args.mode, args.file)
+    print(f"sent {n_bytes} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+'''
+    headless scorekeeper for recorded games. a two channel wave file is run through the same filter, SignalCapture,
+    Game and GameState logic as the realtime game, but instead of waiting on the audio device every capture is
+    handled as soon as it is found and timeouts are measured in samples of the recording. a full match is scored
+    as fast as the filtering and angle estimation allow, and the output is the final score along with a timeline
+    of every event and point.
+
+    player calibration is scripted: either both player's sides are given on the command line, or, like
+    identify_players in the realtime game, the first sound is taken to be player one bouncing the ball on
+    their paddle and the second sound player two.
+
+    with --threaded the audio is instead replayed block by block through the realtime audio and game threads,
+    with timeouts measured by a sample clock (see clock.py) rather than the wall clock.
+
+    usage: python -m pingpong_game.score_recording game-output.wav [more.wav ...] [--p1 name:Left] [--p2 name:Right]
+'''
+import argparse
+import json
+from multiprocessing import Pool, Value
+import sys
+import threading
+
+from pingpong_game.clock import SampleClock
+from pingpong_game.config import config
+from pingpong_game.event_log import EventLog
+from pingpong_game.game import Game
+from pingpong_game.scoreboard import Scoreboard
+from pingpong_game.sig.signal_capture import SignalCapture, get_capture_gate, preprocess_signal
+from pingpong_game.sig.signal_tools import FileSignal, PingPongFilter
+from pingpong_game.state_machine import Event, StartState
+
+
+SIG_CAP_WINDOW_LEN = config["sig_cap_window_len"]
+SIG_CAP_POWER = config["sig_cap_power"]
+BLOCK_LEN = config["signal_block_len"]
+MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
+SERVE_TIMEOUT = config["serve_timeout"]
+GAME_EVENT_TIMEOUT = config["game_event_timeout"]
+POST_SCORING_TIMEOUT = config["post_scoring_timeout"]
+
+
+class RecordingScorer:
+    '''
+    drives a Game over the captures of a preprocessed recording. the scorer plays the part of the
+    game event thread in __main__, with the current position in the recording used as the clock
+    '''
+    def __init__(self, sig_cap, Fs, n_samples, p1_name="Player One", p2_name="Player Two",
+                 p1_position=None, p2_position=None, event_log=None):
+        self.Fs = Fs
+        self.n_samples = n_samples
+        # the scoreboard is only used for its scorekeeping logic, the tk interface is never started
+        self.scoreboard = Scoreboard()
+        self.scoreboard.pause = Value('i', 0)
+        self.scoreboard.quit = Value('i', 0)
+        # the scorer doubles as the game's clock, its time is the position in the recording
+        self.game = Game(sig_cap, self.scoreboard, clock=self, event_log=event_log)
+        self.game.p1.name = p1_name
+        self.game.p2.name = p2_name
+        self.game.p1.position = p1_position
+        self.game.p2.position = p2_position
+        # only captures that pass the game's validity check are used, the same as in wait_for_sound
+        self.captures = [cap for cap in sig_cap.caps if self.game.is_valid_capture(cap)]
+        self.cap_idx = 0
+        # current position in the recording in samples, i.e. the time the game is "waiting" from
+        self.now = 0
+        self.timeline = []
+
+    # the game never waits on this clock (see wait_for_game_event), so it never finishes either
+    finished = False
+
+    def time(self):
+        return self.now/self.Fs
+
+    def next_capture(self):
+        '''
+        return the next capture in the recording or None if there are no captures left.
+        captures are only delivered to the game once they are finished, so the capture's stop
+        index is the time it arrives
+        '''
+        while self.cap_idx < len(self.captures):
+            cap = self.captures[self.cap_idx]
+            self.cap_idx += 1
+            # captures that finished while the game wasn't listening are dropped, like clear_captures
+            if cap[-1][1] >= self.now:
+                return cap
+        return None
+
+    def peek_capture(self):
+        cap_idx = self.cap_idx
+        cap = self.next_capture()
+        self.cap_idx = cap_idx
+        return cap
+
+    def wait_for_game_event(self, timeout):
+        '''
+        equivalent of Game.wait_for_game_event using the recording position as the clock
+        returns None once the recording ends without another event
+        '''
+        deadline = self.now + int(timeout*self.Fs)
+        cap = self.peek_capture()
+        if (cap is not None) and (cap[-1][1] <= deadline):
+            self.next_capture()
+            self.now = cap[-1][1]
+            event = self.game.get_event_from_capture(cap)
+            self.log("event", event=event.etype, player=event.player.name, indices=list(cap[-1]))
+            return event
+        if deadline > self.n_samples:
+            return None
+        self.now = deadline
+        event = Event(self.game.current_state.player, "timeout")
+        self.game.log("event", player=event.player.id, etype="timeout")
+        self.log("event", event=event.etype, player=event.player.name)
+        return event
+
+    def log(self, entry_type, **kwargs):
+        entry = {"time": round(self.now/self.Fs, 3), "sample": int(self.now), "type": entry_type}
+        entry.update(kwargs)
+        self.timeline.append(entry)
+
+    def identify_players(self):
+        '''
+        scripted version of Game.identify_players. each player without a preset position
+        is assigned the side of the next sound in the recording. if only one side is given
+        the other player is put on the opposite side
+        '''
+        p1, p2 = self.game.p1, self.game.p2
+        opposite = {"Left": "Right", "Right": "Left"}
+        if (p1.position is None) and (p2.position is not None):
+            p1.position = opposite[p2.position]
+        elif (p2.position is None) and (p1.position is not None):
+            p2.position = opposite[p1.position]
+        for player in [self.game.p1, self.game.p2]:
+            if player.position is not None:
+                continue
+            cap = self.next_capture()
+            if cap is None:
+                raise ValueError(f"recording ended before {player.name} could be identified")
+            self.now = cap[-1][1]
+            angle = self.game.get_angle_from_capture(cap)
+            player.position = self.game.get_position_from_angle(angle)
+            self.log("calibration", player=player.name, position=player.position, indices=list(cap[-1]))
+
+    def run(self):
+        '''
+        score the recording, following the same state transitions as game_event_thread in __main__
+        '''
+        game = self.game
+        end_of_recording = False
+        self.identify_players()
+        game.new_game()
+        game.set_start_state(game.p1)
+        self.log("start", server=game.p1.name)
+
+        while game.current_state.state_name not in ["ErrorState", "EndState"]:
+            if game.current_state.state_name == "ScoreState":
+                post_scoring_state = self.scoreboard.update_score(game.current_state)
+                self.log(
+                    "point",
+                    player=game.current_state.player.name,
+                    score=list(self.scoreboard.score),
+                )
+                if post_scoring_state.state_name == "EndState":
+                    game.current_state = post_scoring_state
+                    break
+                # ignore any sounds for the post scoring timeout
+                self.now += int(POST_SCORING_TIMEOUT*self.Fs)
+                event = self.wait_for_game_event(SERVE_TIMEOUT)
+            elif game.current_state.state_name == "StartState":
+                event = self.wait_for_game_event(SERVE_TIMEOUT)
+            else:
+                event = self.wait_for_game_event(GAME_EVENT_TIMEOUT)
+            if event is None:
+                end_of_recording = True
+                break
+            game.current_state = game.game_state.transition(game.current_state, event)
+
+        return make_result(game, self.scoreboard, self.timeline, self.n_samples/self.Fs, end_of_recording)
+
+
+def make_result(game, scoreboard, timeline, duration, end_of_recording):
+    '''
+    summary of a scored recording: the players, the final score and state, and the timeline
+    '''
+    state = game.current_state
+    result = {
+        "players": [
+            {"name": game.p1.name, "position": game.p1.position},
+            {"name": game.p2.name, "position": game.p2.position},
+        ],
+        "score": list(scoreboard.score),
+        "final_state": state.state_name,
+        # true if the recording ran out before the game reached an end or error state
+        "end_of_recording": end_of_recording,
+        "duration": round(duration, 3),
+        "timeline": timeline,
+    }
+    if state.state_name == "EndState":
+        result["winner"] = state.player.name
+    elif state.state_name == "ErrorState":
+        result["error"] = state.msg
+    return result
+
+
+def replay_recording(fname, p1_name="Player One", p2_name="Player Two", p1_position=None, p2_position=None,
+                     event_log_fname=None):
+    '''
+    replay a recording through the realtime threads instead of the preprocessed captures. one thread feeds
+    the audio block by block through the filter and SignalCapture while the game waits for sounds on another,
+    the same as in __main__. a lockstep sample clock (see clock.py) measures the timeouts in audio frames, so
+    the replay runs as fast as the threads allow while the timeouts fire where they would in the live game
+    '''
+    sig = FileSignal(fname)
+    Fs = sig.rate
+    clock = SampleClock(Fs, lockstep=True)
+    sig_cap = SignalCapture(SIG_CAP_WINDOW_LEN, SIG_CAP_POWER, MAX_SIG_BUFFER_LEN, gate=get_capture_gate())
+    scoreboard = Scoreboard()
+    scoreboard.pause = Value('i', 0)
+    scoreboard.quit = Value('i', 0)
+    event_log = EventLog(event_log_fname, append=False) if event_log_fname else None
+    game = Game(sig_cap, scoreboard, clock=clock, event_log=event_log)
+    game.p1.name, game.p1.position = p1_name, p1_position
+    game.p2.name, game.p2.position = p2_name, p2_position
+    filt = PingPongFilter(
+        low=config["filter_low_thresh"],
+        high=config["filter_high_thresh"],
+        Fs=Fs,
+        K=6,
+    )
+    timeline = []
+    end_of_recording = Value('i', 0)
+
+    def log(entry_type, **kwargs):
+        entry = {"time": round(clock.time(), 3), "sample": int(clock.frames), "type": entry_type}
+        entry.update(kwargs)
+        timeline.append(entry)
+
+    def audio_thread_func():
+        audio_idx = 0
+        while (not sig.done) and (scoreboard.quit.value == 0):
+            data = sig.read(BLOCK_LEN)
+            # drop any partial window at the end of the file
+            n = (len(data)//2 // SIG_CAP_WINDOW_LEN) * SIG_CAP_WINDOW_LEN
+            lch = data[:2*n:2]
+            rch = data[1:2*n:2] * config["polarity"]
+            [lch, rch] = filt.filter(lch, rch)
+            with sig_cap.condition:
+                sig_cap.process(lch, rch, frame_offset=audio_idx)
+                if sig_cap.capture_ready:
+                    clock.notify(sig_cap.condition)
+            audio_idx += n
+            # advance outside of the condition, in lockstep mode this waits for the game thread
+            clock.advance(n)
+        # wake the game thread so it sees the end of the recording, wherever it is waiting on the clock
+        if scoreboard.quit.value == 0:
+            end_of_recording.value = 1
+        scoreboard.quit.value = 1
+        clock.finish()
+        with sig_cap.condition:
+            sig_cap.condition.notify_all()
+
+    def game_event_thread():
+        for player in [game.p1, game.p2]:
+            if player.position is not None:
+                continue
+            cap = game.wait_for_sound()
+            if cap is None:
+                return
+            angle = game.get_angle_from_capture(cap)
+            player.position = game.get_position_from_angle(angle)
+            log("calibration", player=player.name, position=player.position, indices=list(cap[-1]))
+
+        game.new_game()
+        game.set_start_state(game.p1)
+        log("start", server=game.p1.name)
+        while game.current_state.state_name not in ["ErrorState", "EndState"]:
+            timeout = GAME_EVENT_TIMEOUT
+            if game.current_state.state_name == "ScoreState":
+                post_scoring_state = scoreboard.update_score(game.current_state)
+                log("point", player=game.current_state.player.name, score=list(scoreboard.score))
+                if post_scoring_state.state_name == "EndState":
+                    game.current_state = post_scoring_state
+                    break
+                with sig_cap.condition:
+                    sig_cap.clear_captures()
+                game.clock.sleep(POST_SCORING_TIMEOUT)
+                timeout = SERVE_TIMEOUT
+            elif game.current_state.state_name == "StartState":
+                timeout = SERVE_TIMEOUT
+            cap = game.wait_for_sound(timeout)
+            # interrupted at the end of the recording, which is not a timeout
+            if game.interrupted:
+                break
+            if cap is None:
+                event = game.get_timeout_event()
+                log("event", event=event.etype, player=event.player.name)
+            else:
+                event = game.get_event_from_capture(cap)
+                log("event", event=event.etype, player=event.player.name, indices=list(cap[-1]))
+            game.current_state = game.game_state.transition(game.current_state, event)
+
+    def game_thread_func():
+        try:
+            game_event_thread()
+        finally:
+            # stop the audio thread once the game is over
+            scoreboard.quit.value = 1
+
+    if (game.p1.position is None) != (game.p2.position is None):
+        opposite = {"Left": "Right", "Right": "Left"}
+        game.p1.position = game.p1.position or opposite[game.p2.position]
+        game.p2.position = game.p2.position or opposite[game.p1.position]
+    # the game needs a current state for timeout events during calibration
+    game.current_state = StartState(game.p1)
+    audio_thread = threading.Thread(target=audio_thread_func)
+    game_thread = threading.Thread(target=game_thread_func)
+    game_thread.start()
+    audio_thread.start()
+    game_thread.join()
+    audio_thread.join()
+    sig.close()
+    if event_log is not None:
+        event_log.close()
+
+    result = make_result(game, scoreboard, timeline, clock.time(), end_of_recording.value == 1)
+    result["fname"] = fname
+    return result
+
+
+def score_recording(fname, p1_name="Player One", p2_name="Player Two", p1_position=None, p2_position=None,
+                    event_log_fname=None):
+    '''
+    score a recorded game from a two channel wave file, returns a dict with the final score and the timeline
+    if event_log_fname is given the game is also written to an event log (see event_log.py)
+    '''
+    event_log = EventLog(event_log_fname, append=False) if event_log_fname else None
+    sig_cap = preprocess_signal(fname, SIG_CAP_POWER, window_len=SIG_CAP_WINDOW_LEN)
+    scorer = RecordingScorer(
+        sig_cap,
+        sig_cap.Fs,
+        sig_cap.n_samples,
+        p1_name=p1_name,
+        p2_name=p2_name,
+        p1_position=p1_position,
+        p2_position=p2_position,
+        event_log=event_log,
+    )
+    result = scorer.run()
+    if event_log is not None:
+        event_log.close()
+    result["fname"] = fname
+    return result
+
+
+def parse_player(arg, default_name):
+    '''
+    parse a player argument of the form name, name:side or :side
+    '''
+    if arg is None:
+        return default_name, None
+    name, _, side = arg.partition(":")
+    side = side.capitalize() or None
+    if side not in [None, "Left", "Right"]:
+        raise argparse.ArgumentTypeError(f"invalid side {side}, expected Left or Right")
+    return (name or default_name), side
+
+
+def _score_job(args):
+    fname, p1, p2, threaded, log_events = args
+    event_log_fname = fname.replace(".wav", "") + "-log.jsonl" if log_events else None
+    if threaded:
+        return replay_recording(fname, p1[0], p2[0], p1[1], p2[1], event_log_fname)
+    return score_recording(fname, p1[0], p2[0], p1[1], p2[1], event_log_fname)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="score recorded ping pong games without a gui or audio device")
+    parser.add_argument("fnames", nargs="+", help="two channel wave files to score")
+    parser.add_argument("--p1", help="player one as name:side, e.g. nicky:Left")
+    parser.add_argument("--p2", help="player two as name:side, e.g. kyle:Right")
+    parser.add_argument("-o", "--output", help="write the results as json to this file instead of stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of recordings to score in parallel")
+    parser.add_argument("--threaded", action="store_true",
+                        help="replay the audio through the realtime threads using a sample clock")
+    parser.add_argument("--event-log", action="store_true",
+                        help="write an event log next to each recording, e.g. game-output-log.jsonl")
+    args = parser.parse_args(argv)
+
+    p1 = parse_player(args.p1, "Player One")
+    p2 = parse_player(args.p2, "Player Two")
+    jobs = [(fname, p1, p2, args.threaded, args.event_log) for fname in args.fnames]
+    if args.jobs > 1:
+        with Pool(args.jobs) as pool:
+            results = pool.map(_score_job, jobs)
+    else:
+        results = [_score_job(job) for job in jobs]
+
+    for result in results:
+        winner = result.get("winner", "no winner")
+        print(f"{result['fname']}: {result['score'][0]}-{result['score'][1]} ({result['final_state']}, {winner})",
+              file=sys.stderr)
+    output = results[0] if len(results) == 1 else results
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+'''
+    score publication server. pushes the score, the server and the state of the game to any number of clients
+    (spectator displays, stream overlays, ...) over http using server-sent events, so they don't need their own
+    gui process polling the game. the server runs an asyncio event loop in a background thread and only uses
+    the standard library.
+
+    the game calls publish with a snapshot of the game whenever it likes (e.g. every time around its main loop).
+    snapshots that haven't changed are dropped, and changes are coalesced so clients get at most one update
+    every min_interval seconds containing the latest state. a slow client never queues up old states either,
+    it is just sent the latest snapshot once it is ready for more.
+
+    several games can be published by the same server under different keys, e.g. one per table in multi-table
+    mode. endpoints:
+        GET /                   small score page using the event stream
+        GET /score/<key>        latest snapshot as json
+        GET /events/<key>       event stream, the latest snapshot is sent on connect and then on every change
+    the key defaults to "game" if left out. the server is started by the realtime game and multi-table mode
+    when score_server_enabled is set in the config.
+'''
+import asyncio
+import json
+import threading
+
+from pingpong_game.config import config
+
+
+DEFAULT_KEY = "game"
+# send a comment line this often so idle connections aren't closed by proxies and dead clients are noticed
+KEEPALIVE_INTERVAL = 15
+
+PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>ping pong score</title>
+<style>body{font-family:Arial;text-align:center}#score{font-size:120px}</style></head>
+<body><h1 id="players"></h1><div id="score">0 - 0</div><h2 id="state"></h2>
+<script>
+const key = new URLSearchParams(location.search).get("key") || "%s";
+const es = new EventSource("/events/" + key);
+es.onmessage = (msg) => {
+  const s = JSON.parse(msg.data);
+  document.getElementById("players").textContent = s.players.map(p => p.name).join(" vs ");
+  document.getElementById("score").textContent = s.score.join(" - ");
+  document.getElementById("state").textContent = (s.serving ? s.serving + " serving, " : "") + s.state;
+};
+</script></body></html>
+""" % DEFAULT_KEY
+
+
+class ScoreServer:
+    '''
+    http server publishing game snapshots. start runs the event loop in a daemon thread,
+    publish can be called from any thread
+    '''
+    def __init__(self, host=None, port=None, min_interval=None):
+        self.host = host if host is not None else config["score_server_host"]
+        self.port = port if port is not None else config["score_server_port"]
+        self.min_interval = min_interval if min_interval is not None else config["score_server_min_interval"]
+        # latest snapshot (as json) given to publish for each key, and the snapshots last sent to clients
+        self.latest = {}
+        self.published = {}
+        self.lock = threading.Lock()
+        self.flush_pending = False
+        self.last_flush = 0
+        self.n_clients = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.stopping = False
+        # set (and replaced) every time the published snapshots change, clients wait on it
+        self.changed = None
+
+    def start(self):
+        '''
+        start the server in a background thread, returns once it is accepting connections
+        '''
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def _run(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.changed = asyncio.Event()
+        with self.lock:
+            # anything published before the server started
+            self.published = dict(self.latest)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle_client, self.host, self.port, backlog=1024)
+        )
+        # port 0 picks a free port, record the one actually used
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            # event streams otherwise only end when the client goes away, wake them up so they finish
+            self.stopping = True
+            self.changed.set()
+            tasks = asyncio.all_tasks(self.loop)
+            if tasks:
+                self.loop.run_until_complete(asyncio.wait(tasks, timeout=1))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def publish(self, snapshot, key=DEFAULT_KEY):
+        '''
+        publish a json serializable snapshot of a game. nothing is sent if it is the same as the
+        last snapshot published under the key
+        '''
+        data = json.dumps(snapshot, separators=(",", ":"))
+        with self.lock:
+            if self.latest.get(key) == data:
+                return
+            self.latest[key] = data
+            if self.flush_pending or (self.loop is None):
+                return
+            self.flush_pending = True
+        self.loop.call_soon_threadsafe(self._schedule_flush)
+
+    def _schedule_flush(self):
+        delay = max(0, self.last_flush + self.min_interval - self.loop.time())
+        self.loop.call_later(delay, self._flush)
+
+    def _flush(self):
+        with self.lock:
+            self.published = dict(self.latest)
+            self.flush_pending = False
+        self.last_flush = self.loop.time()
+        changed = self.changed
+        self.changed = asyncio.Event()
+        changed.set()
+
+    async def _handle_client(self, reader, writer):
+        self.n_clients += 1
+        try:
+            request = await reader.readline()
+            # skip the headers, nothing in them is needed
+            while (await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                pass
+            parts = request.decode("latin-1").split()
+            if (len(parts) < 2) or (parts[0] != "GET"):
+                await self._respond(writer, "405 Method Not Allowed", "text/plain", "method not allowed\n")
+                return
+            path = parts[1].split("?")[0].strip("/").split("/")
+            key = path[1] if len(path) > 1 else DEFAULT_KEY
+            if path[0] == "":
+                await self._respond(writer, "200 OK", "text/html; charset=utf-8", PAGE)
+            elif path[0] == "score":
+                await self._respond(writer, "200 OK", "application/json", self.published.get(key, "null"))
+            elif path[0] == "events":
+                await self._stream_events(writer, key)
+            else:
+                await self._respond(writer, "404 Not Found", "text/plain", "not found\n")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.n_clients -= 1
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        body = body.encode()
+        writer.write(
+            (f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+             "Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n").encode() + body
+        )
+        await writer.drain()
+
+    async def _stream_events(self, writer, key):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n"
+        )
+        sent = None
+        while not self.stopping:
+            # take the event before reading the score, a flush while draining then wakes this client right away
+            changed = self.changed
+            data = self.published.get(key)
+            if (data is not None) and (data != sent):
+                writer.write(f"data: {data}\n\n".encode())
+                sent = data
+            await writer.drain()
+            try:
+                await asyncio.wait_for(changed.wait(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                writer.write(b": keepalive\n\n")
@@ -1,10 +1,9 @@
 """
     scoreboard code. implements any user interface behavior as well as basic scorekeeping logic
-    Tkinter is used for the interface
+    Tkinter is used for the interface. tkinter is only imported once the interface is actually used
+    so the scorekeeping logic can run on machines without a display
 """
 from functools import partial
-import tkinter as Tk
-from tkinter import messagebox, simpledialog
 
 from pingpong_game.state_machine import ErrorState, EndState
 
@@ -37,6 +36,12 @@ class Scoreboard:
         self.score = [0,0]
         self.points_to_win = 21
         self.win_by = 2
+        # optional event log (see event_log.py) which score changes are written to
+        self.event_log = None
+
+    def log_score(self, reason, player=None):
+        if self.event_log is not None:
+            self.event_log.log("score", score=list(self.score), reason=reason, player=getattr(player, "id", None))
 
     # change the 'now serving' label depending on who was detected as the server
     # NOTE: the game does not enforce any serving rules such as 5 serves on each side
@@ -49,6 +54,7 @@ class Scoreboard:
 
     # initialize TkInter variables and gui using a grid layout for more control over display
     def init_tk(self, pause, quit_):
+        import tkinter as Tk
         root = Tk.Tk()
         root.geometry("330x330+1000+100")
         self.p1_str_var = Tk.StringVar(value="Player One")
@@ -125,6 +131,7 @@ class Scoreboard:
                 self.score[1] = min(self.score[1] + 1, 21)
             else:
                 self.score[1] = max(self.score[1] - 1, 0)
+        self.log_score("adjust")
         self.p1_score_var.set(self.score[0])
         self.p2_score_var.set(self.score[1])
 
@@ -133,6 +140,7 @@ class Scoreboard:
         output a message alert to the player, pausing any capturing while waiting
         for the user to exit the prompt
         '''
+        from tkinter import messagebox
         is_paused = self.pause.value == 1
         if not is_paused:
             self.pause.value = 1
@@ -144,6 +152,7 @@ class Scoreboard:
         '''
         confirm the promp with the user, pause the input stream while waiting
         '''
+        from tkinter import messagebox
         is_paused = self.pause.value == 1
         if not is_paused:
             self.pause.value = 1
@@ -160,6 +169,7 @@ class Scoreboard:
         '''
         get an input from the user, pausing the input while waiting
         '''
+        from tkinter import simpledialog
         is_paused = self.pause.value == 1
         if not is_paused:
             self.pause.value = 1
@@ -180,6 +190,7 @@ class Scoreboard:
             self.score[1] += 1
         else:
             return ErrorState(msg="invalid player passed to scoreboard")
+        self.log_score("point", score_state.player)
 
         if (self.score[0] >= 21) and (self.score[1] <= 19):
             return EndState(self.p1)
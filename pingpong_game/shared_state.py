@@ -0,0 +1,210 @@
+'''
+    state shared between processes through multiprocessing.shared_memory, used in place of multiprocessing.Value
+    for the flags and clocks that are read every frame or block. a Value goes through a lock on every read and
+    write, while readers here never lock.
+
+    SharedControl is a block of named int64 fields behind a sequence counter (a seqlock): a write makes the
+    counter odd, writes the fields and makes it even again, and a read copies the fields and retries if the counter
+    was odd or changed meanwhile. several fields written together (e.g. the audio clock and the time it was
+    updated) are therefore always read together. all writes must come from one process, within which they are
+    serialized by an ordinary lock. field(name) gives an object with a value attribute, so a field can be passed
+    anywhere a multiprocessing.Value was used (the scoreboard's pause and quit flags for example).
+
+    SharedRing is a ring buffer of the most recent frames of a multichannel stream with one writer and any number
+    of readers, each reader keeping track of its own position. frames are indexed by their position in the
+    stream, a read of frames that have already been overwritten returns None.
+
+    both are pickled by name, so they can be passed to a Process and are attached to the same memory on the
+    other side. the process that creates one should close it when done, which also frees the memory.
+
+    NOTE: python has no memory fences, the seqlock relies on the stores to the shared memory becoming visible to
+    other processes in the order they were made, which holds on x86
+'''
+from multiprocessing import shared_memory
+import threading
+import time
+
+import numpy as np
+
+
+class SharedControl:
+    def __init__(self, fields, name=None):
+        self.fields = tuple(fields)
+        self.index = {field: i + 1 for i, field in enumerate(self.fields)}
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=8*(len(self.fields) + 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # the sequence counter followed by the fields. a memoryview is used rather than a numpy array, indexing
+        # it is several times faster for single values
+        self.data = self.shm.buf.cast("q")
+        if self.owner:
+            for i in range(len(self.data)):
+                self.data[i] = 0
+        self.write_lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"fields": self.fields, "name": self.shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["fields"], name=state["name"])
+
+    def close(self):
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __del__(self):
+        # the view has to be released before the shared memory can close itself, which it does when collected
+        if hasattr(self, "data"):
+            self.data.release()
+
+    def read(self, *fields):
+        '''
+        consistent snapshot of the given fields (all of them if none are given) as a list of ints
+        '''
+        idx = [self.index[field] for field in fields or self.fields]
+        data = self.data
+        while True:
+            seq = data[0]
+            if seq % 2 == 0:
+                values = [data[i] for i in idx]
+                if data[0] == seq:
+                    return values
+            # a write is in progress, let the writer finish
+            time.sleep(0)
+
+    def write(self, **values):
+        '''
+        set the given fields, readers see either all of the new values or none of them
+        '''
+        data = self.data
+        with self.write_lock:
+            data[0] += 1
+            for field, value in values.items():
+                data[self.index[field]] = int(value)
+            data[0] += 1
+
+    def __getitem__(self, field):
+        # a single field needs no retry loop, an aligned 8 byte value is never seen half written
+        return self.data[self.index[field]]
+
+    def field(self, field):
+        return SharedField(self, field)
+
+
+class SharedField:
+    '''
+    one field of a SharedControl, with the value attribute of a multiprocessing.Value
+    '''
+    def __init__(self, control, field):
+        self.control = control
+        self.field = field
+
+    @property
+    def value(self):
+        return self.control[self.field]
+
+    @value.setter
+    def value(self, value):
+        self.control.write(**{self.field: value})
+
+
+class SharedRing:
+    '''
+    the last capacity frames of an n_channels stream. the header holds the number of frames written so far and
+    the end of the block being written, which tells a reader whether the frames it copied were overwritten
+    while it copied them
+    '''
+    HEADER_LEN = 2
+
+    def __init__(self, n_channels, capacity, dtype=np.int16, name=None):
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        header_size = 8*self.HEADER_LEN
+        size = header_size + capacity*n_channels*self.dtype.itemsize
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # [frames written, end of the block being written]
+        self.header = np.ndarray(self.HEADER_LEN, dtype=np.int64, buffer=self.shm.buf)
+        self.frames = np.ndarray((capacity, n_channels), dtype=self.dtype, buffer=self.shm.buf, offset=header_size)
+        if self.owner:
+            self.header[:] = 0
+
+    def __getstate__(self):
+        return {
+            "n_channels": self.n_channels,
+            "capacity": self.capacity,
+            "dtype": self.dtype.str,
+            "name": self.shm.name,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["n_channels"], state["capacity"], state["dtype"], name=state["name"])
+
+    def close(self):
+        self.header = None
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __del__(self):
+        # see SharedControl.__del__
+        self.header = None
+        self.frames = None
+
+    @property
+    def write_pos(self):
+        return int(self.header[0])
+
+    @property
+    def start_pos(self):
+        '''
+        index of the oldest frame that can still be read
+        '''
+        return max(0, int(self.header[1]) - self.capacity)
+
+    def write(self, frames):
+        '''
+        append frames of shape (n, n_channels) (or interleaved samples, which are reshaped), n <= capacity
+        '''
+        frames = np.asarray(frames, dtype=self.dtype).reshape(-1, self.n_channels)
+        n = len(frames)
+        if n > self.capacity:
+            raise ValueError(f"block of {n} frames doesn't fit in a ring of {self.capacity}")
+        pos = int(self.header[0])
+        # readers of the frames about to be overwritten can tell from the reserved end
+        self.header[1] = pos + n
+        lb = pos % self.capacity
+        first = min(n, self.capacity - lb)
+        self.frames[lb:lb + first] = frames[:first]
+        self.frames[:n - first] = frames[first:]
+        self.header[0] = pos + n
+
+    def read(self, start, n):
+        '''
+        copy of the frames from start up to start + n or the last frame written, whichever is first.
+        None if some of them have been overwritten
+        '''
+        end = min(start + n, int(self.header[0]))
+        if end <= start:
+            return np.zeros((0, self.n_channels), dtype=self.dtype)
+        if start < int(self.header[1]) - self.capacity:
+            return None
+        lb = start % self.capacity
+        ub = lb + end - start
+        if ub <= self.capacity:
+            frames = self.frames[lb:ub].copy()
+        else:
+            frames = np.concatenate([self.frames[lb:], self.frames[:ub - self.capacity]])
+        # the writer may have started on frames that overlap the copy in the meantime
+        if start < int(self.header[1]) - self.capacity:
+            return None
+        return frames
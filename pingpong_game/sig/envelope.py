@@ -0,0 +1,174 @@
+'''
+    multi-resolution min/max envelope of a recording for browsing long recordings. plotting every sample of an
+    hour long match means drawing hundreds of millions of points, but a plot can only show one column of pixels
+    per point anyway, and the min and max of the samples under each column is all that's visible.
+
+    level 0 of the pyramid holds the min and max of each block of base samples of every channel, and each level
+    above holds the min and max of factor blocks of the level below, up to a level with only a few hundred
+    blocks. a viewer picks the coarsest level that still has a block per pixel of the visible span (or the
+    samples themselves when zoomed in far enough), so drawing any span costs about the same.
+
+    the pyramid of the filtered channels is stored next to the wave file in a <recording>.envelope directory
+    (one .npy per level plus meta.json) and memory mapped when loaded. it is rebuilt if the wave file or the
+    filter settings change.
+'''
+import json
+import os
+import shutil
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.signal_cache import load_filtered_signal
+
+
+# bumped whenever the layout of the stored pyramid changes
+ENVELOPE_VERSION = 1
+
+
+def reduce_min_max(mins, maxs, factor):
+    '''
+    min of the mins and max of the maxs of each group of factor consecutive rows, the last group may be partial
+    '''
+    n = len(mins)
+    n_out = -(-n // factor)
+    pad = n_out*factor - n
+    if pad > 0:
+        mins = np.concatenate([mins, np.full((pad,) + mins.shape[1:], np.inf, dtype=mins.dtype)])
+        maxs = np.concatenate([maxs, np.full((pad,) + maxs.shape[1:], -np.inf, dtype=maxs.dtype)])
+    shape = (n_out, factor) + mins.shape[1:]
+    return mins.reshape(shape).min(axis=1), maxs.reshape(shape).max(axis=1)
+
+
+class EnvelopePyramid:
+    '''
+    levels[i] has shape (n_blocks, n_channels, 2) holding the min and max of each block of
+    block_sizes[i] samples. signal (optional) is the list of channels themselves, used when a span is
+    short enough to draw every sample
+    '''
+    def __init__(self, levels, block_sizes, n_samples, Fs, signal=None):
+        self.levels = levels
+        self.block_sizes = block_sizes
+        self.n_samples = n_samples
+        self.Fs = Fs
+        self.signal = signal
+
+    @classmethod
+    def build(cls, channels, Fs, base=64, factor=4, min_blocks=256, chunk_len=1 << 22):
+        '''
+        build the pyramid from a list of equal length channels, reading them chunk_len samples at a time
+        so memory mapped channels are never loaded as a whole
+        '''
+        n_samples = len(channels[0])
+        chunk_len -= chunk_len % base
+        mins, maxs = [], []
+        for lb in range(0, n_samples, chunk_len):
+            chunk = np.stack([np.asarray(ch[lb:lb + chunk_len], dtype=np.float32) for ch in channels], axis=1)
+            [chunk_mins, chunk_maxs] = reduce_min_max(chunk, chunk, base)
+            mins.append(chunk_mins)
+            maxs.append(chunk_maxs)
+        mins = np.concatenate(mins)
+        maxs = np.concatenate(maxs)
+        levels = [np.stack([mins, maxs], axis=-1)]
+        block_sizes = [base]
+        while len(mins) > min_blocks:
+            [mins, maxs] = reduce_min_max(mins, maxs, factor)
+            levels.append(np.stack([mins, maxs], axis=-1))
+            block_sizes.append(block_sizes[-1]*factor)
+        return cls(levels, block_sizes, n_samples, Fs)
+
+    def save(self, dirname, meta=None):
+        '''
+        write each level and meta.json to dirname, replacing whatever was there
+        '''
+        tmp_dirname = dirname + ".tmp"
+        shutil.rmtree(tmp_dirname, ignore_errors=True)
+        os.makedirs(tmp_dirname)
+        for i, level in enumerate(self.levels):
+            np.save(os.path.join(tmp_dirname, f"level_{i}.npy"), level)
+        meta = dict(
+            meta or {},
+            version=ENVELOPE_VERSION,
+            block_sizes=self.block_sizes,
+            n_samples=self.n_samples,
+            fs=self.Fs,
+        )
+        with open(os.path.join(tmp_dirname, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(dirname, ignore_errors=True)
+        os.replace(tmp_dirname, dirname)
+
+    @classmethod
+    def load(cls, dirname, signal=None):
+        '''
+        memory map a saved pyramid, returns (pyramid, meta)
+        '''
+        with open(os.path.join(dirname, "meta.json")) as f:
+            meta = json.load(f)
+        levels = [
+            np.load(os.path.join(dirname, f"level_{i}.npy"), mmap_mode="r") for i in range(len(meta["block_sizes"]))
+        ]
+        return cls(levels, meta["block_sizes"], meta["n_samples"], meta["fs"], signal=signal), meta
+
+    def get_level(self, span, n_points):
+        '''
+        index of the coarsest level with at least n_points blocks in a span of span samples,
+        None if even level 0 is too coarse and the samples should be drawn
+        '''
+        level = None
+        for i, block_size in enumerate(self.block_sizes):
+            if span / block_size >= n_points:
+                level = i
+        return level
+
+    def get_span(self, start, stop, n_points):
+        '''
+        envelope of the samples from start to stop at a resolution of at least n_points points.
+        returns (sample index of each point, mins, maxs), mins and maxs have shape (n_points, n_channels).
+        with no level fine enough the samples themselves are returned (mins and maxs are the same) if the
+        pyramid has the signal, otherwise level 0 is used
+        '''
+        start = max(0, int(start))
+        stop = min(self.n_samples, int(stop))
+        level = self.get_level(stop - start, n_points)
+        if (level is None) and (self.signal is not None):
+            samples = np.stack([np.asarray(ch[start:stop]) for ch in self.signal], axis=1)
+            return np.arange(start, stop), samples, samples
+        if level is None:
+            level = 0
+        block_size = self.block_sizes[level]
+        lb, ub = start // block_size, -(-stop // block_size)
+        blocks = np.asarray(self.levels[level][lb:ub])
+        return np.arange(lb, ub)*block_size, blocks[..., 0], blocks[..., 1]
+
+
+def get_envelope_dir(fname):
+    return f"{fname}.envelope"
+
+
+def load_envelope_pyramid(fname, low=None, high=None, polarity=None, rebuild=False):
+    '''
+    envelope pyramid of the filtered channels of a two channel wave file, loaded from next to the file when it
+    is up to date and built and saved otherwise. the filtered channels (from the signal cache, see
+    load_filtered_signal) are attached as the signal for drawing individual samples
+    '''
+    if low is None:
+        low = config["filter_low_thresh"]
+    if high is None:
+        high = config["filter_high_thresh"]
+    if polarity is None:
+        polarity = config["polarity"]
+    st = os.stat(fname)
+    source = {"size": st.st_size, "mtime": st.st_mtime, "low": low, "high": high, "polarity": polarity}
+
+    [lch, rch, Fs] = load_filtered_signal(fname, low=low, high=high, polarity=polarity)
+    signal = [lch, rch]
+    dirname = get_envelope_dir(fname)
+    if (not rebuild) and os.path.exists(os.path.join(dirname, "meta.json")):
+        [pyramid, meta] = EnvelopePyramid.load(dirname, signal=signal)
+        if (meta.get("version") == ENVELOPE_VERSION) and (meta.get("source") == source):
+            return pyramid
+    pyramid = EnvelopePyramid.build([lch, rch], Fs)
+    pyramid.signal = signal
+    pyramid.save(dirname, meta={"source": source})
+    return pyramid
@@ -0,0 +1,127 @@
+'''
+    optional compiled kernels for the two sequential inner loops of the signal processing: the per window
+    power check of SignalCapture.process and the delay search of the beamformer. both loop over small pieces
+    of the signal one at a time, which costs a few numpy calls per window or per delay and doesn't vectorize
+    well. when numba is installed these loops are compiled on first use (and cached on disk), otherwise the
+    numpy code is used. numba itself is only imported on first use too, so importing this module stays cheap. set config["jit_kernels"] to False to always use the numpy code.
+
+    compiling (or loading from the disk cache) takes a while, so the realtime entry points call warm_up before
+    the first block arrives. offline tools pay for it on first use, if they need the kernels at all.
+
+    both versions give the same results: sums of squares are accumulated exactly for integer input, and the
+    beamformer compares the rms of each delay the same way as signal_tools.beamformer_time_delay.
+    devtools/kernel_benchmark.py checks this on a recording and times both versions.
+'''
+from importlib.util import find_spec
+
+import numpy as np
+
+from pingpong_game.config import config
+
+
+# True if the compiled kernels are used
+USE_JIT = bool(config["jit_kernels"]) and (find_spec("numba") is not None)
+
+
+def jit(func):
+    '''
+    compile func with numba on its first call
+    '''
+    compiled = None
+
+    def wrapper(*args):
+        nonlocal compiled
+        if compiled is None:
+            import numba
+            compiled = numba.njit(cache=True, error_model="numpy")(func)
+        return compiled(*args)
+    return wrapper
+
+
+def window_stats_numpy(lsig, rsig, window_len):
+    '''
+    rms and peak absolute value of each full window of both channels, returns (lrms, rrms, lpeak, rpeak).
+    same values as calling get_rms and abs().max() on each window
+    '''
+    n_windows = len(lsig) // window_len
+    lwin = np.asarray(lsig)[:n_windows*window_len].reshape(n_windows, window_len)
+    rwin = np.asarray(rsig)[:n_windows*window_len].reshape(n_windows, window_len)
+    return (
+        np.sqrt(np.mean(lwin**2, axis=1)),
+        np.sqrt(np.mean(rwin**2, axis=1)),
+        np.abs(lwin).max(axis=1, initial=0),
+        np.abs(rwin).max(axis=1, initial=0),
+    )
+
+
+def _window_stats(lsig, rsig, window_len):
+    n_windows = len(lsig) // window_len
+    lrms = np.zeros(n_windows)
+    rrms = np.zeros(n_windows)
+    lpeak = np.zeros(n_windows)
+    rpeak = np.zeros(n_windows)
+    for i in range(n_windows):
+        l_sum_sq = 0.
+        r_sum_sq = 0.
+        for j in range(i*window_len, (i + 1)*window_len):
+            l_sum_sq += lsig[j]*lsig[j]
+            r_sum_sq += rsig[j]*rsig[j]
+            lpeak[i] = max(lpeak[i], abs(lsig[j]))
+            rpeak[i] = max(rpeak[i], abs(rsig[j]))
+        lrms[i] = np.sqrt(l_sum_sq / window_len)
+        rrms[i] = np.sqrt(r_sum_sq / window_len)
+    return lrms, rrms, lpeak, rpeak
+
+
+def _beamformer_delay(sig1, sig2, max_delay):
+    # returns max_delay + 1 if no delay gives any power, beamformer_time_delay returns None in that case
+    rms_max = 0.
+    best = max_delay + 1
+    n = len(sig1)
+    for delay in range(-max_delay, max_delay + 1):
+        D = abs(delay)
+        sum_sq = 0.
+        for j in range(n - D):
+            if delay > 0:
+                s = sig1[j] + sig2[j + D]
+            else:
+                s = sig2[j] + sig1[j + D]
+            sum_sq += s*s
+        rms = np.sqrt(sum_sq / (n - D))
+        if rms > rms_max:
+            rms_max = rms
+            best = delay
+    return best
+
+
+if USE_JIT:
+    window_stats = jit(_window_stats)
+    _beamformer_delay_jit = jit(_beamformer_delay)
+
+    def beamformer_time_delay(sig1, sig2, max_delay):
+        '''
+        compiled version of signal_tools.beamformer_time_delay
+        '''
+        delay = _beamformer_delay_jit(
+            np.ascontiguousarray(sig1, dtype=float), np.ascontiguousarray(sig2, dtype=float), max_delay
+        )
+        if delay > max_delay:
+            return None
+        return int(delay)
+else:
+    window_stats = window_stats_numpy
+    # signal_tools.beamformer_time_delay keeps its own loop
+    beamformer_time_delay = None
+
+
+def warm_up():
+    '''
+    compile (or load from the cache) the kernels for the types used while capturing, so that the first block
+    and the first delay estimate aren't held up. does nothing without numba
+    '''
+    if not USE_JIT:
+        return
+    x = np.zeros(16, dtype=np.int32)
+    window_stats(x, x, 8)
+    window_stats(x.astype(float), x.astype(float), 8)
+    beamformer_time_delay(x, x, 2)
@@ -0,0 +1,229 @@
+'''
+    multirate front end for capture detection. ping pong sounds only occupy the 8-10 kHz band, so instead of
+    bandpass filtering every channel at 48 kHz and gating on the full rate signal, the band is shifted down to
+    0 Hz (complex demodulation), lowpass filtered and decimated, 8x by default to 6 kHz. capture detection then
+    runs on the envelope of the decimated signal. the delay between the mics needs the full sample rate though,
+    so the raw full rate samples are kept in a ring buffer and only the short segment around the onset of each
+    detected sound is bandpass filtered at full rate and handed to the game as the capture's samples. the
+    capture's indices and statistics still describe the whole sound, as with the full rate front end, so the
+    capture gate and the event log see the same thing whichever front end is used.
+
+    the lowpass is a short FIR filter evaluated only at the decimated output times (a polyphase decimator),
+    and the demodulating oscillator is a precomputed table, so the per sample cost is a complex multiply and
+    a few multiply-adds per channel. devtools/multirate_compare.py checks the detector against the full rate
+    one and compares their cost.
+
+    with two channels the demodulator costs about as much as the full rate filter, the gain comes from running
+    one demodulator over all the channels of a multichannel interface (see get_demodulator and multi_table.py),
+    with each table's capture taking its pair of envelope channels.
+'''
+from fractions import Fraction
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.signal_capture import Capture, CaptureStats, SignalCapture, get_capture_gate
+from pingpong_game.sig.signal_tools import get_pingpong_filter, get_rms
+
+
+class Demodulator:
+    '''
+    streaming complex demodulator and decimator. process takes blocks of shape (n_frames, n_channels) and
+    returns the complex baseband signal at Fs/decimation. state is carried over between blocks
+    '''
+    def __init__(self, f0, Fs, decimation=8, numtaps=32, cutoff=1500, n_channels=2):
+        from scipy import signal
+        self.decimation = decimation
+        self.numtaps = numtaps
+        # the lowpass only needs to remove what would alias back into the band after decimation
+        self.h = signal.firwin(numtaps, cutoff, fs=Fs)[::-1].copy()
+        # one period of the oscillator, f0/Fs is usually a simple fraction (9 kHz / 48 kHz = 3/16)
+        period = (Fraction(f0)/Fs).limit_denominator(Fs).denominator
+        self.osc = np.exp(-2j*np.pi*f0/Fs*np.arange(period))
+        self.n = 0
+        self.history = np.zeros((numtaps - 1, n_channels), dtype=complex)
+
+    def process(self, block):
+        n = block.shape[0]
+        t = (self.n + np.arange(n)) % len(self.osc)
+        x = np.concatenate([self.history, block * self.osc[t][:, None]])
+        # only evaluate the filter at the samples which are kept after decimation. each row of the strided
+        # view is the window of numtaps samples ending at one of those samples
+        first = (-self.n) % self.decimation
+        n_out = (n - first + self.decimation - 1) // self.decimation
+        [s0, s1] = x.strides
+        windows = np.lib.stride_tricks.as_strided(
+            x[first:], shape=(n_out, x.shape[1], self.numtaps), strides=(self.decimation*s0, s1, s0)
+        )
+        y = windows @ self.h
+        self.history = x[n:]
+        self.n += n
+        return y
+
+    def envelope(self, block):
+        # the baseband signal only holds half of the band's power (the negative frequencies were filtered out)
+        return np.sqrt(2)*np.abs(self.process(block))
+
+
+def get_demodulator(Fs, n_channels=2, decimation=None):
+    '''
+    demodulator for the configured ping pong band, decimating by config["multirate_decimation"] by default
+    '''
+    if decimation is None:
+        decimation = config["multirate_decimation"]
+    low, high = config["filter_low_thresh"], config["filter_high_thresh"]
+    return Demodulator((low + high)/2, Fs, decimation=decimation, cutoff=(high - low)/2 + 500, n_channels=n_channels)
+
+
+class MultirateSignalCapture(SignalCapture):
+    '''
+    drop in replacement for SignalCapture which takes the unfiltered signal. detection runs on the decimated
+    envelope using a SignalCapture with the same window length (in time) and power threshold, and each capture
+    is then rebuilt from the full rate samples: a segment of up to segment_len samples starting pre_roll samples
+    before the onset, bandpass filtered and padded like a normal capture, with its gate and notification handled
+    the same way.
+
+    the capture's indices are the start and stop of the whole sound, not of the segment, and its statistics
+    cover the whole sound too, so the gate applies the same threshold as with the full rate front end. windows
+    of a long sound that fall outside the segment are taken from the envelope (their peaks are left out).
+    stats.offset is the index of the sound's first window in the samples, which is negative when the segment
+    starts after it; stats.onset_idx is the onset in the samples either way
+    '''
+    def __init__(self, window_len, power_thresh, max_capture_len, Fs, padding=50, use_lock=True, gate=None,
+                 decimation=None, segment_len=None, pre_roll=None):
+        super().__init__(
+            window_len, power_thresh, max_capture_len, padding=padding, use_lock=use_lock, gate=gate, Fs=Fs
+        )
+        if decimation is None:
+            decimation = config["multirate_decimation"]
+        if segment_len is None:
+            segment_len = config["multirate_segment_len"]
+        if pre_roll is None:
+            pre_roll = config["onset_pre_roll"]
+        self.decimation = decimation
+        self.segment_len = segment_len
+        self.pre_roll = pre_roll
+        low, high = config["filter_low_thresh"], config["filter_high_thresh"]
+        self.demod = get_demodulator(Fs, decimation=decimation)
+        # the FIR delays the envelope by half its length, detected boundaries are moved back by this much
+        self.group_delay = (self.demod.numtaps - 1)//2
+        # the full rate bandpass filter is only run over each capture's segment, starting warmup samples early
+        # so the filter has settled by the start of the segment
+        [self.b, self.a] = get_pingpong_filter(low=low, high=high, Fs=Fs)
+        self.warmup = int(.005*Fs)
+        # detection on the envelope, power is compared on the same scale as the full rate signal
+        self.detector = SignalCapture(
+            window_len//decimation, power_thresh, max_capture_len//decimation, padding=0, use_lock=False
+        )
+        # frame index just after the last sample written to the ring buffer (l_sig_buffer and r_sig_buffer)
+        self.end_frame = 0
+
+    @property
+    def is_capturing(self):
+        return self.detector.capturing_signal
+
+    def clear_captures(self):
+        super().clear_captures()
+        self.detector.clear_captures()
+
+    def process(self, lsig, rsig, frame_offset=0, envelope=None):
+        '''
+        process the next block of the unfiltered channels. the block length must be a multiple of the window length.
+        envelope is this pair's channels from a demodulator shared by several captures, fed the same blocks with
+        the same decimation, if None the capture demodulates the block itself
+        '''
+        n = len(lsig)
+        # store the raw samples for rebuilding captures at full rate, wrapping around the end of the ring buffer
+        lb = self.w_idx
+        first = min(n, self.max_capture_len - lb)
+        self.l_sig_buffer[lb:lb + first] = lsig[:first]
+        self.l_sig_buffer[:n - first] = lsig[first:]
+        self.r_sig_buffer[lb:lb + first] = rsig[:first]
+        self.r_sig_buffer[:n - first] = rsig[first:]
+        self.w_idx = (self.w_idx + n) % self.max_capture_len
+        self.end_frame = frame_offset + n
+
+        if envelope is None:
+            envelope = self.demod.envelope(np.stack([lsig, rsig], axis=1).astype(float))
+        self.detector.do_capture = self.do_capture
+        self.detector.process(envelope[:, 0], envelope[:, 1], frame_offset=frame_offset//self.decimation)
+        while self.detector.capture_ready:
+            self.add_capture(self.detector.get_next_capture())
+
+    def get_segment(self, start, stop):
+        '''
+        raw samples of both channels between the given frame indices from the ring buffer
+        '''
+        idx = (self.w_idx - (self.end_frame - np.arange(start, stop))) % self.max_capture_len
+        return self.l_sig_buffer[idx], self.r_sig_buffer[idx]
+
+    def add_capture(self, detected):
+        '''
+        rebuild a capture found on the envelope from the full rate samples
+        '''
+        from scipy import signal
+        self.n_captures += 1
+        D = self.decimation
+        W = self.window_len
+        start = max(0, detected[-1][0]*D - self.group_delay)
+        stop = detected[-1][1]*D - self.group_delay
+        onset = start + detected.stats.onset*W
+        # the segment starts on a window boundary of the sound so its windows line up with the detected ones
+        lb = start + max(0, onset - self.pre_roll - start)//W*W
+        ub = min(stop, lb + self.segment_len)
+        pad = self.padding
+        # the segment can't reach further back than the ring buffer or the start of the signal
+        seg_start = max(lb - pad - self.warmup, self.end_frame - self.max_capture_len, 0)
+        seg_stop = min(ub + pad, self.end_frame)
+        l_raw, r_raw = self.get_segment(seg_start, seg_stop)
+        filtered = signal.lfilter(self.b, self.a, np.stack([l_raw, r_raw], axis=1), axis=0)
+        filtered = filtered[max(0, lb - pad - seg_start):]
+        l_signal, r_signal = filtered[:, 0], filtered[:, 1]
+
+        # statistics of the whole sound, as SignalCapture collects them. the windows inside the segment come from
+        # the full rate samples, the ones outside it from the envelope windows the sound was detected on, which
+        # have the same length in time and the same power scale. padding is only counted where the segment
+        # reaches the start or end of the sound
+        stats = CaptureStats(W)
+        offset = min(pad, lb - seg_start)
+        l_core, r_core = l_signal[offset:offset + (ub - lb)], r_signal[offset:offset + (ub - lb)]
+        first = (lb - start)//W
+        # only the length of the blocks is used when the rms and peaks are given
+        blank = np.zeros(W)
+        for k in range(detected.stats.n_windows):
+            i = (k - first)*W
+            if 0 <= i < len(l_core):
+                lblock, rblock = l_core[i:i + W], r_core[i:i + W]
+                stats.add_window(lblock, rblock, get_rms(lblock), get_rms(rblock))
+            else:
+                lrms, rrms = detected.stats.l_window_rms[k], detected.stats.r_window_rms[k]
+                stats.add_window(blank, blank, lrms, rrms, 0., 0.)
+        if lb == start:
+            stats.add_samples(l_signal[:offset], r_signal[:offset])
+        if ub == stop:
+            stats.add_samples(l_signal[offset + len(l_core):], r_signal[offset + len(l_core):])
+        # index of the sound's first window in the samples, negative if the segment starts after it
+        stats.offset = offset - (lb - start)
+
+        if (self.gate is not None) and (not self.gate(stats)):
+            self.n_rejected += 1
+            return
+        self.caps.append(Capture([l_signal, r_signal, (start, stop)], stats=stats, Fs=self.Fs))
+        self.capture_ready = True
+        if self.use_lock:
+            self.condition.notify()
+
+
+def get_signal_capture(Fs, use_lock=True, front_end=None):
+    '''
+    signal capture object for the configured front end (config["front_end"]) using the configured capture
+    settings and gate. with the "multirate" front end the capture takes the unfiltered signal
+    '''
+    if front_end is None:
+        front_end = config["front_end"]
+    args = (config["sig_cap_window_len"], config["sig_cap_power"], config["max_sig_buffer_len"])
+    if front_end == "multirate":
+        return MultirateSignalCapture(*args, Fs, use_lock=use_lock, gate=get_capture_gate())
+    if front_end == "full":
+        return SignalCapture(*args, use_lock=use_lock, gate=get_capture_gate(), Fs=Fs)
+    raise ValueError(f"unknown front end {front_end}, expected full or multirate")
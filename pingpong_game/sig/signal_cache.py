@@ -0,0 +1,311 @@
+'''
+    on-disk cache of filtered signals and rms envelopes. the offline tools (preprocess_signal, the plotter, the
+    spectral analysis scripts) all load the same wave files and run the same bandpass filter over them on every run.
+    this module stores the filtered channels keyed by a hash of the file contents plus the filter parameters, so
+    repeated runs just memory-map the arrays from disk instead of re-filtering. the per-window rms envelope of the
+    filtered channels is stored in the same entry, one array per window length, and added the first time it is
+    asked for.
+
+    each cache entry is a directory containing lch.npy, rch.npy, one rms_<window_len>.npy per window length and
+    meta.json. entries are evicted least-recently-used first whenever the total size of the cache goes over the
+    configured budget.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from pingpong_game.config import config
+from pingpong_game.sig.kernels import window_stats
+from pingpong_game.sig.signal_tools import get_pingpong_filter, load_signal
+
+
+# bumped whenever the layout of an entry or the way the arrays are computed changes
+CACHE_VERSION = 3
+
+
+def file_hash(fname, chunk_size=1 << 20):
+    '''
+    return the sha1 hex digest of the contents of the given file, read in chunks
+    so that long recordings don't have to be held in memory
+    '''
+    h = hashlib.sha1()
+    with open(fname, "rb") as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(chunk_size)
+    return h.hexdigest()
+
+
+class SignalCache:
+    '''
+    content-addressed cache of filtered signals stored under cache_dir
+    '''
+    def __init__(self, cache_dir=None, max_bytes=None):
+        if cache_dir is None:
+            cache_dir = config["signal_cache_dir"]
+        if max_bytes is None:
+            max_bytes = config["signal_cache_max_bytes"]
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # file hashes are remembered by (path, size, mtime) so unchanged files are only hashed once
+        self.hash_index_fname = os.path.join(self.cache_dir, "hashes.json")
+        self.lock = threading.Lock()
+
+    def _load_hash_index(self):
+        try:
+            with open(self.hash_index_fname) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get_file_hash(self, fname):
+        '''
+        return the content hash of fname, reusing the stored hash if the file hasn't changed
+        '''
+        path = os.path.abspath(fname)
+        st = os.stat(path)
+        with self.lock:
+            index = self._load_hash_index()
+            entry = index.get(path)
+            if (entry is not None) and (entry["size"] == st.st_size) and (entry["mtime_ns"] == st.st_mtime_ns):
+                return entry["sha1"]
+            digest = file_hash(path)
+            index[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": digest}
+            tmp_fname = f"{self.hash_index_fname}.{os.getpid()}.tmp"
+            with open(tmp_fname, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_fname, self.hash_index_fname)
+        return digest
+
+    def get_key(self, fname, params):
+        '''
+        cache key for a file and a dict of processing parameters
+        '''
+        params = dict(params, version=CACHE_VERSION)
+        param_str = json.dumps(params, sort_keys=True)
+        h = hashlib.sha1(self.get_file_hash(fname).encode())
+        h.update(param_str.encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        '''
+        return the cached entry as a dict of memory-mapped arrays, or None if the key isn't cached
+        reading an entry marks it as recently used
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_fname = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_fname) as f:
+                meta = json.load(f)
+            entry = {
+                name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r")
+                for name in meta["arrays"]
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+        # the meta file's mtime is used as the last access time for lru eviction
+        os.utime(meta_fname)
+        entry["meta"] = meta
+        return entry
+
+    def put(self, key, arrays, meta=None):
+        '''
+        write the given arrays to the cache under key. the entry is written to a temporary directory
+        and moved into place so that concurrent readers never see a partially written entry
+        '''
+        meta = dict(meta or {}, arrays=sorted(arrays))
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), arr)
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            entry_dir = os.path.join(self.cache_dir, key)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # another process already wrote this entry, keep theirs
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def add(self, key, arrays):
+        '''
+        add arrays to an existing entry. each array is written to a temporary file and moved into place before
+        the meta file lists it, so readers only ever see complete arrays. returns False if the entry is gone
+        '''
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_fname = os.path.join(entry_dir, "meta.json")
+        tmp_fnames = []
+        try:
+            for name, arr in arrays.items():
+                tmp_fname = os.path.join(entry_dir, f".tmp-{os.getpid()}-{name}.npy")
+                tmp_fnames.append(tmp_fname)
+                np.save(tmp_fname, arr)
+                os.replace(tmp_fname, os.path.join(entry_dir, f"{name}.npy"))
+            with open(meta_fname) as f:
+                meta = json.load(f)
+            meta["arrays"] = sorted(set(meta["arrays"]) | set(arrays))
+            tmp_fname = f"{meta_fname}.{os.getpid()}.tmp"
+            tmp_fnames.append(tmp_fname)
+            with open(tmp_fname, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_fname, meta_fname)
+        except (OSError, ValueError, KeyError):
+            # the entry was evicted or cleared in the meantime
+            for tmp_fname in tmp_fnames:
+                if os.path.exists(tmp_fname):
+                    os.remove(tmp_fname)
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        '''
+        return a list of (last_access_time, size_in_bytes, entry_dir) for every complete entry
+        '''
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_fname = os.path.join(entry_dir, "meta.json")
+            if name.startswith(".") or not os.path.isfile(meta_fname):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir)
+            )
+            result.append((os.path.getmtime(meta_fname), size, entry_dir))
+        return result
+
+    def evict(self):
+        '''
+        remove least recently used entries until the cache fits in max_bytes
+        '''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while (total > self.max_bytes) and (len(entries) > 0):
+            _, size, entry_dir = entries.pop(0)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, entry_dir in self.entries():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    '''
+    return the process-wide cache using the locations in the config file
+    '''
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SignalCache()
+    return _default_cache
+
+
+def _load_filtered_signal(fname, low, high, K, polarity, use_cache):
+    '''
+    returns [lch, rch, Fs, key] where key is the cache key of the entry holding the filtered signal,
+    or None if the cache isn't used
+    '''
+    if low is None:
+        low = config["filter_low_thresh"]
+    if high is None:
+        high = config["filter_high_thresh"]
+    if polarity is None:
+        polarity = config["polarity"]
+    if use_cache is None:
+        use_cache = config["signal_cache_enabled"]
+    params = {
+        "low": low,
+        "high": high,
+        "K": K,
+        "filt_type": "cheby",
+        "polarity": polarity,
+    }
+
+    key = None
+    if use_cache:
+        cache = get_default_cache()
+        key = cache.get_key(fname, params)
+        entry = cache.get(key)
+        if entry is not None:
+            return [entry["lch"], entry["rch"], entry["meta"]["fs"], key]
+
+    # scipy.signal is only imported on a cache miss, a cache hit never needs it
+    from scipy import signal
+    [lch, rch, Fs] = load_signal(fname)
+    rch = rch*polarity
+    [b,a] = get_pingpong_filter(low=low, high=high, Fs=Fs, K=K)
+    lch = signal.lfilter(b,a,lch)
+    rch = signal.lfilter(b,a,rch)
+
+    if use_cache:
+        cache.put(key, {"lch": lch, "rch": rch}, meta=dict(params, fs=Fs, fname=os.path.abspath(fname)))
+    return [lch, rch, Fs, key]
+
+
+def load_filtered_signal(fname, low=None, high=None, K=6, polarity=None, use_cache=None):
+    '''
+    load a two channel wave file, apply the polarity to the right channel and run both channels through
+    the ping pong bandpass filter. returns [lch, rch, Fs].
+    results come from the on-disk cache when possible, in which case the arrays are read-only memory maps
+    '''
+    [lch, rch, Fs, _] = _load_filtered_signal(fname, low, high, K, polarity, use_cache)
+    return [lch, rch, Fs]
+
+
+def load_rms_envelope(fname, window_len=None, low=None, high=None, K=6, polarity=None, use_cache=None):
+    '''
+    rms of each full window of length window_len of the filtered channels (see load_filtered_signal), returns
+    an array of shape (n_windows, 2). the rms is computed from the int32 signal with kernels.window_stats, the
+    same way SignalCapture.process does, so the values are identical to the ones the signal capture sees.
+    the envelope is stored next to the filtered signal in its cache entry, as rms_<window_len>.npy
+    '''
+    if window_len is None:
+        window_len = config["sig_cap_window_len"]
+    window_len = int(window_len)
+    [lch, rch, _, key] = _load_filtered_signal(fname, low, high, K, polarity, use_cache)
+    name = f"rms_{window_len}"
+    if key is not None:
+        cache = get_default_cache()
+        entry = cache.get(key)
+        if (entry is not None) and (name in entry):
+            return entry[name]
+
+    [lrms, rrms, _, _] = window_stats(
+        np.asarray(lch).astype(np.int32), np.asarray(rch).astype(np.int32), window_len,
+    )
+    env = np.stack((lrms, rrms), axis=1)
+    if key is not None:
+        cache.add(key, {name: env})
+    return env
+
+
+if __name__ == "__main__":
+    '''
+    print the contents of the cache or clear it
+    usage: python -m pingpong_game.sig.signal_cache [clear]
+    '''
+    import sys
+    cache = get_default_cache()
+    if (len(sys.argv) > 1) and (sys.argv[1] == "clear"):
+        cache.clear()
+    total = 0
+    for atime, size, entry_dir in sorted(cache.entries(), reverse=True):
+        total += size
+        with open(os.path.join(entry_dir, "meta.json")) as f:
+            meta = json.load(f)
+        print(f"{os.path.basename(entry_dir)[:12]} {size/1e6:8.1f} MB {meta.get('fname')}")
+    print(f"total: {total/1e6:.1f} MB of {cache.max_bytes/1e6:.1f} MB")
@@ -10,23 +10,163 @@
 import json
 import logging
 import numpy as np
-from scipy import signal
 from threading import Condition
 
 from pingpong_game.config import config
+from pingpong_game.sig.kernels import window_stats
+from pingpong_game.sig.signal_cache import load_filtered_signal, load_rms_envelope
+from pingpong_game.sig.spectrum import CaptureSpectrum
 from pingpong_game.sig.signal_tools import (
     get_angle_from_sound,
-    get_pingpong_filter,
-    get_rms,
-    load_signal,
 )
 
 
 log = logging.getLogger()
 
 
+class CaptureStats:
+    '''
+    running statistics of a capture, collected one window at a time while the capture is in progress and
+    attached to the finished capture (see Capture). they are built from the window rms values that process
+    already computes, so the rms and other features of a capture are available without another pass over
+    its samples:
+        l_sum_sq, r_sum_sq      sum of squares of each channel
+        l_peak, r_peak          largest absolute sample of each channel
+        envelope                rms of each window of the capture, shape (n_windows, 2)
+        onset                   index of the window with the largest rise in energy over the window before it,
+                                onset_idx is the sample index of that window in the capture
+        n_windows               number of windows above the power threshold, i.e. the duration of the sound
+    the padding added on either side of a capture counts towards the sums of squares and peaks but isn't
+    part of the envelope. captures of the multirate front end only hold a segment of the sound's samples,
+    their statistics still cover the whole sound (see sig/multirate.py)
+    '''
+    def __init__(self, window_len):
+        self.window_len = window_len
+        # index in the finished capture of the first window, i.e. the padding before it
+        self.offset = 0
+        self.l_sum_sq = 0.
+        self.r_sum_sq = 0.
+        self.n_samples = 0
+        self.l_peak = 0.
+        self.r_peak = 0.
+        self.l_window_rms = []
+        self.r_window_rms = []
+        self.onset = 0
+        self.max_rise = 0.
+
+    def add_window(self, lblock, rblock, lrms, rrms, lpeak=None, rpeak=None):
+        n = len(lblock)
+        self.l_sum_sq += lrms**2 * n
+        self.r_sum_sq += rrms**2 * n
+        self.n_samples += n
+        # the peaks are computed here unless the caller already has them
+        if lpeak is None:
+            lpeak = np.abs(lblock).max()
+        if rpeak is None:
+            rpeak = np.abs(rblock).max()
+        self.l_peak = max(self.l_peak, float(lpeak))
+        self.r_peak = max(self.r_peak, float(rpeak))
+        # the energy of the first window is compared to silence
+        energy = lrms**2 + rrms**2
+        prev_energy = (self.l_window_rms[-1]**2 + self.r_window_rms[-1]**2) if self.l_window_rms else 0.
+        if energy - prev_energy > self.max_rise:
+            self.max_rise = energy - prev_energy
+            self.onset = len(self.l_window_rms)
+        self.l_window_rms.append(lrms)
+        self.r_window_rms.append(rrms)
+
+    def add_samples(self, lsig, rsig):
+        '''
+        add samples that weren't part of a window, i.e. the padding on either side of the capture
+        '''
+        self.l_sum_sq += float(np.dot(lsig, lsig))
+        self.r_sum_sq += float(np.dot(rsig, rsig))
+        self.n_samples += len(lsig)
+        if len(lsig) > 0:
+            self.l_peak = max(self.l_peak, float(np.abs(lsig).max()))
+            self.r_peak = max(self.r_peak, float(np.abs(rsig).max()))
+
+    @property
+    def onset_idx(self):
+        # sample index of the onset window in the finished capture
+        return self.offset + self.onset*self.window_len
+
+    @property
+    def n_windows(self):
+        return len(self.l_window_rms)
+
+    @property
+    def envelope(self):
+        return np.array([self.l_window_rms, self.r_window_rms]).T
+
+    @property
+    def l_rms(self):
+        return np.sqrt(self.l_sum_sq/self.n_samples)
+
+    @property
+    def r_rms(self):
+        return np.sqrt(self.r_sum_sq/self.n_samples)
+
+    @property
+    def mean_rms(self):
+        # same as the mean of get_rms over both channels of the finished capture
+        return (self.l_rms + self.r_rms)/2
+
+
+class Capture(list):
+    '''
+    a finished capture, the list [left_signal, right_signal, (start_idx, stop_idx)] used throughout the code
+    with the statistics collected while it was captured attached as stats and its spectrum as spectrum.
+    Fs is the sample rate of the signals, config["fs"] if not given
+    '''
+    def __init__(self, items, stats=None, Fs=None):
+        super().__init__(items)
+        self.stats = stats
+        self.Fs = Fs
+        self._spectrum = None
+
+    @property
+    def spectrum(self):
+        # computed on first use and shared by everything that needs it, see sig/spectrum.py
+        if self._spectrum is None:
+            self._spectrum = CaptureSpectrum(self[0], self[1], Fs=self.Fs)
+        return self._spectrum
+
+
+class PowerGate:
+    '''
+    capture gate which only accepts captures with a high enough mean rms between the channels,
+    the same check the game used to do on every capture it was woken for
+    '''
+    def __init__(self, min_power=None):
+        if min_power is None:
+            min_power = config["mean_signal_power_min"]
+        self.min_power = min_power
+
+    def __call__(self, stats):
+        return stats.mean_rms > self.min_power
+
+
+# gates that can be selected with config["capture_gate"]. a gate is any callable that takes the
+# CaptureStats of a finished capture and returns True if the capture should be passed on to the game
+capture_gates = {
+    "power": PowerGate,
+}
+
+
+def get_capture_gate(name=None):
+    '''
+    return the capture gate configured in the config file, or None if gating is turned off
+    '''
+    if name is None:
+        name = config["capture_gate"]
+    if name is None:
+        return None
+    return capture_gates[name]()
+
+
 class SignalCapture:
-    def __init__(self, window_len, power_thresh, max_capture_len, padding=50, use_lock=True):
+    def __init__(self, window_len, power_thresh, max_capture_len, padding=50, use_lock=True, gate=None, Fs=None):
         # smallest window length for each block - typically .01 seconds
         self.window_len = int(window_len)
         # max capture length - used as the size of the circular buffer used to record the incoming signal
@@ -69,6 +209,19 @@ class SignalCapture:
         # perform a capture on incoming signal. sometimes will be set to False by consumer
         # when audio data should be ignored
         self.do_capture = True
+        # optional gate (see capture_gates) deciding which finished captures are passed on to the consumer.
+        # rejected captures are only counted, the consumer is never woken up for them
+        self.gate = gate
+        self.stats = None
+        # sample rate of the signal, passed on to the captures (config["fs"] if None)
+        self.Fs = Fs
+        self.n_captures = 0
+        self.n_rejected = 0
+
+    @property
+    def is_capturing(self):
+        # True while a sound has started and not finished yet
+        return self.capturing_signal
 
     def clear_captures(self):
         '''
@@ -101,6 +254,20 @@ class SignalCapture:
         with open(fname, 'w') as f:
             f.write(json.dumps(all_caps, indent=4))
 
+    def skip(self, lsig, rsig):
+        '''
+        copies samples into the circular buffers without checking them. only valid outside of a capture for a
+        whole number of windows that are all below the power threshold, where process would do nothing but copy
+        them. used by preprocess_signal to pass over the quiet parts of a recording using the cached rms envelope
+        '''
+        n = len(lsig)
+        # only the last max_capture_len samples can still end up in the padding of a capture
+        keep = min(n, self.max_capture_len)
+        idx = (self.w_idx + n - keep + np.arange(keep)) % self.max_capture_len
+        self.l_sig_buffer[idx] = np.asarray(lsig[n - keep:]).astype(np.int32)
+        self.r_sig_buffer[idx] = np.asarray(rsig[n - keep:]).astype(np.int32)
+        self.w_idx = (self.w_idx + n) % self.max_capture_len
+
     def process(self, lsig, rsig, frame_offset=0):
         '''
         iterates over both incoming signals checking if each block has high enough power
@@ -121,6 +288,10 @@ class SignalCapture:
         self.l_sig_buffer[lb:ub] = lsig.copy()
         self.r_sig_buffer[lb:ub] = rsig.copy()
 
+        # rms and peak of every window in the block, computed up front in one go (compiled if available,
+        # see sig/kernels.py) instead of a few numpy calls per window inside the loop
+        [lrms_all, rrms_all, lpeak_all, rpeak_all] = window_stats(lsig, rsig, self.window_len)
+
         # iterate through blocks of size window_len, checking if each block has enough power
         for i in range(int(block_len/self.window_len)):
             block_lb, block_ub = i*self.window_len, (i+1)*self.window_len
@@ -131,8 +302,8 @@ class SignalCapture:
             stop_cap = False
 
             # get the rms of each block
-            lrms = get_rms(lblock)
-            rrms = get_rms(rblock)
+            lrms = lrms_all[i]
+            rrms = rrms_all[i]
 
             # get the minimum rms allowable
             min_rms = self.power_thresh
@@ -142,6 +313,7 @@ class SignalCapture:
                 # if we are already capturing a signal
                 # add this block's index to the upper bound of the capture
                 if self.capturing_signal:
+                    self.stats.add_window(lblock, rblock, lrms, rrms, lpeak_all[i], rpeak_all[i])
                     self.max_idx = self.w_idx + block_ub
                     self.signal_stop_idx = frame_offset + block_ub
                     cap_len = self.max_idx - self.min_idx
@@ -158,6 +330,8 @@ class SignalCapture:
                     self.max_idx = self.w_idx + block_ub
                     self.signal_start_idx = frame_offset + block_lb
                     self.signal_stop_idx = frame_offset + block_ub
+                    self.stats = CaptureStats(self.window_len)
+                    self.stats.add_window(lblock, rblock, lrms, rrms, lpeak_all[i], rpeak_all[i])
                     # set the currently capturing flag to True
                     self.capturing_signal = True
                     log.debug(f"starting signal capture at index {self.signal_start_idx}")
@@ -189,14 +363,32 @@ class SignalCapture:
                     l_signal = self.l_sig_buffer[lb_idx:ub_idx]
                     r_signal = self.r_sig_buffer[lb_idx:ub_idx]
                 # if we the consumer has indicated that we should do a capture, add the capture
-                # to the list of captures and set the capture ready flag
+                # to the list of captures and set the capture ready flag, unless the gate rejects it
+                accepted = self.do_capture
                 if self.do_capture:
+                    self.n_captures += 1
+                    # the padding is part of the capture too, so the stats cover exactly the captured signal
+                    pad = self.padding
+                    self.stats.offset = pad
+                    if pad > 0:
+                        self.stats.add_samples(l_signal[:pad], r_signal[:pad])
+                        self.stats.add_samples(l_signal[-pad:], r_signal[-pad:])
+                if self.do_capture and (self.gate is not None):
+                    accepted = self.gate(self.stats)
+                    if not accepted:
+                        self.n_rejected += 1
+                        log.debug(f"capture rejected: {self.signal_start_idx}, {self.signal_stop_idx}")
+                if accepted:
                     self.caps.append(
-                        [
-                            l_signal.copy(),
-                            r_signal.copy(),
-                            (self.signal_start_idx, self.signal_stop_idx),
-                        ]
+                        Capture(
+                            [
+                                l_signal.copy(),
+                                r_signal.copy(),
+                                (self.signal_start_idx, self.signal_stop_idx),
+                            ],
+                            stats=self.stats,
+                            Fs=self.Fs,
+                        )
                     )
                     self.capture_ready = True
                     # if the consumer is using the semaphore mechanism, notify
@@ -208,43 +400,62 @@ class SignalCapture:
                 self.max_idx = 0
                 self.signal_start_idx = 0
                 self.signal_stop_idx = 0
+                self.stats = None
         # update circular buffer index
         self.w_idx = (self.w_idx + block_len) % self.max_capture_len
 
 
-def preprocess_signal(fname, power=50, window_len=.01*48_000):
+def preprocess_signal(fname, power=50, window_len=.01*48_000, use_cache=None, low=None, high=None):
     '''
     preprocess a signal loaded from a wave file. this code runs the signal capture processoer
     as if the signal was being processed in real time. it is used for debugging, testing and validation
+    the filtered signal and its rms envelope are read from the on-disk signal cache when available, see
+    sig/signal_cache.py. runs of quiet windows between captures are copied into the buffers in one go
+    instead of being processed window by window, which gives the same captures
+    low and high are the filter band, filter_low_thresh and filter_high_thresh from the config file by default
     '''
-    [lch, rch, Fs] = load_signal(fname)
-    rch = rch*config["polarity"]
-
     # filter each signal before processing
-    filter_low_thresh = config["filter_low_thresh"]
-    filter_high_thresh = config["filter_high_thresh"]
-    K = 6
-    [b,a] = get_pingpong_filter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
-    lch = signal.lfilter(b,a,lch)
-    rch = signal.lfilter(b,a,rch)
+    filter_params = dict(
+        low=config["filter_low_thresh"] if low is None else low,
+        high=config["filter_high_thresh"] if high is None else high,
+        K=6,
+        polarity=config["polarity"],
+        use_cache=use_cache,
+    )
+    [lch, rch, Fs] = load_filtered_signal(fname, **filter_params)
+    env = load_rms_envelope(fname, window_len, **filter_params)
 
     sig_cap = SignalCapture(
         window_len=window_len,
         power_thresh=power,
         max_capture_len=5*Fs,
         use_lock=False,
+        Fs=Fs,
     )
 
     # iterate over blocks of size window_len and process the input
-    sig_cap.Fs = Fs
+    sig_cap.n_samples = len(lch)
     block_len = int(1*window_len)
-    for i in range(int(len(lch)/block_len)):
+    n_blocks = int(len(lch)/block_len)
+    # windows loud enough to start or continue a capture, as checked by process
+    loud = (env[:n_blocks] > power).any(axis=1)
+    loud_idx = np.flatnonzero(loud)
+    i = 0
+    while i < n_blocks:
         frame_offset = i*block_len
-        sig_cap.process(
-            lch[i*block_len : (i+1)*block_len],
-            rch[i*block_len : (i+1)*block_len],
-            frame_offset=frame_offset,
-        )
+        if sig_cap.capturing_signal or loud[i]:
+            sig_cap.process(
+                lch[i*block_len : (i+1)*block_len],
+                rch[i*block_len : (i+1)*block_len],
+                frame_offset=frame_offset,
+            )
+            i += 1
+        else:
+            # quiet windows outside a capture, up to the next loud one
+            k = np.searchsorted(loud_idx, i)
+            j = int(loud_idx[k]) if k < len(loud_idx) else n_blocks
+            sig_cap.skip(lch[i*block_len : j*block_len], rch[i*block_len : j*block_len])
+            i = j
     return sig_cap
 
 
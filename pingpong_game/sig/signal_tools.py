@@ -1,17 +1,30 @@
 from math import asin, acos, degrees
 import numpy as np
-from pyaudio import PyAudio
-from scipy import signal
+import os
 import struct
 import time
 import wave
 
+from pingpong_game.config import config
+from pingpong_game.sig import kernels
+from pingpong_game.sig.spectrum import CaptureSpectrum
+
 
 def beamformer_time_delay(sig1, sig2, max_delay):
     """
     uses a simple time delay beamformer to estimate the delay
     between signal 2 and signal 1. if signal 2 is delayed the
     result will be positive
+    the compiled version of the search is used when available, see sig/kernels.py
+    """
+    if kernels.beamformer_time_delay is not None:
+        return kernels.beamformer_time_delay(sig1, sig2, max_delay)
+    return beamformer_time_delay_numpy(sig1, sig2, max_delay)
+
+
+def beamformer_time_delay_numpy(sig1, sig2, max_delay):
+    """
+    numpy version of beamformer_time_delay
     """
     rms_max = 0
     delay_max = None
@@ -40,6 +53,7 @@ def estimate_delay_cross_corr(sig1, sig2, delay_max):
     the signals are aligned. if this value is greater than the midpoint that indicates the right
     channel is delayed, otherwise the left the estimated delay time is the delay in samples / sample rate
     '''
+    from scipy import signal
     mid_point = int(len(sig1)/2)
     corr = signal.correlate(sig1, sig2, 'same')
     # to get better results we only look at results within +- delay_max of the midpoint
@@ -50,11 +64,78 @@ def estimate_delay_cross_corr(sig1, sig2, delay_max):
     return est_delay
 
 
+def estimate_delay_gcc(sig1, sig2, delay_max):
+    '''
+    generalized cross correlation (phase transform) of the two channels computed from their spectrum,
+    see CaptureSpectrum.gcc_delay. a positive delay means signal 2 is delayed
+    '''
+    return CaptureSpectrum(sig1, sig2).gcc_delay(delay_max)
+
+
 technique_funcs = {
     "xcorr": estimate_delay_cross_corr,
     "beamforming": beamformer_time_delay,
+    "gcc": estimate_delay_gcc,
 }
 
+
+def get_delay_confidence(sig1, sig2, delay):
+    '''
+    normalized correlation between the two signals once aligned by the given delay (same convention as
+    beamformer_time_delay, a positive delay means signal 2 is delayed). close to 1 when both mics heard
+    the same sound and the delay is right, lower when the signals are dominated by noise or reverb
+    '''
+    if delay is None:
+        return 0.
+    n = len(sig1)
+    if delay > 0:
+        ref, shift = sig1[:n-delay], sig2[delay:]
+    else:
+        D = np.abs(delay)
+        ref, shift = sig2[:n-D], sig1[D:]
+    ref = np.asarray(ref, dtype=float)
+    shift = np.asarray(shift, dtype=float)
+    norm = np.sqrt(np.dot(ref, ref) * np.dot(shift, shift))
+    if norm == 0:
+        return 0.
+    return float(np.dot(ref, shift) / norm)
+
+
+def get_onset_window(n, onset_idx, pre_roll, window_len):
+    '''
+    bounds of a window_len long window starting pre_roll samples before the onset, moved back inside
+    the signal of length n if needed
+    '''
+    ub = min(n, max(0, onset_idx - pre_roll) + window_len)
+    lb = max(0, ub - window_len)
+    return lb, ub
+
+
+def estimate_delay_at_onset(sig1, sig2, delay_max, onset_idx=None, technique="beamforming",
+                            pre_roll=None, window_len=None, min_confidence=None):
+    '''
+    estimate the delay from a fixed length window around the onset of a sound instead of the whole capture,
+    which can be up to the max capture length and include reverb and follow up sounds. this keeps the cost of
+    each estimate constant. if the signals in the window don't line up well (see get_delay_confidence) the
+    whole capture is used instead. returns (delay, confidence, used_full_capture)
+    the window defaults are set in the config file
+    '''
+    if pre_roll is None:
+        pre_roll = config["onset_pre_roll"]
+    if window_len is None:
+        window_len = config["onset_window_len"]
+    if min_confidence is None:
+        min_confidence = config["onset_min_confidence"]
+    func = technique_funcs[technique]
+    if (onset_idx is not None) and (len(sig1) > window_len):
+        lb, ub = get_onset_window(len(sig1), onset_idx, pre_roll, window_len)
+        delay = func(sig1[lb:ub], sig2[lb:ub], delay_max)
+        confidence = get_delay_confidence(sig1[lb:ub], sig2[lb:ub], delay)
+        if confidence >= min_confidence:
+            return delay, confidence, False
+    delay = func(sig1, sig2, delay_max)
+    return delay, get_delay_confidence(sig1, sig2, delay), True
+
 def get_angle_from_sound(sig1, sig2, delay_max, technique="xcorr"):
     '''
     get the angle of the incoming sound by estimated the delay using the specified technique
@@ -85,6 +166,8 @@ def get_pingpong_filter(low, high, Fs, K=6, filt_type="cheby"):
     return the desired bandpass filter to be used (8000, 10000) does a good job of only
     passing ping pong sounds
     '''
+    # scipy.signal is slow to import so it is only loaded once filtering is actually needed
+    from scipy import signal
     fcl = 2 * (low/Fs) # usually 8,000
     fch = 2 * (high/Fs) # usually 10,000
     fc = [fcl, fch]
@@ -102,6 +185,7 @@ def get_polarity(sig1, sig2):
     will have signals with flipped signs, this tells the code if it needs to
     reverse this
     '''
+    from scipy import signal
     # see documentation for why this is expected to work in general
     opp_sign_max = signal.correlate(sig1, -1*sig2, 'valid')
     same_sign_max = signal.correlate(sig1, sig2, 'valid')
@@ -134,30 +218,155 @@ def load_signal(fname, split_channels=True):
         raise ValueError('not implemented')
 
 
+def memmap_signal(fname):
+    '''
+    memory map the samples of a 16 bit wave file instead of reading them, for slicing short snippets out of long
+    recordings. returns [frames, Fs] where frames is a read-only array of shape (n_frames, n_channels)
+    '''
+    with open(fname, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if (riff != b"RIFF") or (wave_id != b"WAVE"):
+            raise ValueError(f"{fname} is not a wave file")
+        n_channels = Fs = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{fname} has no data chunk")
+            chunk_id, chunk_len = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_len)
+                [_, n_channels, Fs, _, _, bits] = struct.unpack("<HHIIHH", fmt[:16])
+                if bits != 16:
+                    raise ValueError("not implemented")
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_len, 1)
+            # chunks are padded to an even length
+            if chunk_len % 2:
+                f.seek(1, 1)
+    n_frames = chunk_len // (2*n_channels)
+    # a recording that was cut off may have a data chunk longer than the file
+    n_frames = min(n_frames, (os.path.getsize(fname) - offset) // (2*n_channels))
+    frames = np.memmap(fname, dtype=np.int16, mode="r", offset=offset, shape=(n_frames, n_channels))
+    return [frames, Fs]
+
+
+class PingPongFilter:
+    '''
+    stateful version of the ping pong bandpass filter used when a signal arrives one block at a time.
+    the filter state for each channel is carried over from one block to the next. all channels are
+    filtered in a single vectorized lfilter call
+    '''
+    def __init__(self, low, high, Fs, K=6, n_channels=2, filt_type="cheby"):
+        [self.b, self.a] = get_pingpong_filter(low=low, high=high, Fs=Fs, K=K, filt_type=filt_type)
+        self.n_channels = n_channels
+        # one column of filter state per channel
+        self.states = np.zeros((max(len(self.a), len(self.b)) - 1, n_channels))
+
+    def filter_block(self, block):
+        '''
+        filter the next block of all channels at once. block has shape (n_frames, n_channels),
+        e.g. an interleaved multichannel stream reshaped with block.reshape(-1, n_channels)
+        '''
+        from scipy import signal
+        [y, self.states] = signal.lfilter(self.b, self.a, block, axis=0, zi=self.states)
+        return y
+
+    def filter(self, *channels):
+        '''
+        filter the next block of each channel, returns the filtered blocks in the same order
+        '''
+        y = self.filter_block(np.stack(channels, axis=1))
+        return [y[:, i] for i in range(len(channels))]
+
+    def reset(self):
+        self.states = np.zeros_like(self.states)
+
+
 class StreamSignal:
     '''
-    helper class to read in blocks from a two channel input stream
+    helper class to read in blocks from a multichannel input stream, two channels by default
+    the audio device is only opened on the first read (or an explicit call to open) so that
+    constructing the object doesn't require pyaudio or an input device to be present
     '''
-    def __init__(self, frames_per_buffer=256):
-        self.rate = 48_000
+    def __init__(self, frames_per_buffer=256, channels=2, rate=48_000):
+        self.rate = rate
+        self.channels = channels
         self.frames_per_buffer = frames_per_buffer
+        self.pa = None
+        self.stream = None
 
+    def open(self, callback=None):
+        '''
+        open the input device. if a callback is given the stream runs in callback mode instead of being read,
+        the callback is called from the audio thread with each buffer of interleaved samples as it arrives
+        '''
+        # imported here so that the offline and analysis code never loads portaudio
+        from pyaudio import PyAudio, paContinue
+        stream_callback = None
+        if callback is not None:
+            def stream_callback(in_data, frame_count, time_info, status):
+                callback(np.frombuffer(in_data, dtype=np.int16))
+                return (None, paContinue)
         self.pa = PyAudio()
         self.stream = self.pa.open(
             format=self.pa.get_format_from_width(2),
-            channels=2,
+            channels=self.channels,
             rate=self.rate,
             input=True,
             output=False,
             frames_per_buffer=self.frames_per_buffer,
+            stream_callback=stream_callback,
         )
 
     def read(self, blocklen):
+        if self.stream is None:
+            self.open()
         frames_raw = self.stream.read(blocklen, exception_on_overflow=False)
         signal = np.frombuffer(frames_raw, dtype=np.int16)
         return signal
 
     def close(self):
+        if self.stream is None:
+            return
         self.stream.stop_stream()
         self.stream.close()
         self.pa.terminate()
+        self.stream = None
+        self.pa = None
+
+
+class FileSignal:
+    '''
+    reads blocks from a two channel wave file with the same interface as StreamSignal, used to
+    replay recorded games through the realtime code. done is set once the end of the file is reached.
+    with realtime set, read blocks until each block would have been recorded, like reading from the device
+    '''
+    def __init__(self, fname, realtime=False):
+        self.wf = wave.open(fname)
+        if self.wf.getnchannels() != 2:
+            self.wf.close()
+            raise ValueError('not implemented')
+        self.rate = self.wf.getframerate()
+        self.n_frames = self.wf.getnframes()
+        self.done = False
+        self.realtime = realtime
+        self.start_time = None
+        self.frames_read = 0
+
+    def read(self, blocklen):
+        frames_raw = self.wf.readframes(blocklen)
+        signal = np.frombuffer(frames_raw, dtype=np.int16)
+        if len(signal) < 2*blocklen:
+            self.done = True
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.perf_counter()
+            self.frames_read += len(signal)//2
+            time.sleep(max(0, self.start_time + self.frames_read/self.rate - time.perf_counter()))
+        return signal
+
+    def close(self):
+        self.wf.close()
@@ -0,0 +1,151 @@
+'''
+    spectrum of a capture, shared by everything that looks at the capture in the frequency domain. the rfft of
+    both channels is computed once, the first time it is needed, and the rms (parseval), band energy, spectral
+    centroid, polarity and the cross correlation (for the gcc delay estimate) are all derived from it instead
+    of each going over the samples again. captures from SignalCapture build theirs on first use of
+    Capture.spectrum.
+
+    the channels are zero padded to at least twice their length so the cross correlation from the spectrum is
+    the linear one (no wrap around), the same as scipy.signal.correlate
+'''
+from functools import cached_property
+
+import numpy as np
+
+from pingpong_game.config import config
+
+
+class CaptureSpectrum:
+    '''
+    lazily computed spectrum and spectral features of the two channels of a capture. per channel values
+    are arrays of [left, right]
+    '''
+    def __init__(self, lch, rch, Fs=None):
+        if Fs is None:
+            Fs = config["fs"]
+        self.lch = np.asarray(lch, dtype=float)
+        self.rch = np.asarray(rch, dtype=float)
+        self.Fs = Fs
+        self.n = len(self.lch)
+        from scipy import fft
+        self.nfft = fft.next_fast_len(max(2*self.n, 2), real=True)
+
+    @cached_property
+    def spectra(self):
+        '''
+        rfft of both channels, shape (2, nfft//2 + 1)
+        '''
+        from scipy import fft
+        return fft.rfft(np.stack([self.lch, self.rch]), self.nfft, axis=1)
+
+    @cached_property
+    def freqs(self):
+        return np.fft.rfftfreq(self.nfft, 1/self.Fs)
+
+    @cached_property
+    def power(self):
+        '''
+        power of each frequency bin scaled so that summing it over the bins gives the energy of the channel,
+        i.e. the bins that stand for a positive and a negative frequency count twice (parseval)
+        '''
+        power = np.abs(self.spectra)**2 / self.nfft
+        power[:, 1:(self.nfft + 1)//2] *= 2
+        return power
+
+    @cached_property
+    def energy(self):
+        # sum of squares of each channel
+        return self.power.sum(axis=1)
+
+    @property
+    def rms(self):
+        return np.sqrt(self.energy / max(self.n, 1))
+
+    @property
+    def mean_rms(self):
+        # same as the mean of get_rms over both channels
+        return float(self.rms.mean())
+
+    def band_energy(self, low=None, high=None):
+        '''
+        energy of each channel between low and high Hz, the ping pong band from the config file by default
+        '''
+        if low is None:
+            low = config["filter_low_thresh"]
+        if high is None:
+            high = config["filter_high_thresh"]
+        band = (self.freqs >= low) & (self.freqs <= high)
+        return self.power[:, band].sum(axis=1)
+
+    def band_fraction(self, low=None, high=None):
+        '''
+        fraction of each channel's energy between low and high Hz
+        '''
+        energy = self.energy
+        return np.divide(self.band_energy(low, high), energy, out=np.zeros(2), where=energy > 0)
+
+    @cached_property
+    def centroid(self):
+        '''
+        spectral centroid of each channel in Hz
+        '''
+        weighted = self.power @ self.freqs
+        return np.divide(weighted, self.energy, out=np.zeros(2), where=self.energy > 0)
+
+    @cached_property
+    def cross_spectrum(self):
+        return self.spectra[0] * np.conj(self.spectra[1])
+
+    def cross_correlation(self, max_lag, phat=False):
+        '''
+        cross correlation of the channels for lags -max_lag to max_lag, r[k] = sum(lch[n + k]*rch[n]).
+        with phat the cross spectrum is whitened first (generalized cross correlation with phase transform),
+        which sharpens the peak and makes it less sensitive to reverb. only the bins in the ping pong band are
+        kept then, whitening the rest would give the noise outside the band the same weight as the sound
+        '''
+        from scipy import fft
+        cross = self.cross_spectrum
+        if phat:
+            magnitude = np.abs(cross)
+            band = (self.freqs >= config["filter_low_thresh"]) & (self.freqs <= config["filter_high_thresh"])
+            cross = np.divide(cross, magnitude, out=np.zeros_like(cross), where=band & (magnitude > 0))
+        r = fft.irfft(cross, self.nfft)
+        return np.concatenate([r[-max_lag:], r[:max_lag + 1]]) if max_lag > 0 else r[:1]
+
+    def gcc_delay(self, delay_max, phat=True):
+        '''
+        delay between the channels from the peak of the cross correlation. same convention as the other
+        delay estimates: positive if the right channel (signal 2) is delayed
+        '''
+        r = self.cross_correlation(delay_max, phat=phat)
+        return int(delay_max - r.argmax())
+
+    @property
+    def polarity(self):
+        '''
+        same as get_polarity: -1 if the channels are anti-correlated (at zero lag), 1 otherwise
+        '''
+        # zero lag of the cross correlation from the cross spectrum, with the parseval scaling
+        dot = self.cross_spectrum.real.sum()*2 - self.cross_spectrum[0].real
+        if self.nfft % 2 == 0:
+            dot -= self.cross_spectrum[-1].real
+        return -1 if dot < 0 else 1
+
+    def features(self):
+        '''
+        json serializable summary of the spectral features, e.g. for the event log
+        '''
+        return {
+            "centroid": [round(float(c), 1) for c in self.centroid],
+            "band_fraction": [round(float(f), 3) for f in self.band_fraction()],
+        }
+
+
+def get_spectrum(signal_cap):
+    '''
+    the shared spectrum of a capture, or a new one if the capture is a plain list
+    '''
+    spectrum = getattr(signal_cap, "spectrum", None)
+    if spectrum is None:
+        spectrum = CaptureSpectrum(signal_cap[0], signal_cap[1])
+    return spectrum
@@ -4,8 +4,6 @@
     execution stops when the scoreboard quit button is pressed. two microphones are required.
 '''
 from multiprocessing import Value
-import numpy as np
-from scipy import signal
 import threading
 import wave
 
@@ -15,8 +13,8 @@ from pingpong_game.state_machine import StartState,GameState
 from pingpong_game.scoreboard import Scoreboard
 from pingpong_game.sig.signal_capture import SignalCapture
 from pingpong_game.sig.signal_tools import (
+    PingPongFilter,
     StreamSignal,
-    get_pingpong_filter,
 )
 
 Fs = config["fs"]
@@ -27,17 +25,12 @@ MAX_SIG_BUFFER_LEN = config["max_sig_buffer_len"]
 filter_low_thresh = config["filter_low_thresh"]
 filter_high_thresh = config["filter_high_thresh"]
 K = 6
-[b,a] = get_pingpong_filter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
-lch_states = np.zeros(K*2)
-rch_states = np.zeros(K*2)
 
 
-def audio_thread_func(sig, sig_cap, quit_, pause, output_file):
+def audio_thread_func(sig, sig_cap, quit_, pause, output_file, filt):
     '''
-    read next audio block and process via the SignalCapture class
+    read next audio block, filter it using the stateful bandpass filter and process via the SignalCapture class
     '''
-    global lch_states, rch_states
-
     # keep track of current index in a given channel of the audio stream
     # used for identifying the frame boundaries of a captured sound
     audio_idx = 0
@@ -47,8 +40,7 @@ def audio_thread_func(sig, sig_cap, quit_, pause, output_file):
         lch = data[::2]
         rch = data[1::2] * config["polarity"]
         # filter each channel to only detect relevant frequency band
-        [lch, lch_states] = signal.lfilter(b,a,lch,zi=lch_states)
-        [rch, rch_states] = signal.lfilter(b,a,rch,zi=rch_states)
+        [lch, rch] = filt.filter(lch, rch)
 
         # process segment to check if high power in signal
         # the signal capture class uses condition.notify to let the game
@@ -56,8 +48,8 @@ def audio_thread_func(sig, sig_cap, quit_, pause, output_file):
         sig_cap.condition.acquire()
         sig_cap.process(lch, rch, frame_offset=audio_idx)
         sig_cap.condition.release()
-        # we are tracking frame index so just offset by block length
-        audio_idx += BLOCK_LEN
+        # we are tracking frame index so just offset by the number of frames read
+        audio_idx += len(lch)
         output_file.writeframesraw(data.tobytes())
 
 
@@ -95,9 +87,11 @@ def main():
     game = Game(sig_cap, sb)
 
     # start the audio processing thread
+    # the filter is designed here instead of at import so that importing this module stays cheap
+    filt = PingPongFilter(low=filter_low_thresh, high=filter_high_thresh, Fs=Fs, K=K)
     audio_thread = threading.Thread(
         target=audio_thread_func,
-        args=(sig, sig_cap, quit_, pause, output_file),
+        args=(sig, sig_cap, quit_, pause, output_file, filt),
     )
     # start the signal waiter
     signal_waiter_thread = threading.Thread(
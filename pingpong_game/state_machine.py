@@ -36,7 +36,9 @@ class StartState:
 
 # state used when the scoreboard detects that one player has won
 class EndState:
-    def __init__(self):
+    def __init__(self, player=None):
+        # the winning player
+        self.player = player
         self.state_name = "EndState"
 
 # state used whenever an error occurs, this includes a timeout that happens
@@ -49,12 +51,26 @@ class ErrorState:
 # state machine logic used to transition from one state to the next
 # based on the input event. see documenation for details
 class GameState:
-    def __init__(self, p1, p2):
+    def __init__(self, p1, p2, event_log=None):
         self.current_player = p1
         self.other_player = p2
         self.num_consecutive_events = 0
+        # optional event log (see event_log.py) which every transition is written to
+        self.event_log = event_log
 
     def transition(self, current_state, event):
+        new_state = self._transition(current_state, event)
+        if self.event_log is not None:
+            self.event_log.log(
+                "transition",
+                prev=current_state.state_name,
+                to=new_state.state_name,
+                player=getattr(getattr(new_state, "player", None), "id", None),
+                etype=event.etype,
+            )
+        return new_state
+
+    def _transition(self, current_state, event):
         # if the new state is a different player from the previous state
         # change relevant player info and reset consecutive event counter
         if event.player.id != self.current_player.id: